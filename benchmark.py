@@ -5,6 +5,7 @@ import argparse
 import gym_minigrid
 import gym
 from gym_minigrid.wrappers import *
+from gym_minigrid.visibility import VisCache
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -13,8 +14,8 @@ parser.add_argument(
     help="gym environment to load",
     default='MiniGrid-LavaGapS7-v0'
 )
-parser.add_argument("--num_resets", default=200)
-parser.add_argument("--num_frames", default=5000)
+parser.add_argument("--num_resets", type=int, default=200)
+parser.add_argument("--num_frames", type=int, default=5000)
 args = parser.parse_args()
 
 env = gym.make(args.env_name)
@@ -39,6 +40,7 @@ frames_per_sec = args.num_frames / dt
 env = gym.make(args.env_name)
 env = RGBImgPartialObsWrapper(env)
 env = ImgObsWrapper(env)
+env.reset()
 
 # Benchmark rendering
 t0 = time.time()
@@ -51,3 +53,32 @@ agent_view_fps = args.num_frames / dt
 print('Env reset time: {:.1f} ms'.format(reset_time))
 print('Rendering FPS : {:.0f}'.format(frames_per_sec))
 print('Agent view FPS: {:.0f}'.format(agent_view_fps))
+
+# Benchmark the observation with occlusion processing, for various view sizes.
+# The agent doesn't move, so the visibility cache would answer every call
+# after the first: the shadow-casting sweep is timed with the cache off, and
+# the cache on its own, starting empty
+env = gym.make(args.env_name)
+env.unwrapped.see_through_walls = False
+for view_size in range(3, 22, 2):
+    env.unwrapped.agent_view_size = view_size
+
+    env.unwrapped.vis_cache = None
+    t0 = time.time()
+    for i in range(args.num_frames):
+        env.unwrapped.gen_obs_grid()
+    t1 = time.time()
+    dt = t1 - t0
+    vis_time = (1000000 * dt) / args.num_frames
+
+    env.unwrapped.vis_cache = VisCache()
+    t0 = time.time()
+    for i in range(args.num_frames):
+        env.unwrapped.gen_obs_grid()
+    t1 = time.time()
+    dt = t1 - t0
+    cached_time = (1000000 * dt) / args.num_frames
+    hits = env.unwrapped.vis_cache.hits
+
+    print('Obs grid time (view size {:2d}): {:.1f} us, {:.1f} us cached ({} hits)'.format(
+        view_size, vis_time, cached_time, hits))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import gym_minigrid
+from gym_minigrid.demos import generate_demos
+
+parser = argparse.ArgumentParser(
+    description='generate expert demonstrations, resuming any interrupted run'
+)
+parser.add_argument(
+    "--env-name",
+    dest="env_names",
+    action="append",
+    help="gym environment to solve, can be repeated",
+)
+parser.add_argument("--out-dir", default="demos", help="one subdirectory is written per environment")
+parser.add_argument("--num-seeds", type=int, default=1000)
+parser.add_argument("--first-seed", type=int, default=0)
+parser.add_argument("--shard-size", type=int, default=1000)
+parser.add_argument("--num-workers", type=int, default=os.cpu_count())
+parser.add_argument("--keep-failed", action="store_true", help="also save the failed episodes")
+args = parser.parse_args()
+
+env_names = args.env_names or ['MiniGrid-DoorKey-8x8-v0']
+
+results = []
+for env_name in env_names:
+    stats = generate_demos(
+        env_name,
+        os.path.join(args.out_dir, env_name),
+        num_seeds=args.num_seeds,
+        first_seed=args.first_seed,
+        shard_size=args.shard_size,
+        num_workers=args.num_workers,
+        keep_failed=args.keep_failed,
+        log=print
+    )
+    results.append(stats)
+
+print()
+print('%-40s %8s %8s %10s %10s' % ('env', 'seeds', 'demos', 'success', 'demos/s'))
+for stats in results:
+    print('%-40s %8d %8d %9.1f%% %10.1f' % (
+        stats['env_id'],
+        stats['num_seeds'],
+        stats['num_demos'],
+        100 * stats['success_rate'],
+        stats['demos_per_sec']
+    ))
@@ -0,0 +1,415 @@
+import os
+import hashlib
+import numpy as np
+from .minigrid import *
+
+# Version of the tile rendering code. Bump this whenever the way tiles
+# are drawn changes, so that stale atlas files are not reused.
+RENDERING_VERSION = 1
+
+# Number of values of the state channel covered by the atlas. The agent
+# cells of fully observable encodings store the agent direction there.
+NUM_STATES = max(len(STATE_TO_IDX), len(DIR_TO_VEC))
+
+# Index of the agent direction axis used for tiles without the agent
+NO_AGENT = len(DIR_TO_VEC)
+
+def default_cache_dir():
+    """
+    Directory where atlas files are stored by default, given by the
+    MINIGRID_CACHE_DIR environment variable, or None if it isn't set
+    """
+
+    return os.environ.get('MINIGRID_CACHE_DIR')
+
+def gather_tiles(flat_tiles, index, tile_size, out=None):
+    """
+    Assemble the tiles of flat_tiles, an array of shape
+    (N, tile_size, tile_size, 3), with the given indices, an array of
+    shape (..., width, height), into images of shape
+    (..., height * tile_size, width * tile_size, 3).
+
+    This is a single gather of tile rows, ordered so that the result
+    is already laid out as images. The images are written into out
+    if it is given.
+    """
+
+    *batch, width, height = index.shape
+    shape = tuple(batch) + (height * tile_size, width * tile_size, 3)
+
+    # Row r of tile n is row n * tile_size + r of this table
+    rows = flat_tiles.reshape(-1, tile_size * 3)
+
+    # Image row j * tile_size + r, cell i is row r of tile index[i, j]
+    row_idx = np.swapaxes(index, -1, -2)[..., :, None, :] * tile_size
+    row_idx = row_idx + np.arange(tile_size)[:, None]
+    row_idx = row_idx.ravel()
+
+    if out is None:
+        return np.take(rows, row_idx, axis=0).reshape(shape)
+
+    assert out.shape == shape, out.shape
+    if out.flags.c_contiguous:
+        np.take(rows, row_idx, axis=0, out=out.reshape(-1, tile_size * 3))
+    else:
+        out[...] = np.take(rows, row_idx, axis=0).reshape(shape)
+    return out
+
+def tables_digest():
+    """
+    Short digest of the object, color and state tables, so that atlas
+    files are invalidated if any of these tables change
+    """
+
+    tables = repr((
+        sorted(OBJECT_TO_IDX.items()),
+        sorted(COLOR_TO_IDX.items()),
+        sorted((k, v.tolist()) for k, v in COLORS.items()),
+        sorted(STATE_TO_IDX.items()),
+    ))
+    return hashlib.sha1(tables.encode()).hexdigest()[:8]
+
+class TileAtlas:
+    """
+    Contiguous array of every tile which can appear in a rendering, for a
+    given tile size. Tiles are indexed by object type, color and state,
+    agent direction (NO_AGENT if the agent is not in the cell) and
+    highlighting, so that rendering a cell is a lookup instead of
+    rasterizing shapes.
+
+    Atlases can be saved to and loaded from disk, so that the rendering
+    cost is only paid once per machine rather than once per process.
+    Loaded atlases are registered in TileAtlas.loaded, where they are
+    used by Grid.render_tile to fill the tile cache. This is a bounded
+    cache, so that loading atlases at many tile sizes doesn't keep them
+    all in memory.
+    """
+
+    # Atlases loaded in this process, keyed by (tile_size, subdivs)
+    loaded = TileCache(max_size=8, max_bytes=256 * 1024 * 1024)
+
+    # Object classes whose rendering only depends on their encoding
+    obj_classes = (Goal, Floor, Lava, Wall, Door, Key, Ball, Box, Gift)
+
+    def __init__(self, tiles, tile_size, subdivs=3):
+        assert tiles.shape == TileAtlas.shape(tile_size), tiles.shape
+        assert tiles.dtype == np.uint8
+
+        self.tiles = tiles
+        self.tile_size = tile_size
+        self.subdivs = subdivs
+
+        # Flat view of the tiles, for gathers by index
+        self.flat_tiles = tiles.reshape(-1, tile_size, tile_size, 3)
+
+    @property
+    def nbytes(self):
+        return self.tiles.nbytes
+
+    @staticmethod
+    def shape(tile_size):
+        """
+        Shape of the tile array of an atlas
+        """
+
+        return (
+            len(OBJECT_TO_IDX),
+            len(COLOR_TO_IDX),
+            NUM_STATES,
+            NO_AGENT + 1,
+            2,
+            tile_size,
+            tile_size,
+            3
+        )
+
+    @staticmethod
+    def index(type_idx, color_idx, state, agent_dir=NO_AGENT, highlight=False):
+        """
+        Flat index of a tile in the atlas. This also works on arrays of
+        indices, which allows gathering many tiles at once.
+        """
+
+        index = type_idx * len(COLOR_TO_IDX) + color_idx
+        index = index * NUM_STATES + state
+        index = index * (NO_AGENT + 1) + agent_dir
+        return index * 2 + highlight
+
+    @staticmethod
+    def unindex(index):
+        """
+        Object type, color and state, agent direction and highlighting
+        of the tile with a given flat index, see index()
+        """
+
+        index, highlight = divmod(int(index), 2)
+        index, dir_idx = divmod(index, NO_AGENT + 1)
+        index, state = divmod(index, NUM_STATES)
+        type_idx, color_idx = divmod(index, len(COLOR_TO_IDX))
+        return type_idx, color_idx, state, dir_idx, bool(highlight)
+
+    @staticmethod
+    def file_name(tile_size, subdivs=3):
+        """
+        Name of the atlas file for a tile size
+        """
+
+        return 'atlas-v%d-%dpx-x%d-%s.npy' % (
+            RENDERING_VERSION,
+            tile_size,
+            subdivs,
+            tables_digest()
+        )
+
+    @classmethod
+    def build(cls, tile_size=TILE_PIXELS, subdivs=3):
+        """
+        Render every tile of the atlas
+        """
+
+        tiles = np.zeros(shape=cls.shape(tile_size), dtype=np.uint8)
+
+        # Different encodings can decode to the same object (eg: walls
+        # ignore the state), so only draw each distinct tile once
+        drawn = {}
+
+        for type_idx in range(len(OBJECT_TO_IDX)):
+            for color_idx in range(len(COLOR_TO_IDX)):
+                for state in range(NUM_STATES):
+                    if IDX_TO_OBJECT[type_idx] == 'agent':
+                        # The agent direction is stored in the state
+                        obj = None
+                        agent_dirs = [state] * (NO_AGENT + 1)
+                    else:
+                        obj = WorldObj.decode(type_idx, color_idx, state)
+                        agent_dirs = list(range(NO_AGENT)) + [None]
+
+                    obj_key = obj.encode() if obj else None
+
+                    for dir_idx, agent_dir in enumerate(agent_dirs):
+                        for highlight in (False, True):
+                            key = (obj_key, agent_dir, highlight)
+                            if key not in drawn:
+                                drawn[key] = Grid.draw_tile(
+                                    obj,
+                                    agent_dir,
+                                    highlight,
+                                    tile_size,
+                                    subdivs
+                                )
+                            tiles[type_idx, color_idx, state, dir_idx, int(highlight)] = drawn[key]
+
+        return cls(tiles, tile_size, subdivs)
+
+    def save(self, path):
+        """
+        Save the atlas to a file. The file is written atomically, so that
+        processes loading the atlas never see a partially written file.
+        """
+
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.tiles))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, tile_size=TILE_PIXELS, subdivs=3, mmap=False):
+        """
+        Load an atlas from a file and register it for rendering.
+        With mmap, the tiles are memory-mapped instead of read, so that
+        processes on the same machine share a single copy of the atlas.
+        """
+
+        tiles = np.load(path, mmap_mode='r' if mmap else None)
+        tiles.flags.writeable = False
+
+        atlas = cls(tiles, tile_size, subdivs)
+        cls.loaded[(tile_size, subdivs)] = atlas
+        return atlas
+
+    @classmethod
+    def get(cls, tile_size=TILE_PIXELS, subdivs=3, cache_dir=None, mmap=False):
+        """
+        Get the atlas for a tile size, loading it from the cache directory
+        if it was saved previously, or building and saving it otherwise.
+        Atlases are only stored on disk if cache_dir is given, or set by
+        the MINIGRID_CACHE_DIR environment variable.
+        """
+
+        atlas = cls.loaded.get((tile_size, subdivs))
+        if atlas is not None:
+            return atlas
+
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, cls.file_name(tile_size, subdivs))
+            try:
+                return cls.load(path, tile_size, subdivs, mmap)
+            except (OSError, ValueError, AssertionError):
+                # Missing, truncated or mismatched atlas file
+                pass
+
+        atlas = cls.build(tile_size, subdivs)
+
+        if path is not None:
+            try:
+                atlas.save(path)
+            except OSError:
+                # The atlas is still usable if the cache isn't writable
+                pass
+
+        atlas.tiles.flags.writeable = False
+        cls.loaded[(tile_size, subdivs)] = atlas
+        return atlas
+
+    def tile(self, obj, agent_dir=None, highlight=False):
+        """
+        Get the tile for an object (or None), with the agent facing
+        agent_dir overlaid if agent_dir is not None
+        """
+
+        type_idx, color_idx, state = obj.encode() if obj else (OBJECT_TO_IDX['empty'], 0, 0)
+        dir_idx = NO_AGENT if agent_dir is None else agent_dir
+        return self.tiles[type_idx, color_idx, state, dir_idx, int(highlight)]
+
+    @staticmethod
+    def tile_indices(array, agent_pos=None, agent_dir=None, highlight_mask=None):
+        """
+        Flat atlas indices of the tiles of an encoded grid of shape
+        (width, height, 3), with the agent at agent_pos facing agent_dir,
+        and the cells where highlight_mask is set highlighted
+        """
+
+        width, height, _ = array.shape
+
+        dir_idx = np.full((width, height), NO_AGENT, dtype=np.int64)
+        if agent_pos is not None and agent_dir is not None:
+            dir_idx[agent_pos[0], agent_pos[1]] = agent_dir
+
+        if highlight_mask is None:
+            highlight_mask = np.zeros((width, height), dtype=bool)
+
+        array = array.astype(np.int64)
+        return TileAtlas.index(
+            array[:, :, 0],
+            array[:, :, 1],
+            array[:, :, 2],
+            dir_idx,
+            highlight_mask
+        )
+
+    def render(self, array, agent_pos=None, agent_dir=None, highlight_mask=None, frame=None):
+        """
+        Render an encoded grid of shape (width, height, 3), with the agent
+        at agent_pos facing agent_dir, and the cells where highlight_mask
+        is set highlighted.
+
+        The tile indices of all the cells are computed at once, and the
+        image is built by a single gather, see gather().
+
+        If a FrameBuffer is given and holds the previous frame rendered at
+        the same size, only the cells whose tile changed are redrawn.
+        """
+
+        width, height, _ = array.shape
+        tile_size = self.tile_size
+
+        index = self.tile_indices(array, agent_pos, agent_dir, highlight_mask)
+
+        if frame is not None and frame.matches(index, tile_size):
+            i, j = np.nonzero(index != frame.index)
+            tiles = self.take(index[i, j])
+            frame.img.reshape(height, tile_size, width, tile_size, 3)[j, :, i] = tiles
+            frame.index = index
+            frame.num_redrawn = len(i)
+            return frame.img.copy()
+
+        img = self.gather(index)
+
+        if frame is not None:
+            frame.img = img.copy()
+            frame.index = index
+            frame.tile_size = tile_size
+            frame.num_redrawn = width * height
+
+        return img
+
+    def take(self, indices):
+        """
+        Get the tiles with the given flat indices, as an array of
+        shape (N, tile_size, tile_size, 3)
+        """
+
+        return np.take(self.flat_tiles, indices, axis=0)
+
+    def gather(self, index, out=None):
+        """
+        Assemble the tiles with the given indices, an array of shape
+        (..., width, height), into images, see gather_tiles()
+        """
+
+        return gather_tiles(self.flat_tiles, index, self.tile_size, out)
+
+class CachedTiles(TileAtlas):
+    """
+    Tiles of a tile size, looked up by their atlas index like those of a
+    TileAtlas, but taken from Grid.render_tile. Only the tiles which
+    actually appear are drawn, or copied from a loaded atlas, and they
+    are kept in the bounded Grid.tile_cache. Rendering goes through this,
+    so that the limits and statistics of the tile cache apply to it.
+    """
+
+    # Static cache of the render_tile() arguments of each flat index
+    tile_args = {}
+
+    def __init__(self, tile_size, subdivs=3):
+        self.tile_size = tile_size
+        self.subdivs = subdivs
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def draw(self, index):
+        """
+        Get the tile with a flat atlas index from the tile cache
+        """
+
+        args = CachedTiles.tile_args.get(index)
+
+        if args is None:
+            type_idx, color_idx, state, dir_idx, highlight = TileAtlas.unindex(index)
+            agent_dir = None if dir_idx == NO_AGENT else dir_idx
+
+            if IDX_TO_OBJECT[type_idx] == 'agent':
+                # The agent direction is stored in the state
+                obj, agent_dir = None, state
+            else:
+                obj = WorldObj.decode(type_idx, color_idx, state)
+
+            args = CachedTiles.tile_args[index] = (obj, agent_dir, highlight)
+
+        return Grid.render_tile(*args, self.tile_size, self.subdivs)
+
+    def tile(self, obj, agent_dir=None, highlight=False):
+        return Grid.render_tile(obj, agent_dir, highlight, self.tile_size, self.subdivs)
+
+    def take(self, indices):
+        shape = (len(indices), self.tile_size, self.tile_size, 3)
+        tiles = np.empty(shape=shape, dtype=np.uint8)
+        for n, index in enumerate(indices):
+            tiles[n] = self.draw(index)
+        return tiles
+
+    def gather(self, index, out=None):
+        # Each distinct tile is only looked up once
+        distinct, inverse = np.unique(index, return_inverse=True)
+        inverse = inverse.reshape(index.shape)
+        return gather_tiles(self.take(distinct), inverse, self.tile_size, out)
@@ -0,0 +1,357 @@
+from collections import OrderedDict
+import numpy as np
+from .minigrid import *
+from .distance import cell_costs, distance_fields, action_distance_fields, DistanceOracle
+
+# Cost of moving through a locked door or a movable object when looking
+# for what blocks the way to a target, see ExpertBot.find_blocker()
+BLOCKER_COST = 100
+
+# Number of candidate cells checked before dropping an object, see
+# ExpertBot.drop_cells()
+MAX_DROP_CHECKS = 8
+
+class ExpertBot:
+    """
+    Planner solving the tasks of the environments from their full state,
+    to generate expert demonstrations. The next action is planned again
+    at every step, so the bot recovers from any state it is put in.
+
+    The objective is taken from the mission of the environment: getting
+    to the goal (eg: DoorKey), opening a door (Unlock), picking up an
+    object (UnlockPickup, BlockedUnlockPickup, KeyCorridor, ObstructedMaze),
+    or the phases of the delayed reward environments (fetching a key,
+    opening gifts, and going to the goal, through a locked door for the
+    DoorKeyOptional phase).
+
+    When the way to a target is blocked, the first blocker on the way is
+    cleared: locked doors are opened with the key of their color, taken
+    out of its box if needed, and balls or boxes are picked up and moved
+    out of the way. Objects are only dropped where they don't cut off any
+    part of the reachable area.
+    """
+
+    def __init__(self, env, max_depth=6, max_size=256):
+        self.env = env
+        self.max_depth = max_depth
+        self.max_size = max_size
+
+        # Action distance fields, keyed by the costs and targets
+        self.fields = OrderedDict()
+
+    def task_env(self):
+        """
+        Get the environment whose mission is being solved. Multi-phase
+        environments delegate to the environment of the current phase.
+        """
+
+        env = self.env.unwrapped
+        while hasattr(env, 'num_phases'):
+            env = env.env
+        return env
+
+    def get_field(self, fn, costs, targets):
+        """
+        Compute a distance field with fn, or get it from the cache
+        """
+
+        key = (fn.__name__, costs.shape, costs.tobytes(), targets.tobytes())
+        field = self.fields.get(key)
+
+        if field is None:
+            field = fn(costs, targets)
+            self.fields[key] = field
+            while len(self.fields) > self.max_size:
+                self.fields.popitem(last=False)
+        else:
+            self.fields.move_to_end(key)
+
+        return field
+
+    def act(self):
+        """
+        Get the next action of the expert, or None if it is stuck
+        """
+
+        env = self.task_env()
+        env.grid.sync()
+        kind, cells = self.objective(env)
+
+        if kind == 'wait':
+            return env.actions.done
+
+        return self.interact(env, kind, cells)
+
+    def objective(self, env):
+        """
+        Get the next objective of the agent, as the kind of interaction
+        ('goto', 'pickup' or 'toggle') and the cells to interact with,
+        or ('wait', None) once the task is done
+        """
+
+        grid = env.grid
+        mission = env.mission
+
+        def find(pred):
+            return [pos for pos, obj in grid.objs.items() if pred(obj)]
+
+        carrying_key = env.carrying is not None and env.carrying.type == 'key'
+        goals = list(zip(*np.nonzero(grid.array[:, :, 0] == OBJECT_TO_IDX['goal'])))
+
+        if mission.startswith('pick up') and getattr(env, 'obj', None) is not None:
+            if env.carrying is env.obj:
+                return 'wait', None
+            return 'pickup', find(lambda obj: obj is env.obj)
+
+        if mission == 'open the door':
+            if env.door.is_open:
+                return 'wait', None
+            return 'toggle', [tuple(env.door.cur_pos)]
+
+        if mission == 'fetch a key':
+            keys = find(lambda obj: obj.type == 'key')
+            if carrying_key or not keys:
+                return 'wait', None
+            return 'pickup', keys
+
+        if mission == 'Open all the gifts':
+            gifts = find(lambda obj: obj.type == 'gift' and not obj.is_open)
+            if not gifts:
+                return 'wait', None
+            return 'toggle', gifts
+
+        if mission == 'fetch the key and go to goal' and not carrying_key:
+            keys = find(lambda obj: obj.type == 'key')
+            if keys:
+                return 'pickup', keys
+
+        # Stay on the goal once reached, if the episode goes on
+        if not goals or tuple(env.agent_pos) in goals:
+            return 'wait', None
+        return 'goto', goals
+
+    def costs(self, env):
+        """
+        Cost of moving into each cell, closed doors are opened on the way
+        """
+
+        return cell_costs(env.grid.array)
+
+    def pose_targets(self, costs, cells):
+        """
+        Mask of the poses facing one of the cells, of shape (W, H, 4)
+        """
+
+        mask = np.zeros(costs.shape, dtype=bool)
+        for pos in cells:
+            mask[pos] = True
+
+        passable = ~np.isinf(costs)
+        padded = np.pad(mask, 1)
+        width, height = costs.shape
+        targets = np.zeros(costs.shape + (4,), dtype=bool)
+
+        for d, (dx, dy) in enumerate(DIR_TO_VEC):
+            # The cell in front of the pose (x, y) is (x + dx, y + dy)
+            facing = padded[1 + dx:1 + dx + width, 1 + dy:1 + dy + height]
+            targets[:, :, d] = facing & passable
+
+        return targets
+
+    def interact(self, env, kind, cells, depth=0):
+        """
+        Get the next action to perform an interaction ('goto', 'pickup',
+        'toggle' or 'drop') with one of the cells, clearing the way first
+        """
+
+        if depth > self.max_depth or not cells:
+            return None
+
+        # Locked doors are opened with the key of their color
+        if kind == 'toggle':
+            obj = env.grid.get(*cells[0])
+            if len(cells) == 1 and obj.type == 'door' and obj.is_locked:
+                carrying = env.carrying
+                if carrying is None or carrying.type != 'key' or carrying.color != obj.color:
+                    return self.fetch_key(env, obj.color, depth + 1)
+
+        costs = self.costs(env)
+        if kind == 'goto':
+            targets = np.zeros(costs.shape, dtype=bool)
+            for pos in cells:
+                targets[pos] = True
+        else:
+            targets = self.pose_targets(costs, cells)
+
+        action_dist = self.get_field(action_distance_fields, costs, targets)
+        x, y = env.agent_pos
+        dist = action_dist[x, y, env.agent_dir]
+
+        if np.isinf(dist):
+            # The way is blocked, clear the first blocker on it
+            blocker = self.find_blocker(env, costs, kind, cells)
+            if blocker is None:
+                return None
+
+            obj = env.grid.get(*blocker)
+            if obj.type == 'door':
+                return self.interact(env, 'toggle', [blocker], depth + 1)
+            return self.interact(env, 'pickup', [blocker], depth + 1)
+
+        # Picking up an object needs free hands, which is only done once
+        # the object can be reached, as the carried object may be a key
+        if kind == 'pickup' and env.carrying is not None:
+            return self.interact(env, 'drop', self.drop_cells(env, cells), depth + 1)
+
+        if dist == 0:
+            return getattr(env.actions, kind, None)
+
+        return DistanceOracle.select_action(env, (costs, None, action_dist))
+
+    def fetch_key(self, env, color, depth):
+        """
+        Get the next action to pick up the key of a color, opening the
+        box containing it if needed
+        """
+
+        keys = []
+        boxes = []
+        for pos, obj in env.grid.objs.items():
+            if obj.type == 'key' and obj.color == color:
+                keys.append(pos)
+            elif obj.type == 'box' and obj.contains is not None:
+                if obj.contains.type == 'key' and obj.contains.color == color:
+                    boxes.append(pos)
+
+        if keys:
+            return self.interact(env, 'pickup', keys, depth)
+        return self.interact(env, 'toggle', boxes, depth)
+
+    def find_blocker(self, env, costs, kind, cells):
+        """
+        Find the first locked door or object on the shortest path to
+        interact with the cells, when going through them is allowed at
+        a high cost
+        """
+
+        relaxed = costs.copy()
+        array = env.grid.array
+        movable = np.isin(array[:, :, 0], [OBJECT_TO_IDX[t] for t in ['key', 'ball', 'box']])
+        locked = (array[:, :, 0] == OBJECT_TO_IDX['door']) & (array[:, :, 2] == STATE_TO_IDX['locked'])
+        relaxed[movable | locked] = BLOCKER_COST
+
+        if kind == 'goto':
+            targets = np.zeros(costs.shape, dtype=bool)
+            for pos in cells:
+                targets[pos] = True
+        else:
+            targets = self.pose_targets(relaxed, cells).any(axis=-1)
+
+        dist = self.get_field(distance_fields, relaxed, targets)
+
+        pos = tuple(env.agent_pos)
+        if np.isinf(dist[pos]):
+            return None
+
+        # Follow the path until it goes through a blocker
+        while dist[pos] > 0:
+            x, y = pos
+            best = None
+            for dx, dy in DIR_TO_VEC:
+                n = (x + dx, y + dy)
+                if dist[n] + relaxed[n] == dist[pos]:
+                    best = n
+                    break
+            if best is None:
+                return None
+            if movable[best] or locked[best]:
+                return best
+            pos = best
+
+        return None
+
+    def drop_cells(self, env, avoid):
+        """
+        Pick the cells where the carried object can be dropped: empty cells
+        which are reachable, not next to a door or to the cells to avoid,
+        and whose filling doesn't cut off any part of the reachable area.
+        The nearest cell which qualifies is returned, or the one cutting
+        off the fewest cells if none does.
+        """
+
+        array = env.grid.array
+        costs = self.costs(env)
+        agent = tuple(env.agent_pos)
+
+        start = np.zeros(costs.shape, dtype=bool)
+        start[agent] = True
+        dist = self.get_field(distance_fields, costs, start)
+        reachable = ~np.isinf(dist)
+        num_reachable = reachable.sum()
+
+        # Cells next to a door or to a cell to avoid
+        near = array[:, :, 0] == OBJECT_TO_IDX['door']
+        for pos in avoid:
+            near[pos] = True
+        near[1:] |= near[:-1].copy()
+        near[:-1] |= near[1:].copy()
+        near[:, 1:] |= near[:, :-1].copy()
+        near[:, :-1] |= near[:, 1:].copy()
+
+        empty = array[:, :, 0] == OBJECT_TO_IDX['empty']
+        candidates = empty & reachable & ~near
+        candidates[agent] = False
+        if not candidates.any():
+            candidates = empty & reachable
+            candidates[agent] = False
+
+        xs, ys = np.nonzero(candidates)
+        order = np.argsort(dist[xs, ys], kind='stable')
+
+        best = None
+        best_cut = None
+        for idx in order[:MAX_DROP_CHECKS]:
+            pos = (xs[idx], ys[idx])
+            blocked = costs.copy()
+            blocked[pos] = np.inf
+            cut = num_reachable - 1 - (~np.isinf(distance_fields(blocked, start))).sum()
+            if cut == 0:
+                return [pos]
+            if best_cut is None or cut < best_cut:
+                best, best_cut = pos, cut
+
+        return [] if best is None else [best]
+
+def solve(env, obs, max_steps=None):
+    """
+    Run the expert on an environment, from the first observation obs of
+    an episode, until the end of the episode or until it gets stuck.
+    Returns the observations, actions and rewards of the episode, and
+    whether the expert succeeded, that is got a positive final reward.
+    """
+
+    bot = ExpertBot(env)
+
+    if max_steps is None:
+        max_steps = float('inf')
+
+    observations = []
+    actions = []
+    rewards = []
+    reward = 0
+
+    while len(actions) < max_steps:
+        action = bot.act()
+        if action is None:
+            break
+
+        observations.append(obs)
+        actions.append(int(action))
+        obs, reward, done, _ = env.step(action)
+        rewards.append(reward)
+
+        if done:
+            break
+
+    success = bool(rewards) and rewards[-1] > 0
+    return observations, actions, rewards, success
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import glob
+import multiprocessing as mp
+import numpy as np
+from .vector import make_env
+from .bot import solve
+
+# Name of the file listing the shards of a dataset
+INDEX_FILE = 'index.json'
+
+# Settings which must match to resume generating a dataset
+INDEX_SETTINGS = ['env_id', 'first_seed', 'shard_size', 'keep_failed']
+
+# Environments created by the current process, keyed by id, so that
+# workers only create them once
+worker_envs = {}
+
+def shard_name(shard_idx):
+    return 'shard-%05d.npz' % shard_idx
+
+def save_shard(path, demos):
+    """
+    Save demonstrations to a compressed shard. The steps of all the
+    demonstrations are concatenated, and the steps of demonstration i
+    are offsets[i]:offsets[i+1]. The missions of the steps are stored
+    as indices into the missions of the shard. The file is written
+    atomically, so that an interrupted run never leaves a partial shard.
+    """
+
+    missions = sorted(set(m for demo in demos for m in demo['missions']))
+    mission_idx = {m: i for i, m in enumerate(missions)}
+    lengths = [len(demo['actions']) for demo in demos]
+
+    def concat(key, dtype, shape=()):
+        arrays = [np.asarray(demo[key], dtype=dtype) for demo in demos]
+        if not arrays:
+            return np.zeros((0,) + shape, dtype=dtype)
+        return np.concatenate([a.reshape((-1,) + shape) for a in arrays])
+
+    images = [demo['images'][0] for demo in demos if demo['images']]
+    image_shape = images[0].shape if images else (7, 7, 3)
+
+    arrays = {
+        'images': concat('images', np.uint8, image_shape),
+        'directions': concat('directions', np.uint8),
+        'mission_ids': np.array(
+            [mission_idx[m] for demo in demos for m in demo['missions']],
+            dtype=np.uint16
+        ),
+        'missions': np.array(missions, dtype=np.str_),
+        'actions': concat('actions', np.uint8),
+        'rewards': concat('rewards', np.float32),
+        'offsets': np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64),
+        'seeds': np.array([demo['seed'] for demo in demos], dtype=np.int64),
+        'success': np.array([demo['success'] for demo in demos], dtype=bool),
+    }
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+
+def load_shard(path):
+    """
+    Load the arrays of a shard saved with save_shard()
+    """
+
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+def generate_shard(task):
+    """
+    Worker task: solve the environment with the expert for each seed of
+    the shard, and save the demonstrations. Returns the shard index and
+    its statistics.
+    """
+
+    env_id, shard_idx, seeds, path, keep_failed = task
+
+    env = worker_envs.get(env_id)
+    if env is None:
+        env = worker_envs[env_id] = make_env(env_id)
+
+    start = time.perf_counter()
+    demos = []
+    num_success = 0
+
+    for seed in seeds:
+        env.seed(seed)
+        obs = env.reset()
+        observations, actions, rewards, success = solve(env, obs)
+        num_success += success
+
+        if not success and not keep_failed:
+            continue
+
+        demos.append({
+            'images': [o['image'] for o in observations],
+            'directions': [o['direction'] for o in observations],
+            'missions': [o['mission'] for o in observations],
+            'actions': actions,
+            'rewards': rewards,
+            'seed': seed,
+            'success': success,
+        })
+
+    save_shard(path, demos)
+
+    return shard_idx, {
+        'file': os.path.basename(path),
+        'first_seed': seeds[0],
+        'num_seeds': len(seeds),
+        'num_demos': len(demos),
+        'num_success': num_success,
+        'num_steps': sum(len(demo['actions']) for demo in demos),
+        'gen_time': time.perf_counter() - start,
+    }
+
+def load_index(out_dir):
+    """
+    Load the index of a dataset, or None if there is none yet
+    """
+
+    path = os.path.join(out_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_index(out_dir, index):
+    path = os.path.join(out_dir, INDEX_FILE)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, path)
+
+def generate_demos(
+    env_id,
+    out_dir,
+    num_seeds,
+    first_seed=0,
+    shard_size=1000,
+    num_workers=1,
+    keep_failed=False,
+    start_method=None,
+    log=None
+):
+    """
+    Generate expert demonstrations for the seeds first_seed to
+    first_seed+num_seeds of an environment, with a pool of worker
+    processes, and write them to out_dir in shards of shard_size seeds.
+    Only successful demonstrations are kept, unless keep_failed is set.
+
+    The index file lists the completed shards, and is updated as each
+    shard is written, so that running again with the same arguments
+    after an interruption only generates the missing shards. Running
+    again with more seeds extends the dataset.
+
+    Returns statistics on the dataset, including the success rate of
+    the expert, and the demonstrations per second of this run.
+    """
+
+    assert num_seeds > 0
+    assert shard_size > 0
+    assert num_workers > 0
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    settings = {
+        'env_id': env_id,
+        'first_seed': first_seed,
+        'shard_size': shard_size,
+        'keep_failed': keep_failed,
+    }
+
+    index = load_index(out_dir)
+    if index is None:
+        index = dict(settings, shards=[])
+    for key in INDEX_SETTINGS:
+        if index[key] != settings[key]:
+            raise ValueError(
+                'dataset in %s was generated with %s=%r, not %r' %
+                (out_dir, key, index[key], settings[key])
+            )
+
+    # Remove the files left by an interrupted run
+    for path in glob.glob(os.path.join(out_dir, '*.tmp')):
+        os.remove(path)
+
+    done = {}
+    for entry in index['shards']:
+        if os.path.exists(os.path.join(out_dir, entry['file'])):
+            done[(entry['first_seed'] - first_seed) // shard_size] = entry
+
+    tasks = []
+    num_shards = (num_seeds + shard_size - 1) // shard_size
+    for shard_idx in range(num_shards):
+        start = first_seed + shard_idx * shard_size
+        seeds = list(range(start, min(start + shard_size, first_seed + num_seeds)))
+
+        # Shards cut short by a previous run with fewer seeds are redone
+        entry = done.get(shard_idx)
+        if entry is not None and entry['num_seeds'] >= len(seeds):
+            continue
+
+        path = os.path.join(out_dir, shard_name(shard_idx))
+        tasks.append((env_id, shard_idx, seeds, path, keep_failed))
+
+    start_time = time.perf_counter()
+    num_done = num_shards - len(tasks)
+    run_demos = 0
+
+    if num_workers > 1 and len(tasks) > 1:
+        ctx = mp.get_context(start_method)
+        pool = ctx.Pool(num_workers)
+        results = pool.imap_unordered(generate_shard, tasks)
+    else:
+        pool = None
+        results = map(generate_shard, tasks)
+
+    try:
+        for shard_idx, entry in results:
+            done[shard_idx] = entry
+            index['shards'] = [done[k] for k in sorted(done)]
+            save_index(out_dir, index)
+
+            num_done += 1
+            run_demos += entry['num_demos']
+            if log is not None:
+                elapsed = time.perf_counter() - start_time
+                log('%s: shard %d done (%d/%d), %d/%d solved, %.1f demos/s' % (
+                    env_id,
+                    shard_idx,
+                    num_done,
+                    num_shards,
+                    entry['num_success'],
+                    entry['num_seeds'],
+                    run_demos / max(elapsed, 1e-9)
+                ))
+
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    elapsed = time.perf_counter() - start_time
+    shards = [done[k] for k in sorted(done) if k < num_shards]
+    total_seeds = sum(entry['num_seeds'] for entry in shards)
+    total_success = sum(entry['num_success'] for entry in shards)
+
+    return {
+        'env_id': env_id,
+        'num_shards': len(shards),
+        'num_seeds': total_seeds,
+        'num_demos': sum(entry['num_demos'] for entry in shards),
+        'num_steps': sum(entry['num_steps'] for entry in shards),
+        'success_rate': total_success / max(total_seeds, 1),
+        'run_demos': run_demos,
+        'run_time': elapsed,
+        'demos_per_sec': run_demos / max(elapsed, 1e-9),
+    }
+
+def iter_demos(out_dir):
+    """
+    Iterate over the demonstrations of a dataset, in the order of the
+    seeds, as dicts of the steps of each demonstration
+    """
+
+    index = load_index(out_dir)
+    if index is None:
+        raise FileNotFoundError('no dataset index in %s' % out_dir)
+
+    for entry in index['shards']:
+        shard = load_shard(os.path.join(out_dir, entry['file']))
+        offsets = shard['offsets']
+        missions = shard['missions']
+
+        for i, seed in enumerate(shard['seeds']):
+            steps = slice(offsets[i], offsets[i + 1])
+            yield {
+                'seed': int(seed),
+                'success': bool(shard['success'][i]),
+                'images': shard['images'][steps],
+                'directions': shard['directions'][steps],
+                'missions': [str(m) for m in missions[shard['mission_ids'][steps]]],
+                'actions': shard['actions'][steps],
+                'rewards': shard['rewards'][steps],
+            }
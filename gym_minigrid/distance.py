@@ -0,0 +1,327 @@
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from .minigrid import *
+
+# Number of values of the state channel covered by the cost table. The
+# agent cells of fully observable encodings store the agent direction.
+NUM_STATES = max(len(STATE_TO_IDX), len(DIR_TO_VEC))
+
+# Direction reached by turning left, right or around from each direction
+TURN_LEFT = [3, 0, 1, 2]
+TURN_RIGHT = [1, 2, 3, 0]
+TURN_AROUND = [2, 3, 0, 1]
+
+@lru_cache(maxsize=64)
+def cost_table(door_cost=2, locked_door_cost=np.inf, lava_cost=np.inf):
+    """
+    Table of the cost of moving into a cell, indexed by the object type
+    and state of the cell. Cells which can't be entered cost infinity.
+    The default cost of a closed door accounts for opening it first.
+    """
+
+    table = np.full((len(OBJECT_TO_IDX), NUM_STATES), np.inf)
+
+    for name in ['empty', 'floor', 'goal', 'agent', 'gift']:
+        table[OBJECT_TO_IDX[name]] = 1
+
+    door = OBJECT_TO_IDX['door']
+    table[door, STATE_TO_IDX['open']] = 1
+    table[door, STATE_TO_IDX['closed']] = door_cost
+    table[door, STATE_TO_IDX['locked']] = locked_door_cost
+
+    table[OBJECT_TO_IDX['lava']] = lava_cost
+
+    table.flags.writeable = False
+    return table
+
+def cell_costs(array, door_cost=2, locked_door_cost=np.inf, lava_cost=np.inf):
+    """
+    Cost of moving into each cell of an encoded grid, or stack of grids,
+    of shape (..., width, height, 3)
+    """
+
+    table = cost_table(door_cost, locked_door_cost, lava_cost)
+    return table[array[..., 0], array[..., 2]]
+
+def sweep(dist, total, axis, forward):
+    """
+    Propagate distances along an axis in a single pass: each cell gets
+    the smallest distance of the cells further along the axis (before
+    it if forward is False), plus the cost of moving into every cell on
+    the way. The cost of moving from the start of the axis to each cell
+    is given by total, see prefix_costs().
+    """
+
+    if forward:
+        # min over j >= i of dist[j] + total[j] - total[i]
+        val = np.flip(dist + total, axis=axis)
+        val = np.flip(np.minimum.accumulate(val, axis=axis), axis=axis)
+        return np.minimum(dist, val - total)
+
+    # min over j <= i of dist[j] + total[i] - total[j]
+    val = np.minimum.accumulate(dist - total, axis=axis)
+    return np.minimum(dist, val + total)
+
+def prefix_costs(costs):
+    """
+    Compute the cost of moving from the start of each axis to every cell,
+    in both directions, for sweep(). Infinite costs are replaced by a cost
+    larger than any path avoiding them, so that the sums remain finite.
+    Returns the costs for increasing x, increasing y, decreasing x and
+    decreasing y, and the threshold above which distances are infinite.
+
+    Sums are computed in single precision, which is exact for integer
+    costs as long as they stay below 2**24.
+    """
+
+    blocked = np.isinf(costs)
+    max_cost = costs[~blocked].max(initial=1)
+    big = float(max_cost * costs.shape[-1] * costs.shape[-2] + 1)
+    costs = np.where(blocked, big, costs).astype(np.float32)
+
+    # Moving towards decreasing indices enters the cells before, so the
+    # cost of the current cell is excluded, and the cost of the last one
+    # is included
+    total_x = np.cumsum(costs, axis=-2)
+    total_y = np.cumsum(costs, axis=-1)
+
+    return (total_x, total_y, total_x - costs, total_y - costs), big
+
+def distance_fields(costs, targets):
+    """
+    Compute the cost of the shortest path from every cell to the nearest
+    target cell, given the cost of moving into each cell, both of shape
+    (..., width, height). Cells that can't reach a target are infinitely
+    far.
+
+    Distances are propagated along whole rows and columns at once, and
+    vectorized over any leading dimensions, until they stop changing.
+    This takes about one iteration per turn of the longest shortest path,
+    rather than one per cell as in a breadth-first search.
+    """
+
+    blocked = np.isinf(costs) & ~targets
+    totals, big = prefix_costs(costs)
+    dist = np.where(targets, 0, np.inf).astype(np.float32)
+
+    while True:
+        best = sweep(dist, totals[0], -2, True)
+        best = sweep(best, totals[2], -2, False)
+        best = sweep(best, totals[1], -1, True)
+        best = sweep(best, totals[3], -1, False)
+        best[blocked | (best >= big)] = np.inf
+
+        if np.array_equal(best, dist):
+            return dist.astype(np.float64)
+        dist = best
+
+def action_distance_fields(costs, targets):
+    """
+    Compute the cost of reaching the nearest target cell from every pose
+    of the agent, as an array of shape (..., width, height, 4) indexed by
+    the position and direction of the agent. Turning costs one action,
+    and moving forward costs the cost of the cell moved into.
+
+    The targets can also be poses rather than cells, given by a mask of
+    shape (..., width, height, 4), eg: to face an object.
+    """
+
+    # Directions come first while iterating, so that each is contiguous
+    if targets.shape == costs.shape + (4,):
+        dist = np.where(np.moveaxis(targets, -1, 0), 0, np.inf).astype(np.float32)
+        targets = targets.any(axis=-1)
+    else:
+        dist = np.where(targets, 0, np.inf).astype(np.float32)[None].repeat(4, axis=0)
+
+    blocked = np.isinf(costs) & ~targets
+    totals, big = prefix_costs(costs)
+
+    while True:
+        # Move forward in the direction of the agent, see DIR_TO_VEC
+        best = np.stack([
+            sweep(dist[0], totals[0], -2, True),
+            sweep(dist[1], totals[1], -1, True),
+            sweep(dist[2], totals[2], -2, False),
+            sweep(dist[3], totals[3], -1, False),
+        ])
+
+        # Turn left, right or around
+        turns = np.minimum(best[TURN_LEFT], best[TURN_RIGHT]) + 1
+        np.minimum(turns, best[TURN_AROUND] + 2, out=turns)
+        np.minimum(best, turns, out=best)
+
+        best[(best >= big) | blocked] = np.inf
+
+        if np.array_equal(best, dist):
+            return np.moveaxis(dist, 0, -1).astype(np.float64)
+        dist = best
+
+class DistanceOracle:
+    """
+    Shortest path distances from the agent to the targets of an
+    environment (its goal cells by default), and optimal next actions.
+
+    The distance fields of a layout are cached, keyed by the cost of
+    every cell, so that they are only computed once per layout. Opening
+    a door, or moving an object, changes the costs, which invalidates
+    the fields. The least recently used fields are evicted once max_size
+    is reached.
+
+    Only moving, turning and opening doors are planned for. Locked doors
+    and lava can be given a finite cost to allow crossing them.
+    """
+
+    def __init__(self, door_cost=2, locked_door_cost=np.inf, lava_cost=np.inf, max_size=256):
+        assert max_size > 0
+        self.door_cost = door_cost
+        self.locked_door_cost = locked_door_cost
+        self.lava_cost = lava_cost
+        self.max_size = max_size
+        self.fields = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.fields)
+
+    def clear(self):
+        self.fields.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def layout(self, env, targets=None):
+        """
+        Get the cell costs and target mask of an environment
+        """
+
+        grid = env.unwrapped.grid
+        grid.sync()
+
+        costs = cell_costs(
+            grid.array,
+            self.door_cost,
+            self.locked_door_cost,
+            self.lava_cost
+        )
+
+        if targets is None:
+            targets = grid.array[:, :, 0] == OBJECT_TO_IDX['goal']
+
+        return costs, targets
+
+    def get_fields(self, env, targets=None):
+        """
+        Get the cell costs, the distance field and the action distance
+        field of the current layout of an environment
+        """
+
+        return self.get_fields_batch([env], None if targets is None else [targets])[0]
+
+    def get_fields_batch(self, envs, targets=None):
+        """
+        Get the fields of several environments, computing the missing
+        fields of all the environments of the same size at once
+        """
+
+        if targets is None:
+            targets = [None] * len(envs)
+
+        layouts = [self.layout(env, t) for env, t in zip(envs, targets)]
+        keys = [
+            (costs.shape, costs.tobytes(), targets.tobytes())
+            for costs, targets in layouts
+        ]
+
+        # Group the layouts to compute by size
+        missing = {}
+        for key, (costs, targets) in zip(keys, layouts):
+            if key in self.fields:
+                self.hits += 1
+                self.fields.move_to_end(key)
+            elif key not in missing:
+                self.misses += 1
+                missing[key] = (costs, targets)
+
+        shapes = set(costs.shape for costs, _ in missing.values())
+        for shape in shapes:
+            group = [k for k, (costs, _) in missing.items() if costs.shape == shape]
+            costs = np.stack([missing[k][0] for k in group])
+            targets = np.stack([missing[k][1] for k in group])
+
+            dist = distance_fields(costs, targets)
+            action_dist = action_distance_fields(costs, targets)
+
+            for idx, key in enumerate(group):
+                fields = (costs[idx], dist[idx], action_dist[idx])
+                for field in fields:
+                    field.flags.writeable = False
+                self.fields[key] = fields
+
+        result = [self.fields[key] for key in keys]
+
+        while len(self.fields) > self.max_size:
+            self.fields.popitem(last=False)
+
+        return result
+
+    def distance(self, env, targets=None):
+        """
+        Cost of the shortest path from the agent to the nearest target,
+        counting turns, or infinity if no target can be reached
+        """
+
+        env = env.unwrapped
+        _, _, action_dist = self.get_fields(env, targets)
+        x, y = env.agent_pos
+        return action_dist[x, y, env.agent_dir]
+
+    def optimal_action(self, env, targets=None):
+        """
+        Get the first action of a shortest path from the agent to the
+        nearest target, or None if the agent is on a target or can't
+        reach one. Moving into a closed door is done by opening it.
+        """
+
+        fields = self.get_fields(env, targets)
+        return self.select_action(env, fields)
+
+    def optimal_actions(self, envs, targets=None):
+        """
+        Get the optimal actions of several environments
+        """
+
+        fields = self.get_fields_batch(envs, targets)
+        return [self.select_action(env, f) for env, f in zip(envs, fields)]
+
+    @staticmethod
+    def select_action(env, fields):
+        """
+        Pick the best action from the fields of the layout of env
+        """
+
+        env = env.unwrapped
+        costs, _, action_dist = fields
+
+        x, y = env.agent_pos
+        d = env.agent_dir
+
+        dist = action_dist[x, y, d]
+        if dist == 0 or np.isinf(dist):
+            return None
+
+        # Cost of each action, ties are broken in this order
+        fx, fy = env.front_pos
+        forward = costs[fx, fy] + action_dist[fx, fy, d]
+        left = 1 + action_dist[x, y, (d - 1) % 4]
+        right = 1 + action_dist[x, y, (d + 1) % 4]
+
+        if forward <= left and forward <= right:
+            front_cell = env.grid.get(fx, fy)
+            if front_cell is not None and front_cell.type == 'door' and not front_cell.is_open:
+                return env.actions.toggle
+            return env.actions.forward
+
+        if left <= right:
+            return env.actions.left
+        return env.actions.right
@@ -58,9 +58,15 @@ class ThreePhaseDelayedReward(gym.Env):
         self.env = KeyEnv(**key_kwargs)
         self.action_space = self.env.action_space
         self.observation_space = self.env.observation_space
-        self.reward_range = self.env.reward_range
         self.metadata = self.env.metadata
 
+        # The rewards of all the phases are returned
+        ranges = [
+            env.get_reward_range(**kwargs)
+            for env, kwargs in zip(self._envs, self._env_kwargs)
+        ]
+        self.reward_range = (min(r[0] for r in ranges), max(r[1] for r in ranges))
+
     def reset(self):
         """reset returns agent back to first environment, KeyEnv"""
         self._env_idx = 0
@@ -100,6 +106,30 @@ class ThreePhaseDelayedReward(gym.Env):
             raise AttributeError("attempted to get missing private attribute '{}'".format(name))
         return getattr(self.env, name)
 
+    def get_state(self, rng=True):
+        """
+        Snapshot the current phase along with the state of its environment
+        """
+
+        return {
+            'env': self.env,
+            'env_state': self.env.get_state(rng),
+            'env_idx': self._env_idx,
+            'env_kwargs': [dict(kwargs) for kwargs in self._env_kwargs],
+            'wrapper_seed': self._wrapper_seed
+        }
+
+    def set_state(self, state):
+        """
+        Restore the phase and environment from a snapshot taken with get_state()
+        """
+
+        self.env = state['env']
+        self.env.set_state(state['env_state'])
+        self._env_idx = state['env_idx']
+        self._env_kwargs = [dict(kwargs) for kwargs in state['env_kwargs']]
+        self._wrapper_seed = state['wrapper_seed']
+
     def seed(self, seed=None):
         self._wrapper_seed = seed
         return self.env.seed(seed)
@@ -139,7 +169,6 @@ class TinyKeyGiftsDoorEnv(ThreePhaseDelayedReward):
             delayed_reward_env=DoorKeyOptionalEnv,
             delayed_reward_kwargs=dict(
                 size=8,
-                key_color=None,
                 door_color='yellow',
                 max_steps=5*8**2
             )
@@ -165,7 +194,6 @@ class KeyNoDistractorDoorEnv(ThreePhaseDelayedReward):
             delayed_reward_env=DoorKeyOptionalEnv,
             delayed_reward_kwargs = dict(
                 size=8,
-                key_color=None,
                 door_color='yellow',
                 max_steps=5*8**2
             )
@@ -11,6 +11,9 @@ class DoorKeyOptionalEnv(MiniGridEnv):
     the color of the door when the environment is initialized.
     """
 
+    # Episode counters, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('_door_num_times_opened',)
+
     def __init__(self,
                  size=8,
                  carrying=None,
@@ -27,6 +30,14 @@ class DoorKeyOptionalEnv(MiniGridEnv):
         self._goal_reward = goal_reward
         super().__init__(grid_size=size, max_steps=max_steps, seed=seed)
 
+        self.reward_range = self.get_reward_range(door_reward=door_reward, goal_reward=goal_reward)
+
+    @classmethod
+    def get_reward_range(cls, door_reward=0.0, goal_reward=1, **kwargs):
+        # The door reward is given once on opening the door, the goal
+        # reward decays by up to 0.9 with the number of steps
+        return (min(0, door_reward, goal_reward - 0.9), max(door_reward, goal_reward))
+
     def step(self, action):
         obs, reward, done, info = super().step(action)
 
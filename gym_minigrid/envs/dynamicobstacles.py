@@ -7,6 +7,9 @@ class DynamicObstaclesEnv(MiniGridEnv):
     Single-room square grid environment with moving obstacles
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('obstacles',)
+
     def __init__(
             self,
             size=8,
@@ -7,6 +7,9 @@ class FetchEnv(MiniGridEnv):
     named using English text strings
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('targetType', 'targetColor')
+
     def __init__(
         self,
         size=8,
@@ -14,6 +14,9 @@ class GoalKeyOptionalEnv(MiniGridEnv):
     reward is deferred till the end of the episode.)
     """
 
+    # Episode counters, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('_reached_goal_count', 'final_reward')
+
     def __init__(self,
                  size=8,
                  carrying=None,
@@ -38,6 +41,14 @@ class GoalKeyOptionalEnv(MiniGridEnv):
             seed=seed,
         )
 
+        self.reward_range = self.get_reward_range(key_reward=key_reward, goal_reward=goal_reward)
+
+    @classmethod
+    def get_reward_range(cls, key_reward=3, goal_reward=1., **kwargs):
+        # The goal reward is topped up with the key reward, and decays
+        # by up to 0.9 with the number of steps, see _reward()
+        return (min(0, goal_reward - 0.9), goal_reward + key_reward)
+
     def reset(self):
         """Override reset so that agent can be initialized
         carrying a key already"""
@@ -7,6 +7,9 @@ class GoToDoorEnv(MiniGridEnv):
     named using an English text string
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('target_pos', 'target_color')
+
     def __init__(
         self,
         size=5
@@ -7,6 +7,9 @@ class GoToObjectEnv(MiniGridEnv):
     named using an English text string
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('targetType', 'target_color', 'target_pos')
+
     def __init__(
         self,
         size=6,
@@ -7,6 +7,9 @@ class KeyCorridor(RoomGrid):
     random room.
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = RoomGrid.state_attrs + ('obj',)
+
     def __init__(
         self,
         num_rows=3,
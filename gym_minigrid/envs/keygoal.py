@@ -26,6 +26,13 @@ class KeyGoalEnv(MiniGridEnv):
             seed=seed,
         )
 
+        self.reward_range = self.get_reward_range(key_reward=key_reward)
+
+    @classmethod
+    def get_reward_range(cls, key_reward=3, **kwargs):
+        # The goal reward is topped up with the key reward
+        return (0, 1 + key_reward)
+
     def _gen_grid(self, width, height):
         self.grid = Grid(width, height)
 
@@ -28,6 +28,9 @@ class LockedRoom(MiniGridEnv):
     named using an English text string
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('rooms',)
+
     def __init__(
         self,
         size=19
@@ -11,6 +11,9 @@ class MemoryEnv(MiniGridEnv):
     object at split.
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('success_pos', 'failure_pos')
+
     def __init__(
         self,
         seed,
@@ -18,6 +18,19 @@ class MultiRoomEnv(MiniGridEnv):
     Environment with multiple rooms (subgoals)
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('rooms', 'goal_pos', 'num_gen_attempts', 'num_gen_restarts')
+
+    # Set this to True to generate the rooms with _placeRooms(), which
+    # backtracks locally instead of restarting from the first room. The
+    # generated layouts differ, so this is disabled by default.
+    constructive_gen = False
+
+    # Maximum number of room placement attempts from a first room,
+    # and of first rooms tried, with the constructive generator
+    max_gen_attempts = 200
+    max_gen_restarts = 100
+
     def __init__(self,
         minNumRooms,
         maxNumRooms,
@@ -44,7 +57,18 @@ class MultiRoomEnv(MiniGridEnv):
         # Choose a random number of rooms to generate
         numRooms = self._rand_int(self.minNumRooms, self.maxNumRooms+1)
 
+        # Number of room placement attempts, and of times the placement
+        # was restarted from a new first room, for this reset
+        self.num_gen_attempts = 0
+        self.num_gen_restarts = 0
+
+        if self.constructive_gen:
+            roomList = self._placeRooms(numRooms, minSz=4, maxSz=self.maxRoomSize)
+
         while len(roomList) < numRooms:
+            if self.num_gen_attempts > 0:
+                self.num_gen_restarts += 1
+
             curRoomList = []
 
             entryDoorPos = (
@@ -125,6 +149,8 @@ class MultiRoomEnv(MiniGridEnv):
         entryDoorWall,
         entryDoorPos
     ):
+        self.num_gen_attempts += 1
+
         # Choose the room size randomly
         sizeX = self._rand_int(minSz, maxSz+1)
         sizeY = self._rand_int(minSz, maxSz+1)
@@ -236,6 +262,143 @@ class MultiRoomEnv(MiniGridEnv):
 
         return True
 
+    def _placeRooms(self, numRooms, minSz, maxSz):
+        """
+        Generate a chain of numRooms rooms. Each room is placed next to
+        the exit door of the previous one, with its position drawn among
+        the positions which fit in the grid. The rooms placed so far are
+        kept in an occupancy raster, and when no room fits after an exit
+        door, the generator backtracks to the previous room instead of
+        restarting from scratch. It only restarts from a new first room
+        when max_gen_attempts attempts are used up.
+        """
+
+        width, height = self.width, self.height
+
+        # Number of rooms covering each cell, excluding the last room,
+        # which the next room may overlap. This has an extra row and
+        # column, since the overlap test extends rooms by one cell.
+        occupied = np.zeros((width + 1, height + 1), dtype=np.int32)
+
+        for restart in range(self.max_gen_restarts):
+            if restart > 0:
+                self.num_gen_restarts += 1
+            attemptLimit = self.num_gen_attempts + self.max_gen_attempts
+
+            sizeX = self._rand_int(minSz, maxSz+1)
+            sizeY = self._rand_int(minSz, maxSz+1)
+            topX = self._rand_int(0, width - sizeX + 1)
+            topY = self._rand_int(0, height - sizeY)
+            self.num_gen_attempts += 1
+
+            roomList = [Room((topX, topY), (sizeX, sizeY), (topX, topY), None)]
+            if self._extendRooms(numRooms, roomList, occupied, minSz, maxSz, 2, attemptLimit):
+                return roomList
+
+        raise RecursionError('failed to place the rooms in _placeRooms')
+
+    def _extendRooms(self, numRooms, roomList, occupied, minSz, maxSz, entryDoorWall, attemptLimit):
+        """
+        Add rooms after the last room of roomList, until there are numRooms
+        rooms. Returns False if the rooms could not be placed before the
+        attempt count reaches attemptLimit, leaving roomList and occupied
+        unchanged.
+        """
+
+        if len(roomList) == numRooms:
+            return True
+
+        room = roomList[-1]
+        topX, topY = room.top
+        sizeX, sizeY = room.size
+
+        # Summed area table of the occupancy raster, for overlap tests
+        areas = np.zeros((self.width + 2, self.height + 2), dtype=np.int32)
+        areas[1:, 1:] = occupied.cumsum(0).cumsum(1)
+
+        for i in range(0, 8):
+            if self.num_gen_attempts >= attemptLimit:
+                return False
+            self.num_gen_attempts += 1
+
+            # Pick the exit door position, on a wall other than the entry one
+            exitDoorWall = self._rand_elem([w for w in range(4) if w != entryDoorWall])
+            if exitDoorWall == 0:
+                exitDoorPos = (topX + sizeX - 1, topY + self._rand_int(1, sizeY - 1))
+            elif exitDoorWall == 1:
+                exitDoorPos = (topX + self._rand_int(1, sizeX - 1), topY + sizeY - 1)
+            elif exitDoorWall == 2:
+                exitDoorPos = (topX, topY + self._rand_int(1, sizeY - 1))
+            else:
+                exitDoorPos = (topX + self._rand_int(1, sizeX - 1), topY)
+
+            nextRoom = self._drawRoom(exitDoorWall, exitDoorPos, minSz, maxSz, areas)
+            if nextRoom is None:
+                continue
+
+            occupied[topX:topX+sizeX, topY:topY+sizeY] += 1
+            roomList.append(nextRoom)
+
+            nextEntryWall = (exitDoorWall + 2) % 4
+            if self._extendRooms(numRooms, roomList, occupied, minSz, maxSz, nextEntryWall, attemptLimit):
+                return True
+
+            # Backtrack, and try another exit door from the current room
+            roomList.pop()
+            occupied[topX:topX+sizeX, topY:topY+sizeY] -= 1
+
+        return False
+
+    def _drawRoom(self, exitDoorWall, exitDoorPos, minSz, maxSz, areas):
+        """
+        Draw a random room entered through the given exit door of the
+        previous room. The room size is drawn among the sizes which fit
+        in the grid, and its position along the door wall among the ones
+        which don't overlap the rooms in the summed area table areas.
+        Returns None if there is no such room.
+        """
+
+        x, y = exitDoorPos
+
+        # The door is on a vertical wall, draw the vertical position
+        if exitDoorWall in (0, 2):
+            maxSzX = min(maxSz, self.width - x if exitDoorWall == 0 else x + 1)
+            if maxSzX < minSz:
+                return None
+            sizeX = self._rand_int(minSz, maxSzX+1)
+            sizeY = self._rand_int(minSz, maxSz+1)
+            topX = x if exitDoorWall == 0 else x - sizeX + 1
+
+            # Rooms are extended by one cell in the overlap test
+            tops = np.arange(max(y - sizeY + 2, 0), min(y - 1, self.height - sizeY - 1) + 1)
+            x0, x1 = topX, topX + sizeX + 1
+            y0, y1 = tops, tops + sizeY + 1
+            overlap = areas[x1, y1] - areas[x0, y1] - areas[x1, y0] + areas[x0, y0]
+            tops = tops[overlap == 0]
+            if len(tops) == 0:
+                return None
+            topY = int(tops[self._rand_int(0, len(tops))])
+
+        # The door is on a horizontal wall, draw the horizontal position
+        else:
+            maxSzY = min(maxSz, self.height - 1 - y if exitDoorWall == 1 else y + 1)
+            if maxSzY < minSz:
+                return None
+            sizeX = self._rand_int(minSz, maxSz+1)
+            sizeY = self._rand_int(minSz, maxSzY+1)
+            topY = y if exitDoorWall == 1 else y - sizeY + 1
+
+            tops = np.arange(max(x - sizeX + 2, 0), min(x - 1, self.width - sizeX) + 1)
+            x0, x1 = tops, tops + sizeX + 1
+            y0, y1 = topY, topY + sizeY + 1
+            overlap = areas[x1, y1] - areas[x0, y1] - areas[x1, y0] + areas[x0, y0]
+            tops = tops[overlap == 0]
+            if len(tops) == 0:
+                return None
+            topX = int(tops[self._rand_int(0, len(tops))])
+
+        return Room((topX, topY), (sizeX, sizeY), exitDoorPos, None)
+
 class MultiRoomEnvN2S4(MultiRoomEnv):
     def __init__(self):
         super().__init__(
@@ -8,6 +8,9 @@ class ObstructedMazeEnv(RoomGrid):
     doors may be obstructed by a ball and keys may be hidden in boxes.
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = RoomGrid.state_attrs + ('obj', 'ball_to_find_color', 'blocking_ball_color', 'box_color', 'door_colors')
+
     def __init__(self,
         num_rows,
         num_cols,
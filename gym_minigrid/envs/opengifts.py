@@ -19,6 +19,9 @@ class GiftsEnv(MiniGridEnv):
     carrying : a WorldObject subclass, e.g. a Key
     """
 
+    # Episode counters, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('_num_opened',)
+
     def __init__(self,
                  size=8,
                  num_objs=3,
@@ -48,6 +51,15 @@ class GiftsEnv(MiniGridEnv):
             seed=seed
         )
 
+        self.reward_range = self.get_reward_range(gift_reward=gift_reward)
+
+    @classmethod
+    def get_reward_range(cls, gift_reward=10., **kwargs):
+        # Opening a gift gives up to the largest gift reward
+        if not isinstance(gift_reward, (list, tuple)):
+            gift_reward = [gift_reward, gift_reward]
+        return (min(0, *gift_reward), max(0, *gift_reward))
+
     def _gen_grid(self, width, height):
         self.grid = Grid(width, height)
 
@@ -7,6 +7,9 @@ class PutNearEnv(MiniGridEnv):
     another object through a natural language string.
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('move_type', 'moveColor', 'move_pos', 'target_type', 'target_color', 'target_pos')
+
     def __init__(
         self,
         size=6,
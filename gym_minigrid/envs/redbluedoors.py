@@ -8,6 +8,9 @@ class RedBlueDoorEnv(MiniGridEnv):
     obtain a reward.
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('red_door', 'blue_door')
+
     def __init__(self, size=8):
         self.size = size
 
@@ -7,6 +7,9 @@ class Unlock(RoomGrid):
     Unlock a door
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = RoomGrid.state_attrs + ('door',)
+
     def __init__(self, seed=None):
         room_size = 6
         super().__init__(
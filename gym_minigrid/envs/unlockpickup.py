@@ -7,6 +7,9 @@ class UnlockPickup(RoomGrid):
     Unlock a door, then pick up a box in another room
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = RoomGrid.state_attrs + ('obj',)
+
     def __init__(self, seed=None):
         room_size = 6
         super().__init__(
@@ -0,0 +1,93 @@
+from functools import lru_cache
+import numpy as np
+
+# Mask to keep Python integers within 64 bits
+MASK64 = (1 << 64) - 1
+
+# Tags separating the cell, agent, inventory and contents key domains
+AGENT_TAG = 1 << 62
+CARRYING_TAG = 1 << 61
+CONTAINED_TAG = 1 << 60
+
+def splitmix64(x):
+    """
+    Mix a 64-bit integer into a pseudo-random 64-bit key
+    """
+
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+def splitmix64_array(x):
+    """
+    Vectorized version of splitmix64 over an array of uint64 values
+    """
+
+    x = x.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+@lru_cache(maxsize=1 << 16)
+def cell_key(i, j, enc):
+    """
+    Key of an object with encoding enc (a tuple) located in cell (i, j).
+    Results are memoized since the same keys are used over and over.
+    """
+
+    type_idx, color_idx, state = enc
+    x = (int(i) << 40) | (int(j) << 24) | (int(type_idx) << 16) | (int(color_idx) << 8) | int(state)
+    return splitmix64(x)
+
+@lru_cache(maxsize=1 << 16)
+def contained_key(i, j, enc, depth):
+    """
+    Key of an object with encoding enc held, depth levels down, by the
+    object located in cell (i, j), e.g. the key in a box
+    """
+
+    return splitmix64(cell_key(i, j, enc) ^ (CONTAINED_TAG | int(depth)))
+
+def cell_keys_hash(array, mask):
+    """
+    XOR of the keys of the cells of an encoded grid where mask is set
+    """
+
+    i, j = np.nonzero(mask)
+    enc = array[i, j].astype(np.uint64)
+
+    x = (
+        (i.astype(np.uint64) << np.uint64(40)) |
+        (j.astype(np.uint64) << np.uint64(24)) |
+        (enc[:, 0] << np.uint64(16)) |
+        (enc[:, 1] << np.uint64(8)) |
+        enc[:, 2]
+    )
+
+    return int(np.bitwise_xor.reduce(splitmix64_array(x), initial=np.uint64(0)))
+
+def agent_key(pos, dir):
+    """
+    Key of the agent pose
+    """
+
+    return splitmix64(AGENT_TAG | (int(pos[0]) << 24) | (int(pos[1]) << 8) | int(dir))
+
+@lru_cache(maxsize=1 << 16)
+def carrying_key(enc):
+    """
+    Key of the object carried by the agent
+    """
+
+    type_idx, color_idx, state = enc
+    return splitmix64(CARRYING_TAG | (int(type_idx) << 16) | (int(color_idx) << 8) | int(state))
+
+@lru_cache(maxsize=1 << 16)
+def carrying_contained_key(enc, depth):
+    """
+    Key of an object with encoding enc held, depth levels down, by the
+    object carried by the agent, e.g. the key in a carried box
+    """
+
+    return splitmix64(carrying_key(enc) ^ (CONTAINED_TAG | int(depth)))
@@ -5,6 +5,9 @@ import numpy as np
 from gym import error, spaces, utils
 from gym.utils import seeding
 from .rendering import *
+from .visibility import compute_vis_mask, VisCache
+from .hashing import cell_key, contained_key, cell_keys_hash, agent_key, carrying_key, carrying_contained_key
+from .rng import buffered_np_random
 
 # Size in pixels of a tile in the full-scale human view
 TILE_PIXELS = 32
@@ -144,6 +147,7 @@ class WorldObj:
             v = Lava()
         elif obj_type == 'gift':
             v = Gift(color)
+            v.is_open = is_open
         else:
             assert False, "unknown object type in decode '%s'" % objType
 
@@ -174,17 +178,10 @@ class Floor(WorldObj):
     def can_overlap(self):
         return True
 
-    def render(self, r):
+    def render(self, img):
         # Give the floor a pale color
-        c = COLORS[self.color]
-        r.setLineColor(100, 100, 100, 0)
-        r.setColor(*c/2)
-        r.drawPolygon([
-            (1          , TILE_PIXELS),
-            (TILE_PIXELS, TILE_PIXELS),
-            (TILE_PIXELS,           1),
-            (1          ,           1)
-        ])
+        color = COLORS[self.color] / 2
+        fill_coords(img, point_in_rect(0.031, 1, 0.031, 1), color)
 
 class Lava(WorldObj):
     def __init__(self):
@@ -391,10 +388,25 @@ class Gift(WorldObj):
 class Grid:
     """
     Represent a grid and operations on it
+
+    The grid is stored as contiguous uint8 planes (type, color, state)
+    of shape (width, height, 3), using the same layout as the encoding.
+    Objects which have an identity or carry extra state (doors, keys,
+    boxes, etc.) are also kept in a sparse side-table so that `get`
+    returns the very instance that was `set`. Objects which are fully
+    described by their encoding (walls, floor, lava) only live in the
+    planes, and `get` returns a shared instance for them.
     """
 
-    # Static cache of pre-renderer tiles
-    tile_cache = {}
+    # Static cache of pre-rendered tiles. Its limits can be changed
+    # by setting max_size and max_bytes, or by replacing the cache.
+    tile_cache = TileCache()
+
+    # Shared instances returned for objects that only live in the planes
+    plane_objs = {}
+
+    # Type indices of the objects that only live in the planes
+    plane_type_idxs = [OBJECT_TO_IDX[t] for t in ('wall', 'floor', 'lava')]
 
     def __init__(self, width, height):
         assert width >= 3
@@ -403,21 +415,108 @@ class Grid:
         self.width = width
         self.height = height
 
-        self.grid = [None] * width * height
+        # Type, color and state planes, empty cells are (empty, 0, 0)
+        self.array = np.zeros(shape=(width, height, 3), dtype=np.uint8)
+        self.array[:, :, 0] = OBJECT_TO_IDX['empty']
+
+        # Side-table of objects stored by identity, keyed by (i, j)
+        self.objs = {}
+
+        # Planes padded with walls, see padded()
+        self.buf = None
+        self.pad = 0
+
+        # Hash of the contents of the grid, computed on first use, and
+        # the keys of the side-table objects included in it, see hash()
+        self.cell_hash = None
+        self.obj_keys = None
+
+        # Count of the modifications made through set(), update(),
+        # clear() and set_state(), to detect if the grid has changed
+        self.version = 0
+
+    def __getstate__(self):
+        # The planes are a view into the padded buffer, which copying
+        # or pickling would not preserve, so the buffer is dropped
+        state = self.__dict__.copy()
+        state['buf'] = None
+        state['pad'] = 0
+        return state
+
+    @staticmethod
+    def is_plane_obj(v):
+        """
+        Check if an object is fully described by its encoding,
+        so that it does not need to be kept in the side-table
+        """
+
+        return type(v) in (Wall, Floor, Lava)
+
+    @property
+    def grid(self):
+        """
+        Flat list of the grid cells, in row-major order
+        """
+
+        return [
+            self.get(i, j)
+            for j in range(self.height)
+            for i in range(self.width)
+        ]
+
+    def sync(self):
+        """
+        Refresh the planes from the side-table objects, whose state
+        (e.g. door open/locked, gift opened) may have been modified
+        in place since they were set, see update()
+        """
+
+        array = self.array
+        for (i, j), v in self.objs.items():
+            if tuple(array[i, j].tolist()) != v.encode():
+                self.update(i, j)
+
+    def update(self, i, j):
+        """
+        Refresh a cell whose object was modified in place (e.g. a door
+        opened, or the contents of a box changed), updating its encoding
+        and the hash of the grid
+        """
+
+        key = (int(i), int(j))
+        v = self.objs.get(key)
+        if v is None:
+            return
+
+        self.version += 1
+        self.array[i, j] = v.encode()
+
+        if self.cell_hash is not None:
+            obj_key = Grid.obj_key(i, j, v)
+            self.cell_hash ^= self.obj_keys[key] ^ obj_key
+            self.obj_keys[key] = obj_key
 
     def __contains__(self, key):
         if isinstance(key, WorldObj):
-            for e in self.grid:
+            if Grid.is_plane_obj(key):
+                # Plane objects have no identity, match on their encoding
+                self.sync()
+                match = np.all(self.array == key.encode(), axis=2)
+                return bool(match.any())
+            for e in self.objs.values():
                 if e is key:
                     return True
         elif isinstance(key, tuple):
-            for e in self.grid:
-                if e is None:
-                    continue
-                if (e.color, e.type) == key:
-                    return True
-                if key[0] is None and key[1] == e.type:
-                    return True
+            color, type = key
+            if type not in OBJECT_TO_IDX or type in ('empty', 'unseen'):
+                return False
+            self.sync()
+            match = self.array[:, :, 0] == OBJECT_TO_IDX[type]
+            if color is not None:
+                if color not in COLOR_TO_IDX:
+                    return False
+                match &= self.array[:, :, 1] == COLOR_TO_IDX[color]
+            return bool(match.any())
         return False
 
     def __eq__(self, other):
@@ -432,15 +531,179 @@ class Grid:
         from copy import deepcopy
         return deepcopy(self)
 
+    @staticmethod
+    def obj_state(v):
+        """
+        Copy the attributes of an object, and of the objects it contains
+        (e.g. the key in a box), see restore_obj()
+        """
+
+        contains = getattr(v, 'contains', None)
+        return v.__dict__.copy(), None if contains is None else Grid.obj_state(contains)
+
+    @staticmethod
+    def restore_obj(v, state):
+        """
+        Restore the attributes of an object copied by obj_state()
+        """
+
+        attrs, contains = state
+        v.__dict__.update(attrs)
+        if contains is not None:
+            Grid.restore_obj(v.contains, contains)
+
+    def get_state(self):
+        """
+        Snapshot the contents of the grid: a copy of the planes, and the
+        side-table objects along with a copy of their attributes, so that
+        objects keep their identity when the state is restored
+        """
+
+        objs = tuple(
+            (pos, v, Grid.obj_state(v))
+            for pos, v in self.objs.items()
+        )
+
+        obj_keys = None if self.obj_keys is None else self.obj_keys.copy()
+
+        return self.array.copy(), objs, self.cell_hash, obj_keys
+
+    def set_state(self, state):
+        """
+        Restore the contents of the grid from a snapshot
+        """
+
+        array, objs, cell_hash, obj_keys = state
+
+        self.array[:, :] = array
+        self.objs = {}
+        self.cell_hash = cell_hash
+        self.obj_keys = None if obj_keys is None else obj_keys.copy()
+        self.version += 1
+
+        for pos, v, obj_state in objs:
+            Grid.restore_obj(v, obj_state)
+            self.objs[pos] = v
+
     def set(self, i, j, v):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
-        self.grid[j * self.width + i] = v
+
+        key = (int(i), int(j))
+        self.version += 1
+
+        # Remove the previous contents of the cell from the hash
+        if self.cell_hash is not None:
+            if key in self.obj_keys:
+                self.cell_hash ^= self.obj_keys.pop(key)
+            elif self.array[i, j, 0] != OBJECT_TO_IDX['empty']:
+                self.cell_hash ^= cell_key(i, j, tuple(self.array[i, j]))
+
+        if v is None:
+            self.array[i, j] = (OBJECT_TO_IDX['empty'], 0, 0)
+            self.objs.pop(key, None)
+            return
+
+        self.array[i, j] = v.encode()
+
+        if Grid.is_plane_obj(v):
+            self.objs.pop(key, None)
+        else:
+            self.objs[key] = v
+
+        if self.cell_hash is not None:
+            obj_key = Grid.obj_key(i, j, v)
+            self.cell_hash ^= obj_key
+            if key in self.objs:
+                self.obj_keys[key] = obj_key
 
     def get(self, i, j):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
-        return self.grid[j * self.width + i]
+
+        v = self.objs.get((int(i), int(j)))
+        if v is not None:
+            return v
+
+        type_idx, color_idx, state = self.array[i, j]
+        if type_idx == OBJECT_TO_IDX['empty']:
+            return None
+
+        key = (int(type_idx), int(color_idx), int(state))
+        v = Grid.plane_objs.get(key)
+        if v is None:
+            v = WorldObj.decode(*key)
+            Grid.plane_objs[key] = v
+
+        return v
+
+    @staticmethod
+    def obj_key(i, j, v):
+        """
+        Hash key of an object located in cell (i, j), including the
+        objects it contains
+        """
+
+        h = cell_key(i, j, v.encode())
+
+        depth = 0
+        v = getattr(v, 'contains', None)
+        while v is not None:
+            depth += 1
+            h ^= contained_key(i, j, v.encode(), depth)
+            v = getattr(v, 'contains', None)
+
+        return h
+
+    @staticmethod
+    def carried_obj_key(v):
+        """
+        Hash key of the object carried by the agent, including the
+        objects it contains, see obj_key()
+        """
+
+        h = carrying_key(v.encode())
+
+        depth = 0
+        v = getattr(v, 'contains', None)
+        while v is not None:
+            depth += 1
+            h ^= carrying_contained_key(v.encode(), depth)
+            v = getattr(v, 'contains', None)
+
+        return h
+
+    def hash(self):
+        """
+        Compute a 64-bit Zobrist-style hash of the contents of the grid,
+        the XOR of a key per non-empty cell and encoding, see obj_key().
+        The hash is computed on first use, then maintained incrementally
+        by set() and update(). The keys of the side-table objects are
+        checked first, so objects modified in place (e.g. a door opened
+        by a wrapper, or the contents of a box) are accounted for.
+        """
+
+        if self.cell_hash is not None:
+            obj_keys = self.obj_keys
+            for (i, j), v in self.objs.items():
+                if Grid.obj_key(i, j, v) != obj_keys[(i, j)]:
+                    self.update(i, j)
+        else:
+            plane = np.isin(self.array[:, :, 0], Grid.plane_type_idxs)
+            for i, j in self.objs:
+                plane[i, j] = False
+
+            self.obj_keys = {
+                (i, j): Grid.obj_key(i, j, v)
+                for (i, j), v in self.objs.items()
+            }
+
+            h = cell_keys_hash(self.array, plane)
+            for obj_key in self.obj_keys.values():
+                h ^= obj_key
+            self.cell_hash = h
+
+        return self.cell_hash
 
     def horz_wall(self, x, y, length=None, obj_type=Wall):
         if length is None:
@@ -467,10 +730,12 @@ class Grid:
 
         grid = Grid(self.height, self.width)
 
-        for i in range(self.width):
-            for j in range(self.height):
-                v = self.get(i, j)
-                grid.set(j, grid.height - 1 - i, v)
+        # Cell (i, j) moves to (j, width - 1 - i)
+        self.sync()
+        grid.array[:, :] = np.rot90(self.array, k=-1)
+
+        for (i, j), v in self.objs.items():
+            grid.objs[(j, self.width - 1 - i)] = v
 
         return grid
 
@@ -481,18 +746,22 @@ class Grid:
 
         grid = Grid(width, height)
 
-        for j in range(0, height):
-            for i in range(0, width):
-                x = topX + i
-                y = topY + j
+        # Cells outside of the grid are seen as walls
+        grid.array[:, :] = Wall().encode()
 
-                if x >= 0 and x < self.width and \
-                   y >= 0 and y < self.height:
-                    v = self.get(x, y)
-                else:
-                    v = Wall()
+        # Extents of the overlap with this grid, in this grid's coordinates
+        x0 = max(topX, 0)
+        y0 = max(topY, 0)
+        x1 = min(topX + width, self.width)
+        y1 = min(topY + height, self.height)
 
-                grid.set(i, j, v)
+        if x0 < x1 and y0 < y1:
+            self.sync()
+            grid.array[x0-topX:x1-topX, y0-topY:y1-topY] = self.array[x0:x1, y0:y1]
+
+            for (i, j), v in self.objs.items():
+                if x0 <= i < x1 and y0 <= j < y1:
+                    grid.objs[(i - topX, j - topY)] = v
 
         return grid
 
@@ -513,8 +782,34 @@ class Grid:
         key = (agent_dir, highlight, tile_size)
         key = obj.encode() + key if obj else key
 
-        if key in cls.tile_cache:
-            return cls.tile_cache[key]
+        img = cls.tile_cache.get(key)
+        if img is not None:
+            return img
+
+        # Use the precomputed tile if an atlas was loaded for this size
+        atlas = TileAtlas.loaded.get((tile_size, subdivs))
+
+        if atlas is not None and (obj is None or type(obj) in TileAtlas.obj_classes):
+            img = atlas.tile(obj, agent_dir, highlight)
+        else:
+            img = cls.draw_tile(obj, agent_dir, highlight, tile_size, subdivs).astype(np.uint8)
+
+        # Cache the rendered tile
+        cls.tile_cache[key] = img
+
+        return img
+
+    @staticmethod
+    def draw_tile(
+        obj,
+        agent_dir=None,
+        highlight=False,
+        tile_size=TILE_PIXELS,
+        subdivs=3
+    ):
+        """
+        Draw a tile, without caching
+        """
 
         img = np.zeros(shape=(tile_size * subdivs, tile_size * subdivs, 3), dtype=np.uint8)
 
@@ -542,26 +837,31 @@ class Grid:
             highlight_img(img)
 
         # Downsample the image to perform supersampling/anti-aliasing
-        img = downsample(img, subdivs)
-
-        # Cache the rendered tile
-        cls.tile_cache[key] = img
-
-        return img
+        return downsample(img, subdivs)
 
     def render(
         self,
         tile_size,
         agent_pos=None,
         agent_dir=None,
-        highlight_mask=None
+        highlight_mask=None,
+        frame=None
     ):
         """
         Render this grid at a given scale
         :param r: target renderer object
         :param tile_size: tile size in pixels
+        :param frame: optional FrameBuffer holding the previous frame,
+                      so that only the cells which changed get redrawn
         """
 
+        # Objects whose rendering only depends on their encoding
+        # can be rendered in one go from the encoded grid
+        if all(type(v) in TileAtlas.obj_classes for v in self.objs.values()):
+            self.sync()
+            tiles = CachedTiles(tile_size)
+            return tiles.render(self.array, agent_pos, agent_dir, highlight_mask, frame)
+
         if highlight_mask is None:
             highlight_mask = np.zeros(shape=(self.width, self.height), dtype=np.bool)
 
@@ -597,23 +897,12 @@ class Grid:
         Produce a compact numpy encoding of the grid
         """
 
-        if vis_mask is None:
-            vis_mask = np.ones((self.width, self.height), dtype=bool)
-
-        array = np.zeros((self.width, self.height, 3), dtype='uint8')
-
-        for i in range(self.width):
-            for j in range(self.height):
-                if vis_mask[i, j]:
-                    v = self.get(i, j)
+        self.sync()
+        array = self.array.copy()
 
-                    if v is None:
-                        array[i, j, 0] = OBJECT_TO_IDX['empty']
-                        array[i, j, 1] = 0
-                        array[i, j, 2] = 0
-
-                    else:
-                        array[i, j, :] = v.encode()
+        # Cells which are not visible are encoded as unseen (all zeros)
+        if vis_mask is not None:
+            array[~vis_mask] = 0
 
         return array
 
@@ -626,54 +915,89 @@ class Grid:
         width, height, channels = array.shape
         assert channels == 3
 
-        vis_mask = np.ones(shape=(width, height), dtype=np.bool)
+        types = array[:, :, 0]
+        vis_mask = types != OBJECT_TO_IDX['unseen']
 
         grid = Grid(width, height)
-        for i in range(width):
-            for j in range(height):
-                type_idx, color_idx, state = array[i, j]
-                v = WorldObj.decode(type_idx, color_idx, state)
-                grid.set(i, j, v)
-                vis_mask[i, j] = (type_idx != OBJECT_TO_IDX['unseen'])
+
+        # Plane objects are copied over directly, the remaining
+        # objects are instantiated into the side-table
+        plane = np.isin(types, Grid.plane_type_idxs)
+        grid.array[plane] = array[plane]
+
+        objs = vis_mask & ~plane & (types != OBJECT_TO_IDX['empty'])
+        for i, j in zip(*np.nonzero(objs)):
+            type_idx, color_idx, state = array[i, j]
+            v = WorldObj.decode(int(type_idx), int(color_idx), int(state))
+            grid.set(i, j, v)
 
         return grid, vis_mask
 
-    def process_vis(grid, agent_pos):
-        mask = np.zeros(shape=(grid.width, grid.height), dtype=np.bool)
+    def padded(self, pad):
+        """
+        Get the planes padded with walls by at least pad cells on each
+        side, along with the actual padding. The planes of the grid are
+        a view into the padded buffer, so it stays up to date as cells
+        are set, and is only reallocated when more padding is needed.
+        """
 
-        mask[agent_pos[0], agent_pos[1]] = True
+        if self.buf is None or self.pad < pad:
+            buf = np.empty(
+                shape=(self.width + 2 * pad, self.height + 2 * pad, 3),
+                dtype=np.uint8
+            )
+            buf[:, :] = Wall().encode()
+            buf[pad:pad+self.width, pad:pad+self.height] = self.array
 
-        for j in reversed(range(0, grid.height)):
-            for i in range(0, grid.width-1):
-                if not mask[i, j]:
-                    continue
+            self.buf = buf
+            self.pad = pad
+            self.array = buf[pad:pad+self.width, pad:pad+self.height]
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+        self.sync()
 
-                mask[i+1, j] = True
-                if j > 0:
-                    mask[i+1, j-1] = True
-                    mask[i, j-1] = True
+        return self.buf, self.pad
 
-            for i in reversed(range(1, grid.width)):
-                if not mask[i, j]:
-                    continue
+    @staticmethod
+    def array_opacity(array, objs):
+        """
+        Compute the opacity of cells from their planes and side-table
+        """
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+        opaque = array[:, :, 0] == OBJECT_TO_IDX['wall']
+
+        for pos, v in objs.items():
+            opaque[pos] = not v.see_behind()
+
+        return opaque
 
-                mask[i-1, j] = True
-                if j > 0:
-                    mask[i-1, j-1] = True
-                    mask[i, j-1] = True
+    def opacity(self):
+        """
+        Compute a boolean array of shape (width, height) telling which
+        cells the agent cannot see behind
+        """
+
+        return Grid.array_opacity(self.array, self.objs)
 
-        for j in range(0, grid.height):
-            for i in range(0, grid.width):
-                if not mask[i, j]:
-                    grid.set(i, j, None)
+    def clear(self, mask):
+        """
+        Empty all the cells where mask is set
+        """
+
+        self.array[mask] = (OBJECT_TO_IDX['empty'], 0, 0)
+        self.cell_hash = None
+        self.obj_keys = None
+        self.version += 1
+
+        for key in [k for k in self.objs if mask[k]]:
+            del self.objs[key]
+
+    def process_vis(grid, agent_pos, vis_cache=None):
+        if vis_cache is not None:
+            mask = vis_cache.get_mask(grid.opacity(), agent_pos)
+        else:
+            mask = compute_vis_mask(grid.opacity(), agent_pos)
+
+        grid.clear(~mask)
 
         return mask
 
@@ -704,6 +1028,34 @@ class MiniGridEnv(gym.Env):
         # Done completing task
         done = 6
 
+    # Set this to True to report the state hash in the step info
+    hash_in_info = False
+
+    # Attributes holding the state of an episode, saved by get_state().
+    # Subclasses add the attributes set by their generator or updated
+    # during an episode, configuration and caches are left out.
+    state_attrs = ('grid', 'agent_pos', 'agent_dir', 'carrying', 'step_count', 'mission')
+
+    # Set this to True to have place_obj() sample positions directly among
+    # the free cells instead of by rejection sampling. This changes the
+    # layouts generated for a given seed, so it is disabled by default.
+    fast_placement = False
+
+    # Set this to True to seed the environment with a BufferedRNG, which
+    # makes generating levels faster. The random streams differ from the
+    # legacy RandomState ones, so this also changes the generated layouts.
+    buffered_rng = False
+
+    # Static cache of view index maps, see view_index_maps()
+    index_maps = {}
+
+    # Static cache of view highlight maps, see view_highlight_maps()
+    highlight_maps = {}
+
+    # Static cache of visibility masks, shared by all environments
+    # Set this to None on an environment to disable caching
+    vis_cache = VisCache()
+
     def __init__(
         self,
         grid_size=None,
@@ -747,6 +1099,12 @@ class MiniGridEnv(gym.Env):
         # Window to use for human rendering mode
         self.window = None
 
+        # Previous frame, to render consecutive frames incrementally
+        self.frame = FrameBuffer()
+
+        # Visibility mask computed by the last call to gen_obs()
+        self.last_vis_mask = None
+
         # Environment configuration
         self.width = width
         self.height = height
@@ -793,13 +1151,79 @@ class MiniGridEnv(gym.Env):
 
     def seed(self, seed=1337):
         # Seed the random number generator
-        self.np_random, _ = seeding.np_random(seed)
+        if self.buffered_rng:
+            self.np_random, _ = buffered_np_random(seed)
+        else:
+            self.np_random, _ = seeding.np_random(seed)
         return [seed]
 
+    def get_state(self, rng=True):
+        """
+        Snapshot the state of the current episode: the grid, the agent
+        pose, the carried object, the step count, the RNG state, and the
+        attributes listed in state_attrs. The configuration of the
+        environment (e.g. max_steps, agent_view_size) is not part of the
+        snapshot. The snapshot can be restored any number of times with
+        set_state(), and remains valid across episodes.
+
+        Saving the RNG state makes up most of the cost of a snapshot.
+        Planners can pass rng=False when the dynamics of the environment
+        don't draw random numbers during an episode, in which case the
+        RNG is left untouched on restore.
+        """
+
+        attrs = {name: getattr(self, name) for name in self.state_attrs}
+
+        carrying = None
+        if self.carrying is not None:
+            carrying = Grid.obj_state(self.carrying)
+
+        return {
+            'attrs': attrs,
+            'grid': self.grid.get_state(),
+            'carrying': carrying,
+            'rng': self.np_random.get_state() if rng else None
+        }
+
+    def set_state(self, state):
+        """
+        Restore the environment to a snapshot taken with get_state()
+        """
+
+        for name, value in state['attrs'].items():
+            setattr(self, name, value)
+
+        self.grid.set_state(state['grid'])
+        self.last_vis_mask = None
+
+        if self.carrying is not None:
+            Grid.restore_obj(self.carrying, state['carrying'])
+
+        if state['rng'] is not None:
+            self.np_random.set_state(state['rng'])
+
     @property
     def steps_remaining(self):
         return self.max_steps - self.step_count
 
+    @property
+    def state_hash(self):
+        """
+        64-bit hash of the state of the world: the contents of the grid,
+        including door and gift states and moved objects, the agent pose
+        and the carried object, along with the contents of boxes. The step
+        count is not included. The grid part is maintained incrementally
+        as cells change, so this costs a pass over the side-table objects
+        rather than over the whole grid.
+        """
+
+        h = self.grid.hash() ^ agent_key(self.agent_pos, self.agent_dir)
+
+        if self.carrying is not None:
+            h ^= Grid.carried_obj_key(self.carrying)
+
+        return h
+
     def __str__(self):
         """
         Produce a pretty string of the environment's grid along with the agent.
@@ -865,6 +1289,15 @@ class MiniGridEnv(gym.Env):
     def _gen_grid(self, width, height):
         assert False, "_gen_grid needs to be implemented by each environment"
 
+    @classmethod
+    def get_reward_range(cls, **kwargs):
+        """
+        Range of the rewards of the environment constructed with the
+        given arguments, without constructing it
+        """
+
+        return (0, 1)
+
     def _reward(self):
         """
         Compute the reward to be given upon success
@@ -898,7 +1331,10 @@ class MiniGridEnv(gym.Env):
         Pick a random element in a list
         """
 
-        lst = list(iterable)
+        if isinstance(iterable, (list, tuple, range)):
+            lst = iterable
+        else:
+            lst = list(iterable)
         idx = self._rand_int(0, len(lst))
         return lst[idx]
 
@@ -944,7 +1380,10 @@ class MiniGridEnv(gym.Env):
         max_tries=math.inf
     ):
         """
-        Place an object at an empty position in the grid
+        Place an object at an empty position in the grid. Positions are
+        drawn with sample_free_pos() if fast_placement is set, and by
+        rejection sampling otherwise, in which case max_tries bounds
+        the number of draws.
 
         :param top: top-left position of the rectangle where to place
         :param size: size of the rectangle where to place
@@ -959,6 +1398,25 @@ class MiniGridEnv(gym.Env):
         if size is None:
             size = (self.grid.width, self.grid.height)
 
+        if self.fast_placement:
+            pos = self.sample_free_pos(top, size, reject_fn)
+        else:
+            pos = self.reject_sample_pos(top, size, reject_fn, max_tries)
+
+        self.grid.set(*pos, obj)
+
+        if obj is not None:
+            obj.init_pos = pos
+            obj.cur_pos = pos
+
+        return pos
+
+    def reject_sample_pos(self, top, size, reject_fn=None, max_tries=math.inf):
+        """
+        Sample an empty position in a rectangle by rejection sampling.
+        This is the legacy placement method, see place_obj().
+        """
+
         num_tries = 0
 
         while True:
@@ -988,13 +1446,56 @@ class MiniGridEnv(gym.Env):
 
             break
 
-        self.grid.set(*pos, obj)
+        return pos
 
-        if obj is not None:
-            obj.init_pos = pos
-            obj.cur_pos = pos
+    def sample_free_pos(self, top, size, reject_fn=None):
+        """
+        Sample an empty position in a rectangle, uniformly among the cells
+        which are not occupied by an object or the agent and which are
+        not rejected by reject_fn. The free cells are read from the type
+        plane of the grid, so each position is drawn with a single call
+        to the RNG, and unsatisfiable placements fail immediately.
+
+        If reject_fn has a true `vectorized` attribute, it is called once
+        with a pair of arrays (xs, ys) of candidate positions and returns
+        a boolean array. Other functions are called on one candidate at a
+        time, removing rejected candidates until one is accepted.
+        """
 
-        return pos
+        x0, y0 = top
+        x1 = min(x0 + size[0], self.grid.width)
+        y1 = min(y0 + size[1], self.grid.height)
+
+        free = self.grid.array[x0:x1, y0:y1, 0] == OBJECT_TO_IDX['empty']
+
+        if self.agent_pos is not None:
+            ax, ay = self.agent_pos
+            if x0 <= ax < x1 and y0 <= ay < y1:
+                free[ax - x0, ay - y0] = False
+
+        # Flat indices of the candidate cells within the rectangle
+        cells = np.flatnonzero(free)
+
+        if reject_fn is not None and getattr(reject_fn, 'vectorized', False):
+            xs, ys = np.divmod(cells, y1 - y0)
+            cells = cells[~np.asarray(reject_fn(self, (xs + x0, ys + y0)), dtype=bool)]
+            reject_fn = None
+
+        num_cells = len(cells)
+
+        while num_cells > 0:
+            idx = self._rand_int(0, num_cells)
+            x, y = divmod(int(cells[idx]), y1 - y0)
+            pos = np.array((x + x0, y + y0))
+
+            if reject_fn is None or not reject_fn(self, pos):
+                return pos
+
+            # Remove the rejected candidate
+            num_cells -= 1
+            cells[idx] = cells[num_cells]
+
+        raise RecursionError('no free position to place an object in place_obj')
 
     def put_obj(self, obj, i, j):
         """
@@ -1197,6 +1698,7 @@ class MiniGridEnv(gym.Env):
         elif action == self.actions.toggle:
             if fwd_cell:
                 info['toggle_succeeded'] = fwd_cell.toggle(self, fwd_pos)
+                self.grid.update(*fwd_pos)
 
         # Done action (not used by default)
         elif action == self.actions.done:
@@ -1208,10 +1710,179 @@ class MiniGridEnv(gym.Env):
         if self.step_count >= self.max_steps:
             done = True
 
+        if self.hash_in_info:
+            info['state_hash'] = self.state_hash
+
         obs = self.gen_obs()
 
         return obs, reward, done, info
 
+    @classmethod
+    def view_index_maps(cls, view_size, agent_dir):
+        """
+        Get the offsets, relative to the agent position, of the grid cells
+        seen at each position (i, j) of the agent's view when facing
+        agent_dir, as two arrays of shape (view_size, view_size). Also
+        returns the inverse map, an array giving the flat view index of
+        each offset (dx, dy) at [dx + view_size - 1, dy + view_size - 1],
+        or -1 if it is not in view. These are computed once per view size
+        and direction, by slicing and rotating offsets the same way the
+        grid itself would be.
+        """
+
+        key = (view_size, agent_dir)
+
+        if key not in cls.index_maps:
+            sz = view_size
+            hs = view_size // 2
+
+            # Top-left corner of the view, see get_view_exts()
+            topX, topY = [(0, -hs), (-hs, 0), (-sz + 1, -hs), (-hs, -sz + 1)][agent_dir]
+
+            xs, ys = np.meshgrid(
+                np.arange(topX, topX + sz),
+                np.arange(topY, topY + sz),
+                indexing='ij'
+            )
+
+            for i in range(agent_dir + 1):
+                xs = np.rot90(xs, k=-1)
+                ys = np.rot90(ys, k=-1)
+
+            inverse = np.full(shape=(2 * sz - 1, 2 * sz - 1), fill_value=-1)
+            inverse[xs + sz - 1, ys + sz - 1] = np.arange(sz * sz).reshape(sz, sz)
+
+            cls.index_maps[key] = (
+                np.ascontiguousarray(xs),
+                np.ascontiguousarray(ys),
+                inverse
+            )
+
+        return cls.index_maps[key]
+
+    @classmethod
+    def view_highlight_maps(cls, view_size, agent_dir):
+        """
+        Get the offsets, relative to the agent position, of the grid cells
+        highlighted for each position (i, j) of the agent's view when
+        facing agent_dir, as two arrays of shape (view_size, view_size).
+        These are computed once per view size and direction.
+        """
+
+        key = (view_size, agent_dir)
+
+        if key not in cls.highlight_maps:
+            f_vec = DIR_TO_VEC[agent_dir]
+            r_vec = np.array((-f_vec[1], f_vec[0]))
+
+            vis_i, vis_j = np.meshgrid(
+                np.arange(view_size),
+                np.arange(view_size),
+                indexing='ij'
+            )
+
+            # Offsets of the view cells from the top-left
+            # corner of the view, as in render()
+            top_left = f_vec * (view_size - 1) - r_vec * (view_size // 2)
+            xs = top_left[0] - f_vec[0] * vis_j + r_vec[0] * vis_i
+            ys = top_left[1] - f_vec[1] * vis_j + r_vec[1] * vis_i
+
+            cls.highlight_maps[key] = (xs, ys)
+
+        return cls.highlight_maps[key]
+
+    def gen_view(self):
+        """
+        Gather the planes of the grid cells in the agent's field of view,
+        rotated so that the agent is at the bottom and facing up, along
+        with the side-table objects in view, keyed by view coordinates.
+        Cells outside of the grid are seen as walls.
+        """
+
+        sz = self.agent_view_size
+        ax, ay = self.agent_pos
+        ax, ay = int(ax), int(ay)
+
+        # Single gather from the wall-padded planes
+        buf, pad = self.grid.padded(sz - 1)
+        xs, ys, inverse = self.view_index_maps(sz, self.agent_dir)
+        array = buf[xs + (ax + pad), ys + (ay + pad)]
+
+        # Map the side-table objects into view coordinates
+        objs = {}
+        for (i, j), v in self.grid.objs.items():
+            lx = i - ax + sz - 1
+            ly = j - ay + sz - 1
+            if 0 <= lx < 2 * sz - 1 and 0 <= ly < 2 * sz - 1:
+                idx = inverse[lx, ly]
+                if idx >= 0:
+                    objs[divmod(int(idx), sz)] = v
+
+        return array, objs
+
+    def gen_view_grid(self):
+        """
+        Generate the sub-grid in the agent's field of view, rotated so
+        that the agent is at the bottom and facing up, before occlusion
+        is processed
+        """
+
+        array, objs = self.gen_view()
+
+        grid = Grid(self.agent_view_size, self.agent_view_size)
+        grid.array[:, :] = array
+        grid.objs = objs
+
+        return grid
+
+    def gen_vis_mask(self, array, objs):
+        """
+        Compute the visibility mask of the agent's view. The mask may be
+        shared with the visibility cache, and is then read-only.
+        """
+
+        if self.see_through_walls:
+            return np.ones(shape=array.shape[:2], dtype=bool)
+
+        opaque = Grid.array_opacity(array, objs)
+        agent_pos = (self.agent_view_size // 2, self.agent_view_size - 1)
+
+        if self.vis_cache is not None:
+            return self.vis_cache.get_mask(opaque, agent_pos)
+
+        return compute_vis_mask(opaque, agent_pos)
+
+    def vis_mask_key(self):
+        """
+        Everything, besides the grid object itself, that the visibility
+        mask of the agent's view depends on. Objects modified in place
+        (e.g. a door opened outside of step()) change the grid version
+        once the grid is synced, see Grid.sync().
+        """
+
+        return (
+            self.grid.version,
+            tuple(self.agent_pos),
+            self.agent_dir,
+            self.agent_view_size,
+            self.see_through_walls
+        )
+
+    def get_vis_mask(self):
+        """
+        Get the visibility mask of the agent's view, reusing the mask
+        computed by the last call to gen_obs() if neither the grid nor
+        the agent pose have changed since
+        """
+
+        self.grid.sync()
+
+        last = self.last_vis_mask
+        if last is not None and last[0] is self.grid and last[1] == self.vis_mask_key():
+            return last[2]
+
+        return self.gen_vis_mask(*self.gen_view())
+
     def gen_obs_grid(self):
         """
         Generate the sub-grid observed by the agent.
@@ -1219,19 +1890,12 @@ class MiniGridEnv(gym.Env):
         cells the agent can actually see.
         """
 
-        topX, topY, botX, botY = self.get_view_exts()
+        grid = self.gen_view_grid()
 
-        grid = self.grid.slice(topX, topY, self.agent_view_size, self.agent_view_size)
-
-        for i in range(self.agent_dir + 1):
-            grid = grid.rotate_left()
-
-        # Process occluders and visibility
-        # Note that this incurs some performance cost
-        if not self.see_through_walls:
-            vis_mask = grid.process_vis(agent_pos=(self.agent_view_size // 2 , self.agent_view_size - 1))
-        else:
-            vis_mask = np.ones(shape=(grid.width, grid.height), dtype=np.bool)
+        # Process occluders and visibility. Masks from the cache are
+        # shared and read-only, so the caller gets its own copy
+        vis_mask = self.gen_vis_mask(grid.array, grid.objs).copy()
+        grid.clear(~vis_mask)
 
         # Make it so the agent sees what it's carrying
         # We do this by placing the carried object at the agent's position
@@ -1244,15 +1908,52 @@ class MiniGridEnv(gym.Env):
 
         return grid, vis_mask
 
+    def warm_vis_cache(self):
+        """
+        Pre-compute the visibility masks for every position and direction
+        the agent can take in the current grid
+        """
+
+        if self.see_through_walls or self.vis_cache is None:
+            return
+
+        agent_pos, agent_dir = self.agent_pos, self.agent_dir
+
+        opaques = []
+        for j in range(self.grid.height):
+            for i in range(self.grid.width):
+                cell = self.grid.get(i, j)
+                if cell is not None and not cell.can_overlap():
+                    continue
+                for d in range(4):
+                    self.agent_pos, self.agent_dir = (i, j), d
+                    opaques.append(Grid.array_opacity(*self.gen_view()))
+
+        self.agent_pos, self.agent_dir = agent_pos, agent_dir
+
+        self.vis_cache.warm(
+            opaques,
+            (self.agent_view_size // 2, self.agent_view_size - 1)
+        )
+
     def gen_obs(self):
         """
         Generate the agent's view (partially observable, low-resolution encoding)
         """
 
-        grid, vis_mask = self.gen_obs_grid()
+        image, objs = self.gen_view()
+        vis_mask = self.gen_vis_mask(image, objs)
+        self.last_vis_mask = (self.grid, self.vis_mask_key(), vis_mask)
 
-        # Encode the partially observable view into a numpy array
-        image = grid.encode(vis_mask)
+        # Make it so the agent sees what it's carrying
+        agent_pos = self.agent_view_size // 2, self.agent_view_size - 1
+        if self.carrying:
+            image[agent_pos] = self.carrying.encode()
+        else:
+            image[agent_pos] = (OBJECT_TO_IDX['empty'], 0, 0)
+
+        # Cells which are not visible are encoded as unseen
+        image[~vis_mask] = 0
 
         assert hasattr(self, 'mission'), "environments must define a textual mission string"
 
@@ -1270,17 +1971,18 @@ class MiniGridEnv(gym.Env):
 
     def get_obs_render(self, obs, tile_size=TILE_PIXELS//2):
         """
-        Render an agent observation for visualization
+        Render an agent observation for visualization. The encoded cells
+        are mapped straight to cached tiles, without decoding them into a
+        grid, and the cells which aren't unseen are highlighted.
         """
 
-        grid, vis_mask = Grid.decode(obs)
+        tiles = CachedTiles(tile_size)
 
-        # Render the whole grid
-        img = grid.render(
-            tile_size,
+        img = tiles.render(
+            obs,
             agent_pos=(self.agent_view_size // 2, self.agent_view_size - 1),
             agent_dir=3,
-            highlight_mask=vis_mask
+            highlight_mask=obs[:, :, 0] != OBJECT_TO_IDX['unseen']
         )
 
         return img
@@ -1300,42 +2002,29 @@ class MiniGridEnv(gym.Env):
             self.window = gym_minigrid.window.Window('gym_minigrid')
             self.window.show(block=False)
 
-        # Compute which cells are visible to the agent
-        _, vis_mask = self.gen_obs_grid()
-
-        # Compute the world coordinates of the bottom-left corner
-        # of the agent's view area
-        f_vec = self.dir_vec
-        r_vec = self.right_vec
-        top_left = self.agent_pos + f_vec * (self.agent_view_size-1) - r_vec * (self.agent_view_size // 2)
-
-        # Mask of which cells to highlight
-        highlight_mask = np.zeros(shape=(self.width, self.height), dtype=np.bool)
-
-        # For each cell in the visibility mask
-        for vis_j in range(0, self.agent_view_size):
-            for vis_i in range(0, self.agent_view_size):
-                # If this cell is not visible, don't highlight it
-                if not vis_mask[vis_i, vis_j]:
-                    continue
+        highlight_mask = None
 
-                # Compute the world coordinates of this cell
-                abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
+        if highlight:
+            # Compute which cells are visible to the agent
+            vis_mask = self.get_vis_mask()
 
-                if abs_i < 0 or abs_i >= self.width:
-                    continue
-                if abs_j < 0 or abs_j >= self.height:
-                    continue
+            # World coordinates of the visible cells
+            xs, ys = self.view_highlight_maps(self.agent_view_size, self.agent_dir)
+            xs = xs[vis_mask] + self.agent_pos[0]
+            ys = ys[vis_mask] + self.agent_pos[1]
+            inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
 
-                # Mark this cell to be highlighted
-                highlight_mask[abs_i, abs_j] = True
+            # Mask of which cells to highlight
+            highlight_mask = np.zeros(shape=(self.width, self.height), dtype=bool)
+            highlight_mask[xs[inside], ys[inside]] = True
 
         # Render the whole grid
         img = self.grid.render(
             tile_size,
             self.agent_pos,
             self.agent_dir,
-            highlight_mask=highlight_mask if highlight else None
+            highlight_mask=highlight_mask,
+            frame=self.frame
         )
 
         if mode == 'human':
@@ -1343,3 +2032,6 @@ class MiniGridEnv(gym.Env):
             self.window.set_caption(self.mission)
 
         return img
+
+# The atlas module builds on the classes above, so it is imported last
+from .atlas import TileAtlas, CachedTiles
@@ -0,0 +1,246 @@
+import time
+import queue
+import itertools
+import traceback
+import multiprocessing as mp
+from functools import partial
+import gym
+from .vector import make_env
+from .wrappers import reset_to_state
+
+def reset_pool_worker(env_fn, tasks, results):
+    """
+    Worker process generating the layouts of a ResetPool: for each ticket
+    and seed taken from the tasks queue, the environment is seeded and
+    reset, and a snapshot of the episode state is put in the results queue
+    """
+
+    env = env_fn()
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            ticket, seed = task
+
+            try:
+                start = time.perf_counter()
+                env.seed(seed)
+                env.reset()
+                state = env.get_state()
+                gen_time = time.perf_counter() - start
+            except Exception:
+                results.put((ticket, seed, None, traceback.format_exc()))
+            else:
+                results.put((ticket, seed, state, gen_time))
+
+    except (KeyboardInterrupt, EOFError):
+        pass
+
+    finally:
+        env.close()
+
+class ResetPool:
+    """
+    Pool of episode layouts generated ahead of time by background worker
+    processes, so that resetting an environment only restores a ready
+    layout instead of running its grid generator.
+
+    Layouts are generated for a sequence of seeds, and handed out in the
+    order of the seeds regardless of which worker generated them, so that
+    the layout restored by the n-th reset is always the one obtained by
+    seeding the environment with the n-th seed and resetting it. This
+    includes the state of the RNG after generation. At most size layouts
+    are generated ahead.
+    """
+
+    def __init__(self, env_fn, seeds=None, size=16, num_workers=1, start_method=None):
+        assert size > 0
+        assert num_workers > 0
+
+        self.seeds = iter(itertools.count() if seeds is None else seeds)
+        self.size = size
+        self.closed = False
+
+        # Submissions are numbered by a ticket, as seeds may repeat
+        self.tickets = itertools.count()
+
+        # Layouts received from the workers, keyed by ticket
+        self.ready = {}
+
+        # Tickets and seeds submitted to the workers and not consumed
+        # yet, in order
+        self.pending = []
+
+        # Statistics
+        self.num_generated = 0
+        self.num_consumed = 0
+        self.total_gen_time = 0
+        self.max_gen_time = 0
+        self.num_waits = 0
+        self.total_wait_time = 0
+
+        ctx = mp.get_context(start_method)
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+
+        self.processes = []
+        for i in range(num_workers):
+            process = ctx.Process(
+                target=reset_pool_worker,
+                args=(env_fn, self.tasks, self.results),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+        self.submit()
+
+    @classmethod
+    def make(cls, env_id, seeds=None, size=16, num_workers=1, start_method=None):
+        """
+        Create a pool generating layouts for a registered environment id
+        """
+
+        return cls(partial(make_env, env_id), seeds, size, num_workers, start_method)
+
+    def submit(self):
+        """
+        Submit seeds to the workers until size layouts are outstanding
+        """
+
+        while len(self.pending) < self.size:
+            seed = next(self.seeds, None)
+            if seed is None:
+                break
+            ticket = next(self.tickets)
+            self.pending.append((ticket, seed))
+            self.tasks.put((ticket, seed))
+
+    def receive(self, block):
+        """
+        Move a layout from the results queue to the ready layouts.
+        Returns False if none was available without blocking.
+        """
+
+        try:
+            ticket, seed, state, gen_time = self.results.get(block=block)
+        except queue.Empty:
+            return False
+
+        if state is None:
+            raise RuntimeError('error generating the layout for seed %s:\n%s' % (seed, gen_time))
+
+        self.ready[ticket] = state
+        self.num_generated += 1
+        self.total_gen_time += gen_time
+        self.max_gen_time = max(self.max_gen_time, gen_time)
+
+        return True
+
+    def next_layout(self):
+        """
+        Get the seed and state snapshot of the next layout, waiting
+        for it to be generated if needed
+        """
+
+        assert not self.closed
+        if not self.pending:
+            raise RuntimeError('no seeds left in the reset pool')
+
+        ticket, seed = self.pending.pop(0)
+
+        if ticket not in self.ready:
+            self.num_waits += 1
+            start = time.perf_counter()
+            while ticket not in self.ready:
+                self.receive(block=True)
+            self.total_wait_time += time.perf_counter() - start
+
+        state = self.ready.pop(ticket)
+        self.num_consumed += 1
+        self.submit()
+
+        return seed, state
+
+    def reset(self, env):
+        """
+        Reset an environment and its wrappers by restoring the next
+        layout into it, and return the first observation of the episode
+        """
+
+        seed, state = self.next_layout()
+
+        # Snapshots leave out the configuration of the environment, so
+        # the layout only has to fit in the grid of the consumer
+        grid = state['attrs']['grid']
+        base = env.unwrapped
+        if (grid.width, grid.height) != (base.width, base.height):
+            raise ValueError('the pool generated a %dx%d grid for a %dx%d environment' % (
+                grid.width, grid.height, base.width, base.height))
+
+        return reset_to_state(env, state)
+
+    def stats(self):
+        """
+        Queue depth and generation time statistics, to size the pool
+        """
+
+        while self.receive(block=False):
+            pass
+
+        return {
+            'ready': len(self.ready),
+            'in_progress': len(self.pending) - len(self.ready),
+            'generated': self.num_generated,
+            'consumed': self.num_consumed,
+            'mean_gen_time': self.total_gen_time / max(self.num_generated, 1),
+            'max_gen_time': self.max_gen_time,
+            'waits': self.num_waits,
+            'mean_wait_time': self.total_wait_time / max(self.num_waits, 1),
+        }
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        for process in self.processes:
+            self.tasks.put(None)
+
+        # Workers can only exit once their results have been read
+        deadline = time.perf_counter() + 5
+        while any(p.is_alive() for p in self.processes) and time.perf_counter() < deadline:
+            try:
+                self.results.get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+        self.tasks.cancel_join_thread()
+        self.results.cancel_join_thread()
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
+
+class ResetPoolWrapper(gym.core.Wrapper):
+    """
+    Wrapper resetting the environment with layouts from a ResetPool.
+    The layouts are generated for the seeds of the pool, so reset()
+    takes no arguments.
+    """
+
+    def __init__(self, env, pool):
+        super().__init__(env)
+        self.pool = pool
+
+    def reset(self, **kwargs):
+        if kwargs:
+            raise ValueError('reset arguments are not supported with a reset pool')
+        return self.pool.reset(self.env)
@@ -1,4 +1,6 @@
 import math
+from collections import OrderedDict
+from functools import lru_cache
 import numpy as np
 
 def downsample(img, factor):
@@ -17,18 +19,32 @@ def downsample(img, factor):
 
 def fill_coords(img, fn, color):
     """
-    Fill pixels of an image with coordinates matching a filter function
+    Fill pixels of an image with coordinates matching a filter function.
+    The filter function is evaluated on the coordinates of all the pixels
+    at once, and must return a boolean mask.
     """
 
-    for y in range(img.shape[0]):
-        for x in range(img.shape[1]):
-            yf = (y + 0.5) / img.shape[0]
-            xf = (x + 0.5) / img.shape[1]
-            if fn(xf, yf):
-                img[y, x] = color
+    yf, xf = pixel_coords(img.shape[0], img.shape[1])
+    img[fn(xf, yf)] = color
 
     return img
 
+@lru_cache(maxsize=64)
+def pixel_coords(height, width):
+    """
+    Get the normalized coordinates of the pixel centers of an image,
+    as two read-only arrays of shape (height, width)
+    """
+
+    y = (np.arange(height) + 0.5) / height
+    x = (np.arange(width) + 0.5) / width
+    yf, xf = np.meshgrid(y, x, indexing='ij')
+
+    yf.flags.writeable = False
+    xf.flags.writeable = False
+
+    return yf, xf
+
 def rotate_fn(fin, cx, cy, theta):
     def fout(x, y):
         x = x - cx
@@ -54,20 +70,22 @@ def point_in_line(x0, y0, x1, y1, r):
     ymax = max(y0, y1) + r
 
     def fn(x, y):
-        # Fast, early escape test
-        if x < xmin or x > xmax or y < ymin or y > ymax:
-            return False
+        # Bounding box test
+        inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
 
-        q = np.array([x, y])
-        pq = q - p0
+        pqx = x - p0[0]
+        pqy = y - p0[1]
 
         # Closest point on line
-        a = np.dot(pq, dir)
+        a = pqx * dir[0] + pqy * dir[1]
         a = np.clip(a, 0, dist)
-        p = p0 + a * dir
+        px = p0[0] + a * dir[0]
+        py = p0[1] + a * dir[1]
 
-        dist_to_line = np.linalg.norm(q - p)
-        return dist_to_line <= r
+        dx = x - px
+        dy = y - py
+        dist_to_line = np.sqrt(dx * dx + dy * dy)
+        return inside & (dist_to_line <= r)
 
     return fn
 
@@ -78,7 +96,7 @@ def point_in_circle(cx, cy, r):
 
 def point_in_rect(xmin, xmax, ymin, ymax):
     def fn(x, y):
-        return x >= xmin and x <= xmax and y >= ymin and y <= ymax
+        return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
     return fn
 
 def point_in_triangle(a, b, c):
@@ -89,14 +107,15 @@ def point_in_triangle(a, b, c):
     def fn(x, y):
         v0 = c - a
         v1 = b - a
-        v2 = np.array((x, y)) - a
+        v2x = x - a[0]
+        v2y = y - a[1]
 
         # Compute dot products
         dot00 = np.dot(v0, v0)
         dot01 = np.dot(v0, v1)
-        dot02 = np.dot(v0, v2)
+        dot02 = v0[0] * v2x + v0[1] * v2y
         dot11 = np.dot(v1, v1)
-        dot12 = np.dot(v1, v2)
+        dot12 = v1[0] * v2x + v1[1] * v2y
 
         # Compute barycentric coordinates
         inv_denom = 1 / (dot00 * dot11 - dot01 * dot01)
@@ -104,7 +123,7 @@ def point_in_triangle(a, b, c):
         v = (dot00 * dot12 - dot01 * dot02) * inv_denom
 
         # Check if point is in triangle
-        return (u >= 0) and (v >= 0) and (u + v) < 1
+        return (u >= 0) & (v >= 0) & ((u + v) < 1)
 
     return fn
 
@@ -116,3 +135,209 @@ def highlight_img(img, color=(255, 255, 255), alpha=0.30):
     blend_img = img + alpha * (np.array(color, dtype=np.uint8) - img)
     blend_img = blend_img.clip(0, 255).astype(np.uint8)
     img[:, :, :] = blend_img
+
+class TileCache:
+    """
+    Bounded cache of rendered tiles, with least recently used eviction.
+
+    The cache is limited both in number of tiles and in total bytes, so
+    that the memory used by each process stays bounded when rendering at
+    many different tile sizes. It supports the dict operations used to
+    look up and store tiles, and keeps hit, miss and eviction counters.
+    """
+
+    def __init__(self, max_size=4096, max_bytes=64 * 1024 * 1024):
+        assert max_size > 0
+        assert max_bytes > 0
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def __getitem__(self, key):
+        img = self.get(key)
+        if img is None:
+            raise KeyError(key)
+        return img
+
+    def __setitem__(self, key, img):
+        self.put(key, img)
+
+    def __delitem__(self, key):
+        img = self.tiles.pop(key)
+        self.nbytes -= img.nbytes
+
+    def get(self, key):
+        """
+        Get a tile, or None if the tile is not in the cache
+        """
+
+        img = self.tiles.get(key)
+        if img is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.tiles.move_to_end(key)
+        return img
+
+    def put(self, key, img):
+        """
+        Store a tile, evicting the least recently used tiles if needed
+        """
+
+        old = self.tiles.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+
+        self.tiles[key] = img
+        self.nbytes += img.nbytes
+
+        # Always keep the tile just added
+        while len(self.tiles) > 1 and (len(self.tiles) > self.max_size or self.nbytes > self.max_bytes):
+            _, old = self.tiles.popitem(last=False)
+            self.nbytes -= old.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all the cached tiles and reset the counters
+        """
+
+        self.tiles.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def keys(self):
+        """
+        Keys of the cached tiles, from least to most recently used
+        """
+
+        return list(self.tiles.keys())
+
+    def stats(self):
+        """
+        Summary of the cache size and counters
+        """
+
+        return {
+            'size': len(self.tiles),
+            'nbytes': self.nbytes,
+            'max_size': self.max_size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+class FrameBuffer:
+    """
+    Last frame rendered from a tile atlas, along with the atlas index of
+    the tile drawn in each cell. The next frame can then be rendered by
+    only redrawing the cells whose tile changed, which between two steps
+    is usually just the cells around the agent.
+    """
+
+    def __init__(self):
+        self.img = None
+        self.index = None
+        self.tile_size = None
+
+        # Number of tiles drawn to render the last frame
+        self.num_redrawn = 0
+
+    def matches(self, index, tile_size):
+        """
+        Check if this buffer can be updated to render a frame with the
+        given tile indices and tile size
+        """
+
+        return (
+            self.img is not None and
+            self.tile_size == tile_size and
+            self.index.shape == index.shape
+        )
+
+    def clear(self):
+        """
+        Drop the buffered frame
+        """
+
+        self.img = None
+        self.index = None
+        self.tile_size = None
+
+def render_batch(
+    encodings,
+    tile_size,
+    agent_pos=None,
+    agent_dir=None,
+    highlight_mask=None,
+    out=None,
+    chunk_size=256
+):
+    """
+    Render a batch of encoded grids of shape (N, W, H, 3), such as stacked
+    observations or full grid encodings, into RGB images of shape
+    (N, H * tile_size, W * tile_size, 3) from the tile cache, see
+    CachedTiles.
+
+    agent_pos and agent_dir give the pose of the agent in each grid, as
+    arrays of shape (N, 2) and (N,), or a single pose for all the grids.
+    No agent is drawn if they are None. For partial observations, the
+    agent is at (V // 2, V - 1) facing up (direction 3), and the cells
+    which aren't unseen are usually highlighted.
+
+    Grids are rendered chunk_size at a time, which bounds the memory used
+    by intermediate arrays. The images can be written into out, e.g. a
+    memory-mapped array, so that the output doesn't have to fit in memory.
+    """
+
+    from .atlas import TileAtlas, CachedTiles, NO_AGENT
+
+    num_grids, width, height, _ = encodings.shape
+    tiles = CachedTiles(tile_size)
+
+    if out is None:
+        shape = (num_grids, height * tile_size, width * tile_size, 3)
+        out = np.empty(shape=shape, dtype=np.uint8)
+
+    if agent_pos is not None and agent_dir is not None:
+        agent_pos = np.broadcast_to(agent_pos, (num_grids, 2))
+        agent_dir = np.broadcast_to(agent_dir, (num_grids,))
+
+    for start in range(0, num_grids, chunk_size):
+        stop = min(start + chunk_size, num_grids)
+        array = encodings[start:stop].astype(np.int64)
+
+        dir_idx = np.full(array.shape[:3], NO_AGENT, dtype=np.int64)
+        if agent_pos is not None and agent_dir is not None:
+            pos = agent_pos[start:stop]
+            dir_idx[np.arange(stop - start), pos[:, 0], pos[:, 1]] = agent_dir[start:stop]
+
+        highlight = False
+        if highlight_mask is not None:
+            highlight = highlight_mask[start:stop]
+
+        index = TileAtlas.index(
+            array[..., 0],
+            array[..., 1],
+            array[..., 2],
+            dir_idx,
+            highlight
+        )
+
+        tiles.gather(index, out=out[start:stop])
+
+    return out
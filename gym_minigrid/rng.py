@@ -0,0 +1,169 @@
+import numpy as np
+from gym import error
+from gym.utils import seeding
+
+# Mask to keep Python integers within 64 bits
+MASK64 = (1 << 64) - 1
+
+# Scale converting the top 53 bits of a 64-bit word to a float in [0, 1)
+FLOAT_SCALE = 1.0 / (1 << 53)
+
+class BufferedRNG:
+    """
+    Random number generator drawing 64-bit words in blocks from a PCG64
+    bit generator, and serving them from a buffer, so that generating a
+    level doesn't pay the overhead of a NumPy call for every draw.
+
+    It implements the subset of the RandomState interface used by the
+    environments (randint, uniform, shuffle, choice, get_state and
+    set_state), so it can be used as the np_random of an environment,
+    see MiniGridEnv.buffered_rng.
+
+    Determinism guarantees:
+    - For a given seed, the values returned only depend on the sequence
+      of calls made and their arguments. Every integer or float draw
+      consumes one word of the stream, or more in the rare cases where
+      an integer draw is rejected to keep it unbiased.
+    - Values don't depend on the block size, since the words are served
+      in the order of the stream, nor on the platform: integers are drawn
+      exactly with integer arithmetic, and floats from the top 53 bits
+      of a word.
+    - Restoring a state obtained with get_state() reproduces all the
+      following draws exactly.
+    - The streams differ from those of RandomState for the same seed,
+      so levels generated in this mode differ from the legacy ones.
+    """
+
+    # Number of 64-bit words drawn from the bit generator at once
+    block_size = 256
+
+    def __init__(self, seed=None):
+        self.bit_generator = np.random.PCG64(seed)
+        self.fill()
+
+    def fill(self, block_state=None):
+        """
+        Draw the next block of words, starting from block_state if given
+        """
+
+        if block_state is not None:
+            self.bit_generator.state = block_state
+
+        # Bit generator state at the start of the block, see get_state()
+        self.block_state = self.bit_generator.state
+        self.buf = self.bit_generator.random_raw(self.block_size).tolist()
+        self.pos = 0
+
+    def next_word(self):
+        """
+        Get the next 64-bit word of the stream
+        """
+
+        if self.pos == len(self.buf):
+            self.fill()
+
+        word = self.buf[self.pos]
+        self.pos += 1
+        return word
+
+    def randint(self, low, high=None):
+        """
+        Generate a random integer in [low,high[, or in [0,low[ if high
+        is omitted. This uses Lemire's multiply and reject method, which
+        is exact and usually only needs a single word.
+        """
+
+        if high is None:
+            low, high = 0, low
+
+        # Bounds may be NumPy integers, which would overflow below
+        low = int(low)
+        n = int(high) - low
+        if n <= 0:
+            raise ValueError('low >= high')
+
+        m = self.next_word() * n
+
+        if (m & MASK64) < n:
+            threshold = ((1 << 64) - n) % n
+            while (m & MASK64) < threshold:
+                m = self.next_word() * n
+
+        return low + (m >> 64)
+
+    def uniform(self, low=0.0, high=1.0):
+        """
+        Generate a random float in [low,high[
+        """
+
+        return low + (high - low) * ((self.next_word() >> 11) * FLOAT_SCALE)
+
+    def shuffle(self, x):
+        """
+        Shuffle a list or the first axis of an array in place
+        """
+
+        perm = list(range(len(x)))
+        for i in reversed(range(1, len(perm))):
+            j = self.randint(0, i + 1)
+            perm[i], perm[j] = perm[j], perm[i]
+
+        if isinstance(x, np.ndarray):
+            x[...] = x[perm]
+        else:
+            x[:] = [x[i] for i in perm]
+
+    def choice(self, a, p=None):
+        """
+        Pick a random element of a sequence, or of range(a) if a is
+        an integer, with probabilities p if given
+        """
+
+        if isinstance(a, int):
+            a = range(a)
+
+        if p is None:
+            return a[self.randint(0, len(a))]
+
+        assert len(p) == len(a)
+        u = self.uniform() * sum(p)
+        for elem, prob in zip(a, p):
+            u -= prob
+            if u < 0:
+                return elem
+        return a[-1]
+
+    def get_state(self):
+        """
+        Get the state of the generator. This only stores the position in
+        the current block, which is drawn again by set_state().
+        """
+
+        return {
+            'block_state': self.block_state,
+            'block_size': len(self.buf),
+            'pos': self.pos,
+        }
+
+    def set_state(self, state):
+        """
+        Restore a state obtained with get_state()
+        """
+
+        block_size = self.block_size
+        self.block_size = state['block_size']
+        self.fill(state['block_state'])
+        self.block_size = block_size
+        self.pos = state['pos']
+
+def buffered_np_random(seed=None):
+    """
+    Create a BufferedRNG, with the same seed conventions as
+    gym.utils.seeding.np_random()
+    """
+
+    if seed is not None and not (isinstance(seed, int) and 0 <= seed):
+        raise error.Error('Seed must be a non-negative integer or omitted, not {}'.format(seed))
+
+    seed = seeding.create_seed(seed)
+    return BufferedRNG(seed), seed
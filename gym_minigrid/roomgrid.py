@@ -11,6 +11,44 @@ def reject_next_to(env, pos):
     d = abs(sx - x) + abs(sy - y)
     return d < 2
 
+# reject_next_to also accepts arrays of positions, see place_obj()
+reject_next_to.vectorized = True
+
+class DisjointSet:
+    """
+    Union-find structure over the integers 0..n-1, used to track which
+    rooms are connected to each other
+    """
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.num_sets = n
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+
+        # Path compression
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+
+        return root
+
+    def union(self, x, y):
+        """
+        Merge the sets of x and y, returns False if they were already merged
+        """
+
+        x = self.find(x)
+        y = self.find(y)
+        if x == y:
+            return False
+
+        self.parent[y] = x
+        self.num_sets -= 1
+        return True
+
 class Room:
     def __init__(
         self,
@@ -66,6 +104,15 @@ class RoomGrid(MiniGridEnv):
     This is meant to serve as a base class for other environments.
     """
 
+    # Attributes set by the generator, saved by get_state()
+    state_attrs = MiniGridEnv.state_attrs + ('room_grid',)
+
+    # Set this to True to have connect_all() track the connectivity of
+    # the rooms with a union-find structure and draw doors among the
+    # valid walls only. Layouts follow the same distribution, but the
+    # random draws differ, so this is disabled by default.
+    fast_connect = False
+
     def __init__(
         self,
         room_size=7,
@@ -308,6 +355,9 @@ class RoomGrid(MiniGridEnv):
         starting position
         """
 
+        if self.fast_connect:
+            return self.connect_all_fast(door_colors)
+
         start_room = self.room_from_pos(*self.agent_pos)
 
         added_doors = []
@@ -358,6 +408,56 @@ class RoomGrid(MiniGridEnv):
 
         return added_doors
 
+    def connect_all_fast(self, door_colors=COLOR_NAMES):
+        """
+        Same as connect_all(), which adds unlocked doors on random walls
+        between unlocked rooms until all rooms are connected, but tracks
+        the connected rooms with a union-find structure, and draws the
+        walls from the list of valid ones instead of by rejection.
+        """
+
+        def room_idx(i, j):
+            return j * self.num_cols + i
+
+        rooms = DisjointSet(self.num_rows * self.num_cols)
+
+        # Walls where a door can be added, each listed once, from the
+        # room to the left of or above the wall
+        walls = []
+
+        for j in range(self.num_rows):
+            for i in range(self.num_cols):
+                room = self.get_room(i, j)
+                for k, (di, dj) in ((0, (1, 0)), (1, (0, 1))):
+                    neighbor = room.neighbors[k]
+                    if neighbor is None:
+                        continue
+
+                    if room.doors[k]:
+                        rooms.union(room_idx(i, j), room_idx(i + di, j + dj))
+                    elif not room.locked and not neighbor.locked:
+                        walls.append((i, j, k, room_idx(i + di, j + dj)))
+
+        added_doors = []
+
+        while rooms.num_sets > 1:
+            # Only happens if locked rooms disconnect the grid
+            if len(walls) == 0:
+                raise RecursionError('connect_all failed')
+
+            idx = self._rand_int(0, len(walls))
+            i, j, k, neighbor_idx = walls[idx]
+            walls[idx] = walls[-1]
+            walls.pop()
+
+            color = self._rand_elem(door_colors)
+            door, _ = self.add_door(i, j, k, color, False)
+            added_doors.append(door)
+
+            rooms.union(room_idx(i, j), neighbor_idx)
+
+        return added_doors
+
     def add_distractors(self, i=None, j=None, num_distractors=10, all_unique=True):
         """
         Add random objects that can potentially distract/confuse the agent.
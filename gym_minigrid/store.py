@@ -0,0 +1,430 @@
+import os
+import json
+import numpy as np
+import gym
+
+# Name of the file describing the arrays of a store
+META_FILE = 'meta.json'
+
+# Arrays with one row per step, and per episode, with their type.
+# The shapes of the observation arrays are taken from the first one.
+STEP_FIELDS = {
+    'images': np.uint8,
+    'directions': np.uint8,
+    'mission_ids': np.uint16,
+    'actions': np.uint8,
+    'rewards': np.float32,
+    'dones': np.uint8,
+    'episode_ids': np.uint32,
+}
+EPISODE_FIELDS = {
+    'episode_starts': np.uint64,
+    'seeds': np.int64,
+    'final_images': np.uint8,
+    'final_directions': np.uint8,
+    'final_mission_ids': np.uint16,
+}
+
+class GrowableArray:
+    """
+    Array of rows stored in a memory-mapped file, whose capacity doubles
+    when it is full. Growing the file doesn't copy the rows already
+    written, as the file is only extended and mapped again.
+    """
+
+    def __init__(self, path, dtype, shape, length=0, capacity=1024):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.row_size = self.dtype.itemsize * int(np.prod(self.shape, dtype=np.int64))
+        self.length = length
+        self.array = None
+
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+        self.resize(max(capacity, length, 1))
+
+    def resize(self, capacity):
+        if self.array is not None:
+            self.array.flush()
+            self.array = None
+            self.rows = None
+
+        with open(self.path, 'r+b') as f:
+            f.truncate(capacity * self.row_size)
+
+        self.capacity = capacity
+        self.array = np.memmap(self.path, self.dtype, 'r+', shape=(capacity,) + self.shape)
+
+        # Rows are written through a plain view, as assigning to a memmap
+        # goes through its slower subclass machinery
+        self.rows = self.array.view(np.ndarray)
+
+    def append(self, row):
+        if self.length == self.capacity:
+            self.resize(2 * self.capacity)
+
+        self.rows[self.length] = row
+        self.length += 1
+
+    def pop(self):
+        """
+        Remove the last row
+        """
+
+        assert self.length > 0
+        self.length -= 1
+
+    def flush(self):
+        self.array.flush()
+
+    def close(self):
+        """
+        Flush the rows and trim the file to the rows written
+        """
+
+        self.array.flush()
+        self.array = None
+        self.rows = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(self.length * self.row_size)
+
+def field_path(path, name):
+    return os.path.join(path, name + '.bin')
+
+def load_meta(path):
+    """
+    Load the description of a store, or None if there is none yet
+    """
+
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+class TrajectoryWriter:
+    """
+    Writer appending episodes to a store of memory-mapped arrays in the
+    directory path: the symbolic observations (image, direction and
+    mission), actions, rewards and dones of every step, and the seed and
+    final observation of every episode. Missions are stored as indices
+    into the missions listed in the description of the store.
+
+    Arrays are preallocated with room for capacity steps, and grown as
+    needed. Only the episodes ended when the store was last flushed are
+    visible to readers. If the store exists, episodes are appended to it,
+    unless overwrite is set.
+    """
+
+    def __init__(self, path, capacity=1 << 16, overwrite=False):
+        self.path = path
+        self.capacity = capacity
+        self.arrays = None
+        self.missions = []
+        self.mission_idx = {}
+        self.num_steps = 0
+        self.num_episodes = 0
+
+        # Observation not yet written, see append(), and first step
+        # of the current episode
+        self.pending_obs = None
+        self.episode_start = None
+
+        os.makedirs(path, exist_ok=True)
+        meta = None if overwrite else load_meta(path)
+
+        if meta is None:
+            for name in list(STEP_FIELDS) + list(EPISODE_FIELDS):
+                if os.path.exists(field_path(path, name)):
+                    os.remove(field_path(path, name))
+        else:
+            self.missions = meta['missions']
+            self.mission_idx = {m: i for i, m in enumerate(self.missions)}
+            self.num_steps = meta['num_steps']
+            self.num_episodes = meta['num_episodes']
+            self.open_arrays(meta['shapes'])
+
+    def open_arrays(self, shapes):
+        """
+        Open the arrays, given the shapes of the rows of each field
+        """
+
+        episode_capacity = max(self.capacity // 64, 1)
+        self.arrays = {}
+
+        for name, dtype in STEP_FIELDS.items():
+            self.arrays[name] = GrowableArray(
+                field_path(self.path, name), dtype, shapes[name], self.num_steps, self.capacity
+            )
+
+        for name, dtype in EPISODE_FIELDS.items():
+            self.arrays[name] = GrowableArray(
+                field_path(self.path, name), dtype, shapes[name], self.num_episodes, episode_capacity
+            )
+
+    def mission_id(self, mission):
+        idx = self.mission_idx.get(mission)
+        if idx is None:
+            idx = len(self.missions)
+            assert idx <= np.iinfo(STEP_FIELDS['mission_ids']).max, 'too many missions'
+            self.missions.append(mission)
+            self.mission_idx[mission] = idx
+        return idx
+
+    def begin_episode(self, obs, seed=None):
+        """
+        Start an episode from its first observation. The seed is stored
+        as -1 if it isn't known.
+        """
+
+        if self.pending_obs is not None:
+            self.end_episode()
+
+        if self.arrays is None:
+            image_shape = obs['image'].shape
+            self.open_arrays({
+                name: image_shape if name in ['images', 'final_images'] else ()
+                for name in list(STEP_FIELDS) + list(EPISODE_FIELDS)
+            })
+
+        self.episode_start = self.arrays['images'].length
+        self.arrays['episode_starts'].append(self.episode_start)
+        self.arrays['seeds'].append(-1 if seed is None else seed)
+        self.pending_obs = obs
+
+    def append(self, action, reward, done, obs):
+        """
+        Append a step: the action taken from the last observation, the
+        reward and done flag obtained, and the next observation
+        """
+
+        assert self.pending_obs is not None, 'no episode started'
+        prev_obs = self.pending_obs
+        arrays = self.arrays
+
+        arrays['images'].append(prev_obs['image'])
+        arrays['directions'].append(prev_obs['direction'])
+        arrays['mission_ids'].append(self.mission_id(prev_obs['mission']))
+        arrays['actions'].append(action)
+        arrays['rewards'].append(reward)
+        arrays['dones'].append(done)
+        arrays['episode_ids'].append(arrays['seeds'].length - 1)
+
+        self.pending_obs = obs
+        if done:
+            self.end_episode()
+
+    def end_episode(self):
+        """
+        End the current episode, storing its last observation. Episodes
+        without any step (e.g. a reset before closing) are discarded.
+        """
+
+        obs = self.pending_obs
+        if obs is None:
+            return
+
+        arrays = self.arrays
+        self.pending_obs = None
+
+        if arrays['images'].length == self.episode_start:
+            arrays['episode_starts'].pop()
+            arrays['seeds'].pop()
+            return
+
+        arrays['final_images'].append(obs['image'])
+        arrays['final_directions'].append(obs['direction'])
+        arrays['final_mission_ids'].append(self.mission_id(obs['mission']))
+
+        self.num_steps = arrays['images'].length
+        self.num_episodes = arrays['seeds'].length
+
+    def flush(self):
+        """
+        Write the arrays and the description of the store to disk, making
+        the ended episodes visible to readers. The description is written
+        atomically, after the arrays.
+        """
+
+        if self.arrays is None:
+            return
+
+        for array in self.arrays.values():
+            array.flush()
+
+        meta = {
+            'num_steps': self.num_steps,
+            'num_episodes': self.num_episodes,
+            'shapes': {name: list(array.shape) for name, array in self.arrays.items()},
+            'dtypes': {name: array.dtype.str for name, array in self.arrays.items()},
+            'missions': self.missions,
+        }
+
+        meta_path = os.path.join(self.path, META_FILE)
+        tmp_path = '%s.%d.tmp' % (meta_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def close(self):
+        """
+        End the current episode, and trim the arrays to their length
+        """
+
+        if self.arrays is None:
+            return
+
+        self.end_episode()
+        self.flush()
+
+        for array in self.arrays.values():
+            array.close()
+        self.arrays = None
+
+class TrajectoryRecorder(gym.core.Wrapper):
+    """
+    Wrapper recording the episodes of an environment to a store, see
+    TrajectoryWriter. The seed of an episode is recorded if the
+    environment was seeded through the wrapper before its reset.
+    """
+
+    def __init__(self, env, path, capacity=1 << 16, overwrite=False, flush_every=None):
+        super().__init__(env)
+        self.writer = TrajectoryWriter(path, capacity, overwrite)
+        self.flush_every = flush_every
+        self.next_seed = None
+
+    def seed(self, seed=None):
+        self.next_seed = seed
+        return self.env.seed(seed)
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+
+        writer = self.writer
+        writer.begin_episode(obs, self.next_seed)
+        self.next_seed = None
+
+        if self.flush_every and writer.num_episodes % self.flush_every == 0:
+            writer.flush()
+
+        return obs
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        self.writer.append(action, reward, done, obs)
+        return obs, reward, done, info
+
+    def close(self):
+        self.writer.close()
+        return self.env.close()
+
+class TrajectoryReader:
+    """
+    Reader of a store written by a TrajectoryWriter. The arrays are
+    memory-mapped, so the store can be larger than the memory, and any
+    step or episode is accessed in constant time.
+
+    The step arrays (images, directions, mission_ids, actions, rewards,
+    dones and episode_ids) and the episode arrays (episode_starts, seeds,
+    final_images, final_directions and final_mission_ids) are available
+    as attributes.
+    """
+
+    def __init__(self, path):
+        meta = load_meta(path)
+        if meta is None:
+            raise FileNotFoundError('no trajectory store in %s' % path)
+
+        self.path = path
+        self.num_steps = meta['num_steps']
+        self.num_episodes = meta['num_episodes']
+        self.missions = meta['missions']
+
+        for name in list(STEP_FIELDS) + list(EPISODE_FIELDS):
+            length = self.num_steps if name in STEP_FIELDS else self.num_episodes
+            shape = (length,) + tuple(meta['shapes'][name])
+            dtype = np.dtype(meta['dtypes'][name])
+
+            if length == 0:
+                array = np.zeros(shape, dtype)
+            else:
+                array = np.memmap(field_path(path, name), dtype, 'r', shape=shape)
+            setattr(self, name, array)
+
+    def __len__(self):
+        return self.num_steps
+
+    def episode_bounds(self, episode):
+        """
+        Get the first step of an episode, and the step after its last
+        """
+
+        start = int(self.episode_starts[episode])
+        if episode + 1 < self.num_episodes:
+            return start, int(self.episode_starts[episode + 1])
+        return start, self.num_steps
+
+    def episode(self, episode):
+        """
+        Get the steps of an episode, as views into the arrays
+        """
+
+        start, end = self.episode_bounds(episode)
+        return {
+            'seed': int(self.seeds[episode]),
+            'images': self.images[start:end],
+            'directions': self.directions[start:end],
+            'missions': [self.missions[i] for i in self.mission_ids[start:end]],
+            'actions': self.actions[start:end],
+            'rewards': self.rewards[start:end],
+            'dones': self.dones[start:end],
+        }
+
+    def transitions(self, indices):
+        """
+        Get the transitions of an array of steps, or of a single step:
+        the observation, the action, reward and done flag, and the next
+        observation. Only the rows of these steps are read.
+        """
+
+        if np.ndim(indices) == 0:
+            batch = self.transitions([indices])
+            return {key: value[0] for key, value in batch.items()}
+
+        indices = np.asarray(indices)
+        episodes = self.episode_ids[indices]
+
+        # The next observation of the last step of an episode is its
+        # final observation
+        next_steps = np.minimum(indices + 1, max(self.num_steps - 1, 0))
+        last = self.episode_ids[next_steps] != episodes
+        last |= indices + 1 >= self.num_steps
+
+        next_images = self.images[next_steps]
+        next_images[last] = self.final_images[episodes[last]]
+        next_directions = self.directions[next_steps]
+        next_directions[last] = self.final_directions[episodes[last]]
+        next_mission_ids = self.mission_ids[next_steps]
+        next_mission_ids[last] = self.final_mission_ids[episodes[last]]
+
+        return {
+            'images': self.images[indices],
+            'directions': self.directions[indices],
+            'mission_ids': self.mission_ids[indices],
+            'actions': self.actions[indices],
+            'rewards': self.rewards[indices],
+            'dones': self.dones[indices],
+            'next_images': next_images,
+            'next_directions': next_directions,
+            'next_mission_ids': next_mission_ids,
+            'episode_ids': episodes,
+        }
+
+    def sample(self, batch_size, np_random=np.random):
+        """
+        Sample a batch of transitions uniformly
+        """
+
+        return self.transitions(np_random.randint(0, self.num_steps, size=batch_size))
@@ -0,0 +1,622 @@
+import traceback
+import multiprocessing as mp
+from functools import partial
+import gym
+from .minigrid import *
+from .visibility import compute_vis_masks
+
+# Encodings of the cell contents the batched dynamics depend on
+EMPTY = OBJECT_TO_IDX['empty']
+WALL = OBJECT_TO_IDX['wall']
+DOOR = OBJECT_TO_IDX['door']
+KEY = OBJECT_TO_IDX['key']
+BOX = OBJECT_TO_IDX['box']
+GOAL = OBJECT_TO_IDX['goal']
+LAVA = OBJECT_TO_IDX['lava']
+GIFT = OBJECT_TO_IDX['gift']
+
+# Objects the agent can walk over, besides open doors
+OVERLAP_TYPES = [OBJECT_TO_IDX[t] for t in ('goal', 'floor', 'lava', 'gift')]
+
+# Objects the agent can pick up
+PICKUP_TYPES = [OBJECT_TO_IDX[t] for t in ('key', 'ball', 'box')]
+
+# Object classes whose behavior is fully determined by their encoding
+VEC_OBJ_CLASSES = (Goal, Floor, Lava, Wall, Door, Key, Ball, Box, Gift)
+
+def _passthrough_step(self, action):
+    obs, reward, done, info = MiniGridEnv.step(self, action)
+    return obs, reward, done, info
+
+def _return_step(self, action):
+    return MiniGridEnv.step(self, action)
+
+def is_base_step(step):
+    """
+    Check if a step function runs the MiniGridEnv.step dynamics only,
+    either because it is MiniGridEnv.step or because it is an override
+    which just calls it and returns its result
+    """
+
+    if step is MiniGridEnv.step:
+        return True
+
+    code = getattr(step, '__code__', None)
+    if code is None:
+        return False
+
+    return any(
+        (code.co_code, code.co_names, code.co_argcount) ==
+        (ref.__code__.co_code, ref.__code__.co_names, ref.__code__.co_argcount)
+        and step.__globals__.get('MiniGridEnv') is MiniGridEnv
+        for ref in (_passthrough_step, _return_step)
+    )
+
+class VecMiniGridEnv:
+    """
+    Batch of MiniGrid environments stepped together. The state of all
+    the environments is held in stacked arrays (grid planes, agent pose,
+    carried object encoding, step counts), and the base MiniGridEnv.step
+    dynamics and the egocentric observations are computed with array
+    operations over the whole batch.
+
+    Grids are still generated by the wrapped MiniGridEnv instances, whose
+    state is loaded into the arrays on reset. Environments are reset
+    automatically when an episode ends: the observation returned is then
+    the first observation of the new episode, and the last observation
+    of the episode is in info['terminal_observation'].
+
+    All the environments must have the same grid and view sizes. Only the
+    dynamics of MiniGridEnv.step and the default reward are simulated, so
+    environments overriding these (e.g. moving obstacles, or tasks ending
+    on pickup like Unlock and KeyCorridor) are rejected, and boxes
+    containing objects aren't supported.
+    """
+
+    def __init__(self, envs):
+        self.envs = [env.unwrapped for env in envs]
+        self.num_envs = len(self.envs)
+        assert self.num_envs > 0
+
+        for env in self.envs:
+            if not isinstance(env, MiniGridEnv):
+                raise ValueError('%s is not a MiniGridEnv' % type(env).__name__)
+            if type(env)._reward is not MiniGridEnv._reward:
+                raise ValueError('%s overrides the reward function' % type(env).__name__)
+            if not is_base_step(type(env).step):
+                raise ValueError('%s overrides the step function' % type(env).__name__)
+
+        env = self.envs[0]
+        self.width = env.width
+        self.height = env.height
+        self.agent_view_size = env.agent_view_size
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+        self.actions = MiniGridEnv.Actions
+
+        for env in self.envs:
+            assert (env.width, env.height) == (self.width, self.height)
+            assert env.agent_view_size == self.agent_view_size
+
+        n = self.num_envs
+
+        # Grid planes, padded with walls so that views can be
+        # gathered without going out of bounds
+        self.pad = self.agent_view_size - 1
+        self.buf = np.zeros(
+            shape=(n, self.width + 2 * self.pad, self.height + 2 * self.pad, 3),
+            dtype=np.uint8
+        )
+        self.buf[...] = Wall().encode()
+        self.grids = self.buf[:, self.pad:self.pad + self.width, self.pad:self.pad + self.height]
+
+        self.agent_pos = np.zeros(shape=(n, 2), dtype=np.int64)
+        self.agent_dir = np.zeros(shape=(n,), dtype=np.int64)
+        self.carrying = np.zeros(shape=(n, 3), dtype=np.uint8)
+        self.step_count = np.zeros(shape=(n,), dtype=np.int64)
+        self.max_steps = np.zeros(shape=(n,), dtype=np.int64)
+        self.see_through_walls = np.zeros(shape=(n,), dtype=bool)
+        self.missions = [None] * n
+
+        # View offsets for each direction, see MiniGridEnv.view_index_maps()
+        maps = [MiniGridEnv.view_index_maps(self.agent_view_size, d) for d in range(4)]
+        self.view_xs = np.stack([m[0] for m in maps])
+        self.view_ys = np.stack([m[1] for m in maps])
+
+        self.dir_vecs = np.array(DIR_TO_VEC)
+
+    @classmethod
+    def make(cls, env_id, num_envs, seed=None):
+        """
+        Create a batch of environments from a registered environment id,
+        seeded with seed, seed + 1, etc. if seed is given
+        """
+
+        envs = [gym.make(env_id) for _ in range(num_envs)]
+
+        if seed is not None:
+            for i, env in enumerate(envs):
+                env.seed(seed + i)
+
+        return cls(envs)
+
+    def seed(self, seed=None):
+        return [env.seed(None if seed is None else seed + i) for i, env in enumerate(self.envs)]
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+    def load(self, i):
+        """
+        Load the state of environment i from its MiniGridEnv instance
+        """
+
+        env = self.envs[i]
+
+        for v in env.grid.objs.values():
+            if type(v) not in VEC_OBJ_CLASSES or (isinstance(v, Box) and v.contains is not None):
+                raise ValueError('%s objects are not supported' % type(v).__name__)
+
+        env.grid.sync()
+        self.grids[i] = env.grid.array
+        self.agent_pos[i] = env.agent_pos
+        self.agent_dir[i] = env.agent_dir
+        self.carrying[i] = env.carrying.encode() if env.carrying else (EMPTY, 0, 0)
+        self.step_count[i] = env.step_count
+        self.max_steps[i] = env.max_steps
+        self.see_through_walls[i] = env.see_through_walls
+        self.missions[i] = env.mission
+
+    def reset_env(self, i):
+        """
+        Reset environment i, generating a new grid
+        """
+
+        self.envs[i].reset()
+        self.load(i)
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self.reset_env(i)
+
+        return self.gen_obs()
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        n = np.arange(self.num_envs)
+
+        self.step_count += 1
+
+        rewards = np.zeros(shape=(self.num_envs,))
+        dones = np.zeros(shape=(self.num_envs,), dtype=bool)
+
+        # Contents of the cell in front of each agent
+        fwd_pos = self.agent_pos + self.dir_vecs[self.agent_dir]
+        fx, fy = fwd_pos[:, 0], fwd_pos[:, 1]
+        fwd_cell = self.grids[n, fx, fy]
+        fwd_type, fwd_color, fwd_state = fwd_cell.T
+        fwd_empty = fwd_type == EMPTY
+        not_carrying = self.carrying[:, 0] == EMPTY
+
+        # Rotate left and right
+        left = actions == self.actions.left
+        self.agent_dir[left] = (self.agent_dir[left] - 1) % 4
+        right = actions == self.actions.right
+        self.agent_dir[right] = (self.agent_dir[right] + 1) % 4
+
+        # Move forward
+        forward = actions == self.actions.forward
+        can_overlap = (
+            fwd_empty |
+            np.isin(fwd_type, OVERLAP_TYPES) |
+            ((fwd_type == DOOR) & (fwd_state == 0))
+        )
+        move = forward & can_overlap
+        self.agent_pos[move] = fwd_pos[move]
+
+        goal = forward & (fwd_type == GOAL)
+        dones |= goal
+        rewards[goal] = 1 - 0.9 * (self.step_count[goal] / self.max_steps[goal])
+        dones |= forward & (fwd_type == LAVA)
+
+        # Pick up an object
+        pickup = (actions == self.actions.pickup) & np.isin(fwd_type, PICKUP_TYPES) & not_carrying
+        self.carrying[pickup] = fwd_cell[pickup]
+        self.grids[n[pickup], fx[pickup], fy[pickup]] = (EMPTY, 0, 0)
+
+        # Drop an object
+        drop = (actions == self.actions.drop) & fwd_empty & ~not_carrying
+        self.grids[n[drop], fx[drop], fy[drop]] = self.carrying[drop]
+        self.carrying[drop] = (EMPTY, 0, 0)
+
+        # Toggle/activate an object
+        toggled = (actions == self.actions.toggle) & ~fwd_empty
+        door = toggled & (fwd_type == DOOR)
+
+        # Locked doors open with a key of the same color
+        unlock = door & (fwd_state == 2) & (self.carrying[:, 0] == KEY) & (self.carrying[:, 1] == fwd_color)
+        self.grids[n[unlock], fx[unlock], fy[unlock], 2] = 0
+
+        # Unlocked doors switch between open and closed
+        flip = door & (fwd_state != 2)
+        self.grids[n[flip], fx[flip], fy[flip], 2] = 1 - fwd_state[flip]
+
+        # Boxes are replaced by their (empty) contents
+        box = toggled & (fwd_type == BOX)
+        self.grids[n[box], fx[box], fy[box]] = (EMPTY, 0, 0)
+
+        # Gifts can be opened once, and turn grey
+        gift = toggled & (fwd_type == GIFT) & (fwd_state == 1)
+        self.grids[n[gift], fx[gift], fy[gift], 1:] = (COLOR_TO_IDX['grey'], 0)
+
+        succeeded = unlock | flip | box | gift
+
+        dones |= self.step_count >= self.max_steps
+
+        obs = self.gen_obs()
+        infos = [{} for _ in range(self.num_envs)]
+
+        for i in np.flatnonzero(toggled):
+            infos[i]['toggle_succeeded'] = bool(succeeded[i])
+
+        # Reset the environments whose episode ended
+        done_idxs = np.flatnonzero(dones)
+        if len(done_idxs) > 0:
+            for i in done_idxs:
+                infos[i]['terminal_observation'] = {
+                    'image': obs['image'][i].copy(),
+                    'direction': int(obs['direction'][i]),
+                    'mission': obs['mission'][i]
+                }
+                self.reset_env(i)
+
+            reset_obs = self.gen_obs(done_idxs)
+            obs['image'][done_idxs] = reset_obs['image']
+            obs['direction'][done_idxs] = reset_obs['direction']
+            for k, i in enumerate(done_idxs):
+                obs['mission'][i] = reset_obs['mission'][k]
+
+        return obs, rewards, dones, infos
+
+    def gen_obs(self, idxs=None):
+        """
+        Generate the observations of the environments with the given
+        indices (all of them by default), as a dictionary with stacked
+        'image' and 'direction' arrays and a list of 'mission' strings
+        """
+
+        if idxs is None:
+            idxs = np.arange(self.num_envs)
+
+        sz = self.agent_view_size
+        agent_dir = self.agent_dir[idxs]
+
+        # Gather the views from the wall-padded planes
+        xs = self.view_xs[agent_dir] + (self.agent_pos[idxs, 0] + self.pad)[:, None, None]
+        ys = self.view_ys[agent_dir] + (self.agent_pos[idxs, 1] + self.pad)[:, None, None]
+        image = self.buf[idxs[:, None, None], xs, ys]
+
+        # Walls and closed doors block the view
+        types = image[..., 0]
+        opaque = (types == WALL) | ((types == DOOR) & (image[..., 2] != 0))
+
+        agent_pos = (sz // 2, sz - 1)
+        vis_mask = compute_vis_masks(opaque, agent_pos)
+        vis_mask[self.see_through_walls[idxs]] = True
+
+        # Make it so the agent sees what it's carrying
+        image[:, agent_pos[0], agent_pos[1]] = self.carrying[idxs]
+
+        # Cells which are not visible are encoded as unseen
+        image[~vis_mask] = 0
+
+        return {
+            'image': image,
+            'direction': agent_dir,
+            'mission': [self.missions[i] for i in idxs]
+        }
+
+def make_env(env_id, seed=None):
+    """
+    Create an environment from its id, seeded if seed is given.
+    This is a module-level function so that it can be sent to workers.
+    """
+
+    env = gym.make(env_id)
+    if seed is not None:
+        env.seed(seed)
+    return env
+
+def subproc_worker(remote, parent_remote, env_fns, start, buffers):
+    """
+    Worker process running a shard of the environments of a
+    SubprocVecEnv, with indices start to start + len(env_fns). If the
+    environments fail to build, every command but close is answered
+    with the error, so that it is raised in the parent.
+    """
+
+    parent_remote.close()
+
+    envs = []
+    build_error = None
+    try:
+        for env_fn in env_fns:
+            envs.append(env_fn())
+    except Exception:
+        build_error = traceback.format_exc()
+
+    images, directions, rewards, dones = SubprocVecEnv.buffer_arrays(buffers)
+
+    def write_obs(i, obs):
+        images[start + i] = obs['image']
+        directions[start + i] = obs['direction']
+
+    try:
+        while True:
+            cmd, data = remote.recv()
+
+            try:
+                if build_error is not None and cmd != 'close':
+                    remote.send((False, build_error))
+                    continue
+
+                if cmd == 'step':
+                    infos = []
+                    missions = {}
+
+                    for i, (env, action) in enumerate(zip(envs, data)):
+                        obs, reward, done, info = env.step(action)
+
+                        # Reset the environment at the end of the episode
+                        if done:
+                            info['terminal_observation'] = obs
+                            obs = env.reset()
+                            missions[start + i] = obs['mission']
+
+                        write_obs(i, obs)
+                        rewards[start + i] = reward
+                        dones[start + i] = done
+                        infos.append(info)
+
+                    result = (infos, missions)
+
+                elif cmd == 'reset':
+                    missions = {}
+                    for i, env in enumerate(envs):
+                        obs = env.reset()
+                        write_obs(i, obs)
+                        missions[start + i] = obs['mission']
+                    result = missions
+
+                elif cmd == 'seed':
+                    result = [env.seed(seed) for env, seed in zip(envs, data)]
+
+                elif cmd == 'call':
+                    name, args, kwargs = data
+                    result = [getattr(env, name)(*args, **kwargs) for env in envs]
+
+                elif cmd == 'close':
+                    remote.send((True, None))
+                    break
+
+                else:
+                    raise ValueError('unknown command %r' % cmd)
+
+            except Exception:
+                remote.send((False, traceback.format_exc()))
+            else:
+                remote.send((True, result))
+
+    except (KeyboardInterrupt, EOFError):
+        pass
+
+    finally:
+        for env in envs:
+            env.close()
+        remote.close()
+
+class SubprocVecEnv:
+    """
+    Batch of environments stepped in parallel by worker processes, each
+    running a shard of envs_per_worker environments. Observation images,
+    directions, rewards and dones are written by the workers directly
+    into shared memory arrays, so only the actions, infos and missions of
+    reset environments go through the pipes.
+
+    This is meant for environments with custom dynamics which can't be
+    simulated by VecMiniGridEnv. Environments are reset automatically at
+    the end of episodes: the observation returned is then the first
+    observation of the new episode, and the last observation of the
+    episode is in info['terminal_observation']. Call close() to shut the
+    workers down.
+    """
+
+    def __init__(self, env_fns, envs_per_worker=1, start_method=None):
+        assert len(env_fns) > 0
+        assert envs_per_worker > 0
+
+        self.num_envs = len(env_fns)
+        self.closed = False
+
+        # Get the spaces from a throwaway environment
+        env = env_fns[0]()
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+        env.close()
+
+        image_shape = self.observation_space.spaces['image'].shape
+        self.buffers = SubprocVecEnv.alloc_buffers(self.num_envs, image_shape)
+        self.images, self.directions, self.rewards, self.dones = SubprocVecEnv.buffer_arrays(self.buffers)
+        self.missions = [None] * self.num_envs
+
+        ctx = mp.get_context(start_method)
+
+        self.remotes = []
+        self.processes = []
+        self.shards = []
+
+        for start in range(0, self.num_envs, envs_per_worker):
+            stop = min(start + envs_per_worker, self.num_envs)
+            remote, work_remote = ctx.Pipe()
+
+            process = ctx.Process(
+                target=subproc_worker,
+                args=(work_remote, remote, env_fns[start:stop], start, self.buffers),
+                daemon=True
+            )
+            process.start()
+            work_remote.close()
+
+            self.remotes.append(remote)
+            self.processes.append(process)
+            self.shards.append((start, stop))
+
+    @classmethod
+    def make(cls, env_id, num_envs, envs_per_worker=1, seed=None, start_method=None):
+        """
+        Create a batch of environments from a registered environment id,
+        seeded with seed, seed + 1, etc. if seed is given
+        """
+
+        env_fns = [
+            partial(make_env, env_id, None if seed is None else seed + i)
+            for i in range(num_envs)
+        ]
+
+        return cls(env_fns, envs_per_worker, start_method)
+
+    @staticmethod
+    def alloc_buffers(num_envs, image_shape):
+        """
+        Allocate the shared memory buffers of the observations,
+        rewards and dones of num_envs environments
+        """
+
+        return (
+            mp.RawArray('B', int(num_envs * np.prod(image_shape))),
+            mp.RawArray('q', num_envs),
+            mp.RawArray('d', num_envs),
+            mp.RawArray('B', num_envs),
+            (num_envs,) + tuple(image_shape)
+        )
+
+    @staticmethod
+    def buffer_arrays(buffers):
+        """
+        Get NumPy views of the shared memory buffers
+        """
+
+        images, directions, rewards, dones, shape = buffers
+
+        return (
+            np.frombuffer(images, dtype=np.uint8).reshape(shape),
+            np.frombuffer(directions, dtype=np.int64),
+            np.frombuffer(rewards, dtype=np.float64),
+            np.frombuffer(dones, dtype=np.bool_)
+        )
+
+    def send(self, cmd, data=None):
+        for remote in self.remotes:
+            remote.send((cmd, data))
+
+    def recv(self):
+        results = []
+        errors = []
+
+        for remote in self.remotes:
+            ok, result = remote.recv()
+            if ok:
+                results.append(result)
+            else:
+                errors.append(result)
+
+        if errors:
+            raise RuntimeError('error in worker process:\n' + errors[0])
+
+        return results
+
+    def gen_obs(self, copy=True):
+        """
+        Current observations, as a dictionary with stacked 'image' and
+        'direction' arrays and a list of 'mission' strings. Without copy,
+        the arrays are views of the shared buffers, which are overwritten
+        by the next step.
+        """
+
+        return {
+            'image': self.images.copy() if copy else self.images,
+            'direction': self.directions.copy() if copy else self.directions,
+            'mission': list(self.missions)
+        }
+
+    def reset(self, copy=True):
+        self.send('reset')
+        for missions in self.recv():
+            for i, mission in missions.items():
+                self.missions[i] = mission
+
+        return self.gen_obs(copy)
+
+    def step_async(self, actions):
+        actions = [int(a) for a in actions]
+        assert len(actions) == self.num_envs
+
+        for remote, (start, stop) in zip(self.remotes, self.shards):
+            remote.send(('step', actions[start:stop]))
+
+    def step_wait(self, copy=True):
+        infos = []
+        for shard_infos, missions in self.recv():
+            infos.extend(shard_infos)
+            for i, mission in missions.items():
+                self.missions[i] = mission
+
+        rewards = self.rewards.copy() if copy else self.rewards
+        dones = self.dones.copy() if copy else self.dones
+
+        return self.gen_obs(copy), rewards, dones, infos
+
+    def step(self, actions, copy=True):
+        self.step_async(actions)
+        return self.step_wait(copy)
+
+    def seed(self, seed=None):
+        for remote, (start, stop) in zip(self.remotes, self.shards):
+            seeds = [None if seed is None else seed + i for i in range(start, stop)]
+            remote.send(('seed', seeds))
+        return [s for shard in self.recv() for s in shard]
+
+    def env_method(self, name, *args, **kwargs):
+        """
+        Call a method on all the environments and return the results
+        """
+
+        self.send('call', (name, args, kwargs))
+        return [r for shard in self.recv() for r in shard]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        for remote in self.remotes:
+            try:
+                remote.send(('close', None))
+            except (BrokenPipeError, EOFError):
+                pass
+
+        for remote, process in zip(self.remotes, self.processes):
+            try:
+                if remote.poll(5):
+                    remote.recv()
+            except (BrokenPipeError, EOFError, ConnectionResetError):
+                pass
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            remote.close()
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
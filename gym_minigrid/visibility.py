@@ -0,0 +1,200 @@
+from collections import OrderedDict
+import numpy as np
+
+def pack_rows(bits):
+    """
+    Pack a boolean array of shape (width, height) into a list of
+    integers, one per row j, where bit i is set if bits[i, j] is set
+    """
+
+    width = bits.shape[0]
+
+    # Fall back to Python integers for rows that don't fit in 63 bits
+    dtype = np.int64 if width < 63 else object
+    weights = np.array([1 << i for i in range(width)], dtype=dtype)
+
+    return bits.T.astype(dtype).dot(weights).tolist()
+
+def unpack_rows(rows, width):
+    """
+    Unpack a list of per-row integers into a boolean array
+    of shape (width, len(rows))
+    """
+
+    dtype = np.int64 if width < 63 else object
+    rows = np.array(rows, dtype=dtype)
+    shifts = np.arange(width)
+
+    if dtype is object:
+        shifts = shifts.astype(object)
+
+    return ((rows[None, :] >> shifts[:, None]) & 1).astype(bool)
+
+def _fill_right(seen, clear, full, width):
+    """
+    Propagate visibility towards increasing i within a row: a cell is
+    visible if it is seen, or if the cell to its left is visible and
+    transparent. This is a Kogge-Stone prefix scan over the row bits.
+    """
+
+    prop = (clear << 1) & full
+    shift = 1
+    while shift < width:
+        seen |= prop & (seen << shift)
+        prop &= prop << shift
+        shift *= 2
+    return seen & full
+
+def _fill_left(seen, clear, width):
+    """
+    Propagate visibility towards decreasing i within a row: a cell is
+    visible if it is seen, or if the cell to its right is visible and
+    transparent.
+    """
+
+    prop = clear >> 1
+    shift = 1
+    while shift < width:
+        seen |= prop & (seen >> shift)
+        prop &= prop >> shift
+        shift *= 2
+    return seen
+
+def vis_rows(clear_rows, width, agent_pos):
+    """
+    Compute the packed visibility mask rows from the packed transparency
+    rows of a view, with the agent located at agent_pos.
+
+    This reproduces the cell-by-cell sweep originally done in
+    Grid.process_vis: rows are processed from the bottom up, and within
+    each row, visibility spreads to the right, then to the left, through
+    transparent cells. Visible transparent cells also make the cells
+    diagonally and directly above them visible, in the direction of the
+    pass they were visited in.
+    """
+
+    height = len(clear_rows)
+    full = (1 << width) - 1
+
+    # Cells which propagate upward in the rightward/leftward passes
+    right_cells = full >> 1
+    left_cells = full & ~1
+
+    rows = [0] * height
+    seen = 0
+
+    for j in reversed(range(height)):
+        if j == agent_pos[1]:
+            seen |= 1 << agent_pos[0]
+
+        clear = clear_rows[j]
+
+        # Rightward pass, then leftward pass
+        after_right = _fill_right(seen, clear, full, width)
+        after_left = _fill_left(after_right, clear, width)
+        rows[j] = after_left
+
+        # Cells made visible in the row above
+        up_right = after_right & clear & right_cells
+        up_left = after_left & clear & left_cells
+        seen = (up_right | (up_right << 1) | up_left | (up_left >> 1)) & full
+
+    return rows
+
+def compute_vis_mask(opaque, agent_pos):
+    """
+    Compute the visibility mask of a view given a boolean opacity array
+    of shape (width, height) and the position of the agent in the view
+    """
+
+    width, height = opaque.shape
+    clear_rows = pack_rows(~opaque)
+    rows = vis_rows(clear_rows, width, agent_pos)
+    return unpack_rows(rows, width)
+
+def compute_vis_masks(opaque, agent_pos):
+    """
+    Compute the visibility masks of a batch of views given a boolean
+    opacity array of shape (N, width, height), with the agent located
+    at the same position agent_pos in every view. The packed rows of all
+    the views are processed at once, as arrays of 64-bit integers.
+    """
+
+    num_views, width, height = opaque.shape
+    assert width < 63
+
+    weights = np.array([1 << i for i in range(width)], dtype=np.int64)
+    clear_rows = np.einsum('nij,i->jn', (~opaque).astype(np.int64), weights)
+
+    rows = vis_rows(list(clear_rows), width, agent_pos)
+    rows = np.stack(np.broadcast_arrays(*rows), axis=1)
+
+    shifts = np.arange(width)
+    return ((rows[:, None, :] >> shifts[None, :, None]) & 1).astype(bool)
+
+class VisCache:
+    """
+    Bounded cache of visibility masks, keyed by the packed opacity
+    bitmask of the view and the position of the agent in the view.
+
+    For a given view size, the visibility mask only depends on which
+    cells of the view are opaque, and the same occlusion patterns recur
+    very often, so most masks can be looked up instead of recomputed.
+    The least recently used masks are evicted once max_size is reached.
+    Cached masks are read-only.
+    """
+
+    def __init__(self, max_size=8192):
+        assert max_size > 0
+        self.max_size = max_size
+        self.masks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.masks)
+
+    def clear(self):
+        """
+        Remove all the cached masks and reset the counters
+        """
+
+        self.masks.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_mask(self, opaque, agent_pos):
+        """
+        Get the visibility mask for a view given its opacity array
+        """
+
+        key = (opaque.shape, tuple(agent_pos), np.packbits(opaque).tobytes())
+
+        mask = self.masks.get(key)
+        if mask is not None:
+            self.hits += 1
+            self.masks.move_to_end(key)
+            return mask
+
+        self.misses += 1
+        mask = compute_vis_mask(opaque, agent_pos)
+        mask.flags.writeable = False
+
+        self.masks[key] = mask
+        if len(self.masks) > self.max_size:
+            self.masks.popitem(last=False)
+
+        return mask
+
+    def warm(self, opaques, agent_pos):
+        """
+        Pre-compute the masks for an iterable of opacity arrays
+        """
+
+        hits, misses = self.hits, self.misses
+
+        for opaque in opaques:
+            self.get_mask(opaque, agent_pos)
+
+        # Pre-warming doesn't count towards the statistics
+        self.hits, self.misses = hits, misses
@@ -1,27 +1,144 @@
 import math
 import operator
 from functools import reduce
+from collections import OrderedDict
 
 import numpy as np
 import gym
 from gym import error, spaces, utils
 from .minigrid import OBJECT_TO_IDX, COLOR_TO_IDX, STATE_TO_IDX
 
+def reset_to_state(env, state):
+    """
+    Reset an environment through its wrappers, restoring a snapshot taken
+    with get_state() on the unwrapped environment instead of generating a
+    new layout. The wrappers see a regular reset, so their own reset
+    logic runs and the observation returned is the wrapped one.
+    """
+
+    base = env.unwrapped
+
+    def restore(**kwargs):
+        base.set_state(state)
+        return base.gen_obs()
+
+    # Wrappers call reset() on the environment they wrap, so shadowing
+    # the method on the unwrapped environment intercepts the chain
+    base.reset = restore
+    try:
+        return env.reset()
+    finally:
+        del base.reset
+
+class LayoutCache:
+    """
+    Bounded cache of the state of an environment right after it was reset
+    with a given seed, so that resetting it again with the same seed
+    restores the generated layout instead of generating it from scratch.
+    Restored states are identical to freshly generated ones, including
+    the state of the random number generator. The least recently used
+    layouts are evicted once max_size layouts are cached.
+
+    The episode state is saved with get_state() on the unwrapped
+    environment, and restored with reset_to_state(), so the wrappers
+    around it are reset as usual and the first observation goes through
+    them. The configuration of the environment is not cached, changes
+    made to it between resets are kept.
+    """
+
+    def __init__(self, max_size=1024):
+        assert max_size > 0
+        self.max_size = max_size
+        self.layouts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.layouts)
+
+    @staticmethod
+    def check_env(env):
+        """
+        Check that the layouts of an environment can be cached
+        """
+
+        if not hasattr(env.unwrapped, 'get_state'):
+            raise ValueError('%s does not support snapshots' % type(env.unwrapped).__name__)
+
+    def reset(self, env, seed):
+        """
+        Seed and reset an environment, restoring the layout if it
+        was generated before
+        """
+
+        state = self.layouts.get(seed)
+
+        if state is not None:
+            self.hits += 1
+            self.layouts.move_to_end(seed)
+            return reset_to_state(env, state)
+
+        self.misses += 1
+        env.seed(seed)
+        obs = env.reset()
+
+        self.layouts[seed] = env.unwrapped.get_state()
+        if len(self.layouts) > self.max_size:
+            self.layouts.popitem(last=False)
+            self.evictions += 1
+
+        return obs
+
+    def clear(self):
+        """
+        Remove all the cached layouts and reset the counters
+        """
+
+        self.layouts.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            'size': len(self.layouts),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
 class ReseedWrapper(gym.core.Wrapper):
     """
     Wrapper to always regenerate an environment with the same set of seeds.
     This can be used to force an environment to always keep the same
     configuration when reset.
+
+    With cache_size, the layouts generated for up to cache_size seeds are
+    kept in a LayoutCache, and restored instead of being generated again.
+    Layouts are cached by seed only, so reset() then takes no arguments.
     """
 
-    def __init__(self, env, seeds=[0], seed_idx=0):
+    def __init__(self, env, seeds=[0], seed_idx=0, cache_size=None):
         self.seeds = list(seeds)
         self.seed_idx = seed_idx
         super().__init__(env)
 
+        self.layout_cache = None
+        if cache_size is not None:
+            LayoutCache.check_env(env)
+            self.layout_cache = LayoutCache(cache_size)
+
     def reset(self, **kwargs):
         seed = self.seeds[self.seed_idx]
         self.seed_idx = (self.seed_idx + 1) % len(self.seeds)
+
+        if self.layout_cache is not None:
+            if kwargs:
+                raise ValueError('reset arguments are not supported with a layout cache')
+            return self.layout_cache.reset(self.env, seed)
+
         self.env.seed(seed)
         return self.env.reset(**kwargs)
 
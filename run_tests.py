@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
+import os
+import math
 import random
 import numpy as np
 import gym
 from gym_minigrid.register import env_list
-from gym_minigrid.minigrid import Grid, OBJECT_TO_IDX
+from gym_minigrid.minigrid import *
+from gym_minigrid.visibility import compute_vis_mask
+from gym_minigrid.hashing import agent_key
+from gym_minigrid.rendering import *
 
 # Test specifically importing a specific environment
 from gym_minigrid.envs import DoorKeyEnv
@@ -128,6 +133,16 @@ for env_idx, env_name in enumerate(env_list):
         # This should not fail either
         ImgObsWrapper(env)
 
+# Reward ranges can be computed without constructing the environments
+from gym_minigrid.envs import GiftsEnv, KeyGoalEnv, GoalKeyOptionalEnv, DoorKeyOptionalEnv
+for env_cls, kwargs in [
+    (GiftsEnv, dict(gift_reward=[-1, 5])),
+    (KeyGoalEnv, dict(key_reward=2)),
+    (GoalKeyOptionalEnv, dict(key_reward=4., goal_reward=0.5)),
+    (DoorKeyOptionalEnv, dict(door_reward=2., goal_reward=1.5)),
+]:
+    assert env_cls.get_reward_range(**kwargs) == env_cls(**kwargs).reward_range
+
 ##############################################################################
 
 print('testing agent_sees method')
@@ -151,3 +166,1120 @@ for i in range(0, 500):
     assert agent_sees_goal == goal_visible
     if done:
         env.reset()
+
+##############################################################################
+
+print('testing array-backed grid storage')
+grid = Grid(5, 5)
+grid.wall_rect(0, 0, 5, 5)
+door = Door('yellow', is_locked=True)
+grid.set(2, 2, door)
+assert grid.get(2, 2) is door
+assert grid.get(0, 0).type == 'wall'
+assert grid.get(1, 1) is None
+assert door in grid
+assert ('yellow', 'door') in grid
+
+# In-place changes to objects must be reflected in the encoding
+door.is_locked = False
+door.is_open = True
+assert grid.encode()[2, 2, 2] == STATE_TO_IDX['open']
+
+# Slicing pads with walls and keeps object identity
+sub = grid.slice(1, 1, 5, 5)
+assert sub.get(1, 1) is door
+assert sub.get(4, 4).type == 'wall'
+assert sub.rotate_left().get(1, 3) is door
+
+##############################################################################
+
+print('testing vectorized visibility against the reference sweep')
+
+def process_vis_ref(opaque, agent_pos):
+    """Cell-by-cell visibility sweep, as originally done by Grid.process_vis"""
+    width, height = opaque.shape
+    mask = np.zeros(shape=(width, height), dtype=bool)
+    mask[agent_pos[0], agent_pos[1]] = True
+    for j in reversed(range(0, height)):
+        for i in range(0, width-1):
+            if not mask[i, j] or opaque[i, j]:
+                continue
+            mask[i+1, j] = True
+            if j > 0:
+                mask[i+1, j-1] = True
+                mask[i, j-1] = True
+        for i in reversed(range(1, width)):
+            if not mask[i, j] or opaque[i, j]:
+                continue
+            mask[i-1, j] = True
+            if j > 0:
+                mask[i-1, j-1] = True
+                mask[i, j-1] = True
+    return mask
+
+rng = np.random.RandomState(0)
+for view_size in range(3, 22):
+    for density in (0.1, 0.3, 0.6):
+        for _ in range(20):
+            opaque = rng.uniform(size=(view_size, view_size)) < density
+            agent_pos = (view_size // 2, view_size - 1)
+            assert np.array_equal(
+                compute_vis_mask(opaque, agent_pos),
+                process_vis_ref(opaque, agent_pos)
+            )
+
+# Non-square views and arbitrary agent positions
+for _ in range(200):
+    width, height = rng.randint(3, 70, size=2)
+    opaque = rng.uniform(size=(width, height)) < 0.3
+    agent_pos = (rng.randint(0, width), rng.randint(0, height))
+    assert np.array_equal(
+        compute_vis_mask(opaque, agent_pos),
+        process_vis_ref(opaque, agent_pos)
+    )
+
+##############################################################################
+
+print('testing the visibility mask cache')
+env = gym.make('MiniGrid-FourRooms-v0')
+vis_cache = env.unwrapped.vis_cache
+vis_cache.clear()
+env.unwrapped.warm_vis_cache()
+assert len(vis_cache) > 0 and vis_cache.hits == 0 and vis_cache.misses == 0
+env.reset()
+for i in range(100):
+    obs, _, done, _ = env.step(random.randint(0, 2))
+    grid = env.unwrapped.gen_view_grid()
+    vis_mask = compute_vis_mask(grid.opacity(), (3, 6))
+    assert np.array_equal(env.unwrapped.gen_obs_grid()[1], vis_mask)
+    if done:
+        env.reset()
+assert vis_cache.hits > 0
+
+# The masks returned by gen_obs_grid() can be written to, without
+# affecting the cached masks
+_, vis_mask = env.unwrapped.gen_obs_grid()
+vis_mask[:] = False
+assert env.unwrapped.gen_obs_grid()[1].any()
+
+##############################################################################
+
+print('testing gather-based view extraction')
+env = gym.make('MiniGrid-KeyCorridorS3R3-v0').unwrapped
+for view_size in range(3, 22):
+    env.agent_view_size = view_size
+    env.reset()
+    for i in range(20):
+        env.step(random.randint(0, env.action_space.n - 1))
+
+        # Reference view, sliced and rotated from the full grid
+        topX, topY, _, _ = env.get_view_exts()
+        ref = env.grid.slice(topX, topY, view_size, view_size)
+        for _ in range(env.agent_dir + 1):
+            ref = ref.rotate_left()
+
+        view = env.gen_view_grid()
+        assert np.array_equal(view.encode(), ref.encode())
+        assert all(view.get(*pos) is v for pos, v in ref.objs.items())
+
+##############################################################################
+
+print('testing environment state snapshots')
+
+def rollout(env, actions):
+    trace = []
+    for action in actions:
+        obs, reward, done, info = env.step(action)
+        trace.append((obs['image'], env.grid.encode(), tuple(env.agent_pos), env.agent_dir, done))
+        if done:
+            obs = env.reset()
+            trace.append((obs['image'], env.grid.encode()))
+    return trace
+
+for env_name in env_list:
+    env = gym.make(env_name)
+    env.reset()
+    rollout(env, [random.randint(0, env.action_space.n - 1) for _ in range(10)])
+
+    state = env.get_state()
+    actions = [random.randint(0, env.action_space.n - 1) for _ in range(40)]
+    trace1 = rollout(env, actions)
+
+    # Restoring twice must replay the exact same trajectory
+    for _ in range(2):
+        env.set_state(state)
+        trace2 = rollout(env, actions)
+        assert len(trace1) == len(trace2)
+        for t1, t2 in zip(trace1, trace2):
+            assert all(np.array_equal(a, b) for a, b in zip(t1, t2)), env_name
+
+# Objects inside boxes are restored too
+env = gym.make('MiniGrid-Empty-5x5-v0').unwrapped
+env.reset()
+key = Key('red')
+box = Box('blue', contains=Box('grey', contains=key))
+env.grid.set(2, 1, box)
+state = env.get_state()
+box.contains.color = 'green'
+key.color = 'yellow'
+env.set_state(state)
+assert env.grid.get(2, 1).contains.color == 'grey' and key.color == 'red'
+
+# The same holds for a carried box
+env.carrying = box
+state = env.get_state()
+key.cur_pos = (3, 3)
+env.set_state(state)
+assert key.cur_pos is None
+
+# The configuration of the environment is not part of snapshots
+state = env.get_state()
+env.max_steps = 3
+env.agent_view_size = 5
+env.set_state(state)
+assert env.max_steps == 3 and env.gen_obs()['image'].shape == (5, 5, 3)
+
+##############################################################################
+
+print('testing incremental state hashing')
+
+def full_hash(env):
+    """Hash of the state recomputed from scratch"""
+    grid = Grid.decode(env.grid.encode())[0]
+    h = grid.hash() ^ agent_key(env.agent_pos, env.agent_dir)
+    if env.carrying is not None:
+        h ^= Grid.carried_obj_key(env.carrying)
+    return h
+
+for env_name in ['MiniGrid-DoorKey-8x8-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0', 'MiniGrid-KeyCorridorS3R3-v0']:
+    env = gym.make(env_name).unwrapped
+    env.hash_in_info = True
+    env.reset()
+    hashes = {}
+    for i in range(300):
+        obs, _, done, info = env.step(random.randint(0, env.action_space.n - 1))
+        assert info['state_hash'] == full_hash(env)
+        assert info['state_hash'] == env.state_hash
+
+        # Equal hashes should mean equal states
+        key = (env.grid.encode().tobytes(), tuple(env.agent_pos), env.agent_dir,
+               env.carrying.encode() if env.carrying else None)
+        assert hashes.setdefault(env.state_hash, key) == key
+        if done:
+            env.reset()
+
+# The contents of boxes are part of the hash
+grid = Grid(5, 5)
+grid.set(2, 2, Box('red'))
+empty_hash = grid.hash()
+grid.set(2, 2, Box('red', contains=Key('blue')))
+key_hash = grid.hash()
+grid.set(2, 2, Box('red', contains=Ball('blue')))
+assert len({empty_hash, key_hash, grid.hash()}) == 3
+grid.get(2, 2).contains = None
+grid.update(2, 2)
+assert grid.hash() == empty_hash
+
+# Objects modified in place are picked up by update() and sync()
+door = Door('yellow')
+grid.set(1, 1, door)
+closed_hash = grid.hash()
+door.is_open = True
+grid.sync()
+open_hash = grid.hash()
+assert open_hash != closed_hash
+assert open_hash == Grid.decode(grid.encode())[0].hash()
+grid.set(1, 1, None)
+grid.set(1, 1, door)
+assert grid.hash() == open_hash
+
+# Changes made outside of step(), without update() or sync(), are seen too
+door.is_open = False
+assert grid.hash() == closed_hash
+grid.get(2, 2).contains = Key('green')
+ref_grid = grid.copy()
+ref_grid.cell_hash = None
+assert grid.hash() == ref_grid.hash() != closed_hash
+env = gym.make('MiniGrid-Empty-8x8-v0').unwrapped
+env.reset()
+env.state_hash
+env.put_obj(Door('red'), 3, 3)
+assert env.state_hash == full_hash(env)
+env.grid.get(3, 3).is_open = True
+assert env.state_hash == full_hash(env)
+
+# So are the contents of a carried box
+env.carrying = Box('red')
+empty_hash = env.state_hash
+env.carrying.contains = Key('blue')
+key_hash = env.state_hash
+env.carrying.contains = Ball('blue')
+assert len({empty_hash, key_hash, env.state_hash}) == 3
+env.carrying.contains = None
+assert env.state_hash == empty_hash
+
+##############################################################################
+
+print('testing vectorized shape rasterization')
+shapes = [
+    point_in_rect(0.12, 0.88, 0.47, 0.53),
+    point_in_circle(0.56, 0.28, 0.190),
+    point_in_line(0.1, 0.3, 0.3, 0.4, r=0.03),
+    rotate_fn(point_in_triangle((0.12, 0.19), (0.87, 0.50), (0.12, 0.81)), 0.5, 0.5, 0.5 * math.pi),
+]
+for fn in shapes:
+    for size in (7, 24, 48):
+        img = np.zeros(shape=(size, size, 3), dtype=np.uint8)
+        fill_coords(img, fn, (255, 0, 0))
+        for y in range(size):
+            for x in range(size):
+                inside = fn((x + 0.5) / size, (y + 0.5) / size)
+                assert (img[y, x, 0] == 255) == inside
+
+##############################################################################
+
+print('testing tile atlas')
+import tempfile
+from gym_minigrid.atlas import TileAtlas, NO_AGENT
+
+cache_dir = tempfile.mkdtemp()
+atlas = TileAtlas.get(tile_size=8, cache_dir=cache_dir)
+assert TileAtlas.loaded[(8, 3)] is atlas
+
+# The atlas should be loaded back from disk
+del TileAtlas.loaded[(8, 3)]
+assert np.array_equal(TileAtlas.get(tile_size=8, cache_dir=cache_dir).tiles, atlas.tiles)
+
+objs = [None, Wall(), Floor('blue'), Lava(), Goal(), Key('red'), Ball('purple'), Box('grey'),
+        Gift('yellow'), Door('green'), Door('green', is_open=True), Door('green', is_locked=True)]
+for obj in objs:
+    for agent_dir in [None, 0, 1, 2, 3]:
+        for highlight in [False, True]:
+            tile = Grid.draw_tile(obj, agent_dir, highlight, 8).astype(np.uint8)
+            assert np.array_equal(atlas.tile(obj, agent_dir, highlight), tile)
+
+# Agent cells of fully observable encodings store the direction as the state
+agent_tile = atlas.flat_tiles[TileAtlas.index(OBJECT_TO_IDX['agent'], 0, 3, NO_AGENT, True)]
+assert np.array_equal(agent_tile, Grid.draw_tile(None, 3, True, 8).astype(np.uint8))
+
+# Rendering with the atlas should give the same frames
+env = gym.make('MiniGrid-KeyCorridorS3R3-v0')
+env.reset()
+img = env.render('rgb_array', tile_size=8)
+Grid.tile_cache.clear()
+del TileAtlas.loaded[(8, 3)]
+assert np.array_equal(env.render('rgb_array', tile_size=8), img)
+
+# Atlases are only written to disk if a cache directory is given
+cache_dir = os.environ.pop('MINIGRID_CACHE_DIR', None)
+atlas = TileAtlas.get(tile_size=7)
+assert not os.path.exists(os.path.join(os.path.expanduser('~'), '.cache', 'gym_minigrid', TileAtlas.file_name(7)))
+if cache_dir is not None:
+    os.environ['MINIGRID_CACHE_DIR'] = cache_dir
+
+# Rendering without a loaded atlas draws the tiles on demand, without
+# building atlases, and gives the same frames as rendering with one
+num_loaded = len(TileAtlas.loaded)
+for tile_size in range(2, 20):
+    img = env.render('rgb_array', tile_size=tile_size)
+    assert len(TileAtlas.loaded) == num_loaded
+obs = env.gen_obs()['image']
+obs_img = env.get_obs_render(obs, tile_size=19)
+TileAtlas.get(tile_size=19)
+assert np.array_equal(env.render('rgb_array', tile_size=19), img)
+assert np.array_equal(env.get_obs_render(obs, tile_size=19), obs_img)
+
+# Loading atlases at many tile sizes keeps a bounded number of them
+for tile_size in range(2, 14):
+    TileAtlas.get(tile_size=tile_size)
+assert len(TileAtlas.loaded) <= TileAtlas.loaded.max_size
+assert TileAtlas.loaded.nbytes <= TileAtlas.loaded.max_bytes
+
+##############################################################################
+
+print('testing single-gather grid rendering')
+
+def render_ref(grid, tile_size, agent_pos, agent_dir, highlight_mask):
+    img = np.zeros(shape=(grid.height * tile_size, grid.width * tile_size, 3), dtype=np.uint8)
+    for j in range(grid.height):
+        for i in range(grid.width):
+            agent_here = agent_pos is not None and tuple(agent_pos) == (i, j)
+            img[j*tile_size:(j+1)*tile_size, i*tile_size:(i+1)*tile_size] = Grid.render_tile(
+                grid.get(i, j),
+                agent_dir=agent_dir if agent_here else None,
+                highlight=highlight_mask[i, j],
+                tile_size=tile_size
+            )
+    return img
+
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-LavaCrossingS9N1-v0', 'MiniGrid-ObstructedMaze-2Dlhb-v0']:
+    env = gym.make(env_name).unwrapped
+    env.reset()
+    for i in range(20):
+        env.step(random.randint(0, env.action_space.n - 1))
+        highlight_mask = np.random.randint(0, 2, size=(env.width, env.height)).astype(bool)
+        for tile_size in [5, 8]:
+            img = env.grid.render(tile_size, env.agent_pos, env.agent_dir, highlight_mask)
+            assert np.array_equal(img, render_ref(env.grid, tile_size, env.agent_pos, env.agent_dir, highlight_mask))
+
+        # Decoded partial views contain unseen cells
+        grid, vis_mask = env.gen_obs_grid()
+        agent_pos = (grid.width // 2, grid.height - 1)
+        img = grid.render(8, agent_pos, 3, vis_mask)
+        assert np.array_equal(img, render_ref(grid, 8, agent_pos, 3, vis_mask))
+
+##############################################################################
+
+print('testing bounded tile cache')
+
+cache = TileCache(max_size=3)
+for i in range(5):
+    cache[i] = np.zeros((2, 2, 3), dtype=np.uint8)
+assert len(cache) == 3 and cache.evictions == 2
+assert cache.get(0) is None and cache.get(4) is not None
+assert cache.hits == 1 and cache.misses == 1
+
+# The most recently used tiles are kept
+cache.get(2)
+cache[5] = np.zeros((2, 2, 3), dtype=np.uint8)
+assert cache.keys() == [4, 2, 5]
+
+# The byte limit is enforced too
+cache = TileCache(max_bytes=100)
+for i in range(5):
+    cache[i] = np.zeros((4, 4, 3), dtype=np.uint8)
+assert len(cache) == 2 and cache.nbytes == 96
+
+# Rendering through a small cache gives the same frames
+env = gym.make('MiniGrid-KeyCorridorS3R3-v0')
+env.reset()
+img = env.render('rgb_array', tile_size=8)
+obs_img = env.get_obs_render(env.gen_obs()['image'], tile_size=8)
+tile_cache = Grid.tile_cache
+Grid.tile_cache = TileCache(max_size=4)
+assert np.array_equal(env.render('rgb_array', tile_size=8), img)
+assert np.array_equal(env.get_obs_render(env.gen_obs()['image'], tile_size=8), obs_img)
+assert np.array_equal(Grid.render_tile(Key('red'), 1, True, 8), Grid.draw_tile(Key('red'), 1, True, 8).astype(np.uint8))
+assert len(Grid.tile_cache) <= 4
+
+# Rendering goes through the tile cache, even with a loaded atlas
+TileAtlas.get(tile_size=8)
+Grid.tile_cache = TileCache(max_size=4)
+env.unwrapped.frame.clear()
+assert np.array_equal(env.render('rgb_array', tile_size=8), img)
+assert len(Grid.tile_cache) <= 4 and Grid.tile_cache.misses > 0
+Grid.tile_cache = tile_cache
+
+##############################################################################
+
+print('testing incremental rendering')
+
+for env_name in ['MiniGrid-MultiRoom-N6-v0', 'MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-Dynamic-Obstacles-6x6-v0']:
+    env = gym.make(env_name).unwrapped
+    env.reset()
+    for i in range(200):
+        _, _, done, _ = env.step(random.randint(0, env.action_space.n - 1))
+        if done:
+            env.reset()
+        tile_size = random.choice([6, 8])
+        highlight = random.random() < 0.5
+        img = env.render('rgb_array', highlight=highlight, tile_size=tile_size)
+
+        # The frame should be the same as one rendered from scratch
+        frame = env.frame
+        env.frame = FrameBuffer()
+        assert np.array_equal(img, env.render('rgb_array', highlight=highlight, tile_size=tile_size))
+        env.frame = frame
+
+    # Frames returned earlier are not modified by later renders
+    img = env.render('rgb_array', tile_size=8)
+    saved = img.copy()
+    env.step(env.actions.left)
+    env.render('rgb_array', tile_size=8)
+    assert env.frame.num_redrawn < env.width * env.height
+    assert np.array_equal(img, saved)
+
+##############################################################################
+
+print('testing highlight mask computation')
+
+def highlight_mask_ref(env):
+    _, vis_mask = env.gen_obs_grid()
+    f_vec = env.dir_vec
+    r_vec = env.right_vec
+    top_left = env.agent_pos + f_vec * (env.agent_view_size-1) - r_vec * (env.agent_view_size // 2)
+    highlight_mask = np.zeros(shape=(env.width, env.height), dtype=bool)
+    for vis_j in range(0, env.agent_view_size):
+        for vis_i in range(0, env.agent_view_size):
+            if not vis_mask[vis_i, vis_j]:
+                continue
+            abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
+            if 0 <= abs_i < env.width and 0 <= abs_j < env.height:
+                highlight_mask[abs_i, abs_j] = True
+    return highlight_mask
+
+for view_size in [3, 4, 7, 8]:
+    env = gym.make('MiniGrid-KeyCorridorS3R3-v0').unwrapped
+    env.agent_view_size = view_size
+    env.reset()
+    for i in range(100):
+        _, _, done, _ = env.step(random.randint(0, env.action_space.n - 1))
+        if done:
+            env.reset()
+
+        # The mask computed by gen_obs() is reused
+        assert env.get_vis_mask() is env.last_vis_mask[2]
+
+        img = env.render('rgb_array', tile_size=4)
+        ref = env.grid.render(4, env.agent_pos, env.agent_dir, highlight_mask_ref(env))
+        assert np.array_equal(img, ref)
+
+# The mask is recomputed when the grid changes
+env = gym.make('MiniGrid-Empty-8x8-v0').unwrapped
+env.reset()
+env.agent_pos, env.agent_dir = (1, 1), 0
+env.gen_obs()
+env.grid.set(3, 1, Wall())
+assert env.get_vis_mask() is not env.last_vis_mask[2]
+assert np.array_equal(env.render('rgb_array', tile_size=4), env.grid.render(4, (1, 1), 0, highlight_mask_ref(env)))
+
+# The mask is recomputed when a door is toggled in place
+env.grid.set(3, 1, Door('yellow'))
+for i in range(3):
+    env.gen_obs()
+    env.grid.get(3, 1).is_open = not env.grid.get(3, 1).is_open
+    assert np.array_equal(env.render('rgb_array', tile_size=4), env.grid.render(4, (1, 1), 0, highlight_mask_ref(env)))
+
+##############################################################################
+
+print('testing direct rendering of observations')
+
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-LavaCrossingS9N1-v0', 'MiniGrid-BlockedUnlockPickup-v0']:
+    env = gym.make(env_name)
+    env = RGBImgPartialObsWrapper(env, tile_size=6)
+    obs = env.reset()
+    for i in range(100):
+        enc = env.unwrapped.gen_obs()['image']
+        grid, vis_mask = Grid.decode(enc)
+        sz = env.unwrapped.agent_view_size
+        ref = grid.render(6, agent_pos=(sz // 2, sz - 1), agent_dir=3, highlight_mask=vis_mask)
+        assert np.array_equal(obs['image'], ref)
+        obs, _, done, _ = env.step(random.randint(0, env.action_space.n - 1))
+        if done:
+            obs = env.reset()
+
+##############################################################################
+
+print('testing batch rendering')
+
+env = gym.make('MiniGrid-DoorKey-6x6-v0')
+env.reset()
+obs, grids, frames = [], [], []
+for i in range(50):
+    o, _, done, _ = env.step(random.randint(0, env.action_space.n - 1))
+    obs.append(o['image'])
+
+    # Fully observable encodings, where the agent cell stores its direction
+    if env.unwrapped.grid.get(*env.agent_pos) is None:
+        grids.append(FullyObsWrapper(env).observation(o)['image'])
+        frames.append(env.render('rgb_array', highlight=False, tile_size=8))
+
+    if done:
+        env.reset()
+obs = np.stack(obs)
+grids = np.stack(grids)
+
+# Partial observations, in chunks
+imgs = render_batch(obs, 8, agent_pos=(3, 6), agent_dir=3, highlight_mask=obs[..., 0] != 0, chunk_size=16)
+assert imgs.shape == (50, 56, 56, 3)
+for o, img in zip(obs, imgs):
+    assert np.array_equal(img, env.get_obs_render(o, tile_size=8))
+
+imgs = render_batch(grids, 8, chunk_size=7)
+assert np.array_equal(imgs, np.stack(frames))
+
+# Without a loaded atlas, the tiles are drawn on demand
+assert (21, 3) not in TileAtlas.loaded
+imgs = render_batch(grids, 21, chunk_size=7)
+assert (21, 3) not in TileAtlas.loaded
+TileAtlas.get(tile_size=21)
+assert np.array_equal(imgs, render_batch(grids, 21))
+
+##############################################################################
+
+print('testing vectorized environment')
+from gym_minigrid.vector import VecMiniGridEnv
+
+for env_name in [
+    'MiniGrid-Empty-5x5-v0',
+    'MiniGrid-DoorKey-5x5-v0',
+    'MiniGrid-FourRooms-v0',
+    'MiniGrid-LockedRoom-v0',
+    'MiniGrid-LavaGapS5-v0',
+    'MiniGrid-SimpleCrossingS9N1-v0',
+    'MiniGrid-LavaCrossingS9N1-v0',
+]:
+    num_envs = 8
+    vec_env = VecMiniGridEnv.make(env_name, num_envs, seed=1000)
+    envs = [gym.make(env_name) for i in range(num_envs)]
+    for i, env in enumerate(envs):
+        env.seed(1000 + i)
+
+    vec_obs = vec_env.reset()
+    obs = [env.reset() for env in envs]
+
+    for step in range(200):
+        for i in range(num_envs):
+            assert np.array_equal(vec_obs['image'][i], obs[i]['image'])
+            assert vec_obs['direction'][i] == obs[i]['direction']
+            assert vec_obs['mission'][i] == obs[i]['mission']
+
+        actions = np.random.randint(0, vec_env.action_space.n, size=num_envs)
+        vec_obs, rewards, dones, infos = vec_env.step(actions)
+
+        for i, env in enumerate(envs):
+            obs[i], reward, done, info = env.step(actions[i])
+            assert math.isclose(rewards[i], reward) and dones[i] == done
+            assert infos[i].get('toggle_succeeded') == info.get('toggle_succeeded')
+
+            # Environments are reset automatically
+            if done:
+                assert np.array_equal(infos[i]['terminal_observation']['image'], obs[i]['image'])
+                obs[i] = env.reset()
+
+# Environments with their own step function, or which aren't MiniGridEnv
+# instances like the multi-phase ones, can't be simulated
+for env_name in ['MiniGrid-Unlock-v0', 'MiniGrid-Dynamic-Obstacles-5x5-v0', 'MiniGrid-KeyGiftsDoor-tiny-v0']:
+    try:
+        VecMiniGridEnv.make(env_name, 2)
+        assert False
+    except ValueError:
+        pass
+
+##############################################################################
+
+print('testing subprocess vectorized environment')
+from functools import partial
+from gym_minigrid.vector import SubprocVecEnv
+
+env_name = 'MiniGrid-PutNear-6x6-N2-v0'
+num_envs = 6
+vec_env = SubprocVecEnv.make(env_name, num_envs, envs_per_worker=4, seed=1000)
+envs = [gym.make(env_name) for i in range(num_envs)]
+for i, env in enumerate(envs):
+    env.seed(1000 + i)
+
+vec_obs = vec_env.reset()
+obs = [env.reset() for env in envs]
+
+for step in range(100):
+    for i in range(num_envs):
+        assert np.array_equal(vec_obs['image'][i], obs[i]['image'])
+        assert vec_obs['direction'][i] == obs[i]['direction']
+        assert vec_obs['mission'][i] == obs[i]['mission']
+
+    actions = np.random.randint(0, vec_env.action_space.n, size=num_envs)
+    vec_obs, rewards, dones, infos = vec_env.step(actions)
+
+    for i, env in enumerate(envs):
+        obs[i], reward, done, info = env.step(actions[i])
+        assert rewards[i] == reward and dones[i] == done
+        if done:
+            obs[i] = env.reset()
+
+vec_env.close()
+assert not any(p.is_alive() for p in vec_env.processes)
+
+# Environments failing to build in a worker raise the error in the parent
+env_fns = [partial(gym.make, env_name), partial(gym.make, 'MiniGrid-NoSuchEnv-v0')]
+vec_env = SubprocVecEnv(env_fns)
+try:
+    vec_env.reset()
+    assert False
+except RuntimeError as e:
+    assert 'NoSuchEnv' in str(e)
+vec_env.close()
+assert not any(p.is_alive() for p in vec_env.processes)
+
+##############################################################################
+
+print('testing reset pool')
+from gym.wrappers import TimeLimit
+from gym_minigrid.pool import ResetPool, ResetPoolWrapper
+
+env_name = 'MiniGrid-MultiRoom-N4-S5-v0'
+pool = ResetPool.make(env_name, seeds=range(50, 60), size=4, num_workers=2)
+env = ResetPoolWrapper(gym.make(env_name), pool)
+ref_env = gym.make(env_name)
+
+for seed in range(50, 60):
+    # Restored layouts match seeding and resetting the environment
+    obs = env.reset()
+    ref_env.seed(seed)
+    ref_obs = ref_env.reset()
+    assert np.array_equal(obs['image'], ref_obs['image'])
+    assert env.unwrapped.grid == ref_env.unwrapped.grid
+    assert env.unwrapped.np_random.randint(1000) == ref_env.unwrapped.np_random.randint(1000)
+
+stats = pool.stats()
+assert stats['generated'] == stats['consumed'] == 10 and stats['ready'] == 0
+pool.close()
+
+# Repeated seeds each get their layout, with statistics read in between
+seeds = [1, 2, 1, 2, 1]
+pool = ResetPool.make(env_name, seeds=seeds, size=3, num_workers=2)
+env = ResetPoolWrapper(gym.make(env_name), pool)
+for seed in seeds:
+    stats = pool.stats()
+    assert stats['in_progress'] >= 0 and stats['ready'] <= len(pool.pending)
+    obs = env.reset()
+    ref_env.seed(seed)
+    ref_obs = ref_env.reset()
+    assert np.array_equal(obs['image'], ref_obs['image'])
+stats = pool.stats()
+assert stats['generated'] == stats['consumed'] == 5
+pool.close()
+
+# Wrappers are reset and transform the restored observations
+env_name = 'MiniGrid-DoorKey-8x8-v0'
+pool = ResetPool.make(env_name, seeds=range(3), size=2)
+env = ResetPoolWrapper(ImgObsWrapper(TimeLimit(gym.make(env_name), max_episode_steps=5)), pool)
+ref_env = ImgObsWrapper(TimeLimit(gym.make(env_name), max_episode_steps=5))
+for seed in range(3):
+    obs = env.reset()
+    ref_env.seed(seed)
+    ref_obs = ref_env.reset()
+    assert np.array_equal(obs, ref_obs)
+    for step in range(5):
+        obs, reward, done, info = env.step(env.actions.left)
+        ref_obs, ref_reward, ref_done, info = ref_env.step(env.actions.left)
+        assert np.array_equal(obs, ref_obs) and done == ref_done
+    assert done
+
+# Reset arguments can't be applied to pre-generated layouts
+try:
+    env.reset(foo=1)
+    assert False
+except ValueError:
+    pass
+pool.close()
+
+# The configuration of the consumer is kept, only the layout is restored
+pool = ResetPool.make(env_name, seeds=range(2), size=2)
+env = ResetPoolWrapper(ViewSizeWrapper(gym.make(env_name), 5), pool)
+for seed in range(2):
+    obs = env.reset()
+    assert env.observation_space.spaces['image'].shape == obs['image'].shape == (5, 5, 3)
+    ref_env.seed(seed)
+    ref_env.reset()
+    assert env.unwrapped.grid == ref_env.unwrapped.grid
+pool.close()
+
+# Layouts generated for a different grid size are rejected
+pool = ResetPool.make('MiniGrid-DoorKey-5x5-v0', seeds=range(1), size=1)
+env = ResetPoolWrapper(gym.make(env_name), pool)
+try:
+    env.reset()
+    assert False
+except ValueError:
+    pass
+pool.close()
+
+##############################################################################
+
+print('testing layout cache')
+
+def make_cached_env(env_name):
+    # Wrappers with reset logic of their own are reset on restored layouts
+    return ImgObsWrapper(TimeLimit(gym.make(env_name), max_episode_steps=15))
+
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0']:
+    for cache_size in [3, 5]:
+        seeds = [3, 1, 4, 1, 5]
+        env = ReseedWrapper(make_cached_env(env_name), seeds, cache_size=cache_size)
+        ref_env = ReseedWrapper(make_cached_env(env_name), seeds)
+
+        for episode in range(20):
+            # Restored layouts match generating them again
+            obs = env.reset()
+            ref_obs = ref_env.reset()
+            assert np.array_equal(obs, ref_obs)
+            assert env.unwrapped.grid == ref_env.unwrapped.grid
+            assert env.unwrapped.agent_dir == ref_env.unwrapped.agent_dir
+            assert np.array_equal(env.unwrapped.agent_pos, ref_env.unwrapped.agent_pos)
+
+            # Episodes modify the grid and draw from the RNG
+            for step in range(random.randint(1, 30)):
+                action = random.randint(0, env.action_space.n - 1)
+                obs, reward, done, info = env.step(action)
+                ref_obs, ref_reward, ref_done, info = ref_env.step(action)
+                assert np.array_equal(obs, ref_obs)
+                assert reward == ref_reward and done == ref_done
+                if done:
+                    break
+
+        stats = env.layout_cache.stats()
+        assert stats['size'] <= cache_size
+        assert stats['hits'] + stats['misses'] == 20
+        assert stats['hits'] > 0 if cache_size >= 4 else stats['evictions'] > 0
+
+        # Reset arguments could change the layout, so they are rejected
+        try:
+            env.reset(foo=1)
+            assert False
+        except ValueError:
+            pass
+
+# Changes to the configuration between resets are not undone by the cache
+env = ReseedWrapper(gym.make('MiniGrid-Empty-8x8-v0'), [0], cache_size=1)
+env.reset()
+env.unwrapped.max_steps = 3
+env.reset()
+assert env.layout_cache.hits == 1 and env.unwrapped.max_steps == 3
+for i in range(3):
+    obs, reward, done, info = env.step(env.unwrapped.actions.left)
+assert done
+
+##############################################################################
+
+print('testing free cell placement')
+from gym_minigrid.roomgrid import reject_next_to
+
+MiniGridEnv.fast_placement = True
+
+for env_name in ['MiniGrid-PutNear-8x8-N3-v0', 'MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-Dynamic-Obstacles-16x16-v0']:
+    env = gym.make(env_name)
+    ref_env = gym.make(env_name)
+
+    for seed in range(10):
+        # Placement is deterministic for a given seed
+        env.seed(seed)
+        env.reset()
+        ref_env.seed(seed)
+        ref_env.reset()
+        assert env.unwrapped.grid == ref_env.unwrapped.grid
+        assert np.array_equal(env.unwrapped.agent_pos, ref_env.unwrapped.agent_pos)
+
+env = gym.make('MiniGrid-Empty-8x8-v0').unwrapped
+for i in range(50):
+    env.reset()
+
+    # Both vectorized and scalar rejection functions are applied
+    pos = env.place_obj(Ball(), top=(2, 2), size=(4, 4), reject_fn=reject_next_to)
+    assert not reject_next_to(env, pos)
+    assert 2 <= pos[0] < 6 and 2 <= pos[1] < 6
+    pos = env.place_obj(Key(), reject_fn=lambda env, pos: pos[0] != 3)
+    assert pos[0] == 3 and env.grid.get(*pos).type == 'key'
+    assert not np.array_equal(pos, env.agent_pos)
+
+# Unsatisfiable placements fail without looping
+env.reset()
+try:
+    env.place_obj(Ball(), top=(0, 0), size=(1, 8))
+    assert False
+except RecursionError:
+    pass
+
+MiniGridEnv.fast_placement = False
+
+##############################################################################
+
+print('testing buffered rng')
+from gym_minigrid.rng import BufferedRNG
+
+# Values don't depend on the block size
+rng = BufferedRNG(7)
+ref_rng = BufferedRNG(7)
+ref_rng.block_size = 5
+ref_rng.fill(rng.block_state)
+for i in range(1000):
+    assert rng.randint(0, 1 + i % 13) == ref_rng.randint(0, 1 + i % 13)
+    assert rng.uniform(-1, 1) == ref_rng.uniform(-1, 1)
+
+# Draws are within bounds and restoring a state replays them
+state = rng.get_state()
+values = [rng.randint(np.int64(3), np.int64(9)) for i in range(1000)]
+assert min(values) == 3 and max(values) == 8
+rng.set_state(state)
+assert values == [rng.randint(3, 9) for i in range(1000)]
+
+MiniGridEnv.buffered_rng = True
+
+for env_name in ['MiniGrid-MultiRoom-N6-v0', 'MiniGrid-LavaCrossingS9N2-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0']:
+    env = gym.make(env_name)
+    ref_env = gym.make(env_name)
+    assert isinstance(env.np_random, BufferedRNG)
+
+    for seed in range(5):
+        # Levels are reproducible from the seed and from snapshots
+        env.seed(seed)
+        env.reset()
+        ref_env.seed(seed)
+        ref_env.reset()
+        assert env.unwrapped.grid == ref_env.unwrapped.grid
+
+        state = env.get_state()
+        ref_state = ref_env.get_state()
+        for i in range(2):
+            env.set_state(state)
+            ref_env.set_state(ref_state)
+            actions = [env.action_space.sample() for i in range(20)]
+            for action in actions:
+                obs, reward, done, info = env.step(action)
+                ref_obs, ref_reward, ref_done, info = ref_env.step(action)
+                assert np.array_equal(obs['image'], ref_obs['image'])
+
+MiniGridEnv.buffered_rng = False
+
+##############################################################################
+
+print('testing union-find room connection')
+from gym_minigrid.roomgrid import RoomGrid, DisjointSet
+
+sets = DisjointSet(5)
+assert sets.union(0, 1) and sets.union(3, 4) and sets.union(1, 4)
+assert not sets.union(0, 3)
+assert sets.num_sets == 2 and sets.find(2) != sets.find(0)
+
+RoomGrid.fast_connect = True
+
+for env_name in ['MiniGrid-KeyCorridorS3R3-v0', 'MiniGrid-KeyCorridorS6R3-v0']:
+    env = gym.make(env_name)
+
+    for seed in range(20):
+        env.seed(seed)
+        env.reset()
+        room_grid = env.unwrapped.room_grid
+
+        # All the rooms are reachable from the agent's room
+        reach = set()
+        stack = [env.unwrapped.room_from_pos(*env.agent_pos)]
+        while stack:
+            room = stack.pop()
+            if room in reach:
+                continue
+            reach.add(room)
+            stack += [room.neighbors[k] for k in range(4) if room.doors[k]]
+        assert len(reach) == len(room_grid) * len(room_grid[0])
+
+        # The locked room only has its locked door
+        for row in room_grid:
+            for room in row:
+                if room.locked:
+                    doors = [door for door in room.doors if door]
+                    assert len(doors) == 1 and doors[0].is_locked
+
+RoomGrid.fast_connect = False
+
+##############################################################################
+
+print('testing constructive multi-room generation')
+from gym_minigrid.envs.multiroom import MultiRoomEnv
+
+MultiRoomEnv.constructive_gen = True
+
+for env_name in ['MiniGrid-MultiRoom-N4-S5-v0', 'MiniGrid-MultiRoom-N6-v0']:
+    env = gym.make(env_name)
+    ref_env = gym.make(env_name)
+
+    for seed in range(50):
+        env.seed(seed)
+        env.reset()
+        ref_env.seed(seed)
+        ref_env.reset()
+        assert env.unwrapped.grid == ref_env.unwrapped.grid
+
+        rooms = env.unwrapped.rooms
+        assert len(rooms) == env.unwrapped.minNumRooms
+        assert env.unwrapped.num_gen_restarts < MultiRoomEnv.max_gen_restarts
+
+        for idx, room in enumerate(rooms):
+            (x, y), (w, h) = room.top, room.size
+            assert x >= 0 and y >= 0 and x + w <= env.width and y + h < env.height
+
+            # Rooms only touch the previous room
+            for other in rooms[:max(idx - 1, 0)]:
+                assert (
+                    x + w < other.top[0] or other.top[0] + other.size[0] <= x or
+                    y + h < other.top[1] or other.top[1] + other.size[1] <= y
+                )
+
+            # Rooms are entered through a door
+            if idx > 0:
+                assert env.unwrapped.grid.get(*room.entryDoorPos).type == 'door'
+
+MultiRoomEnv.constructive_gen = False
+
+##############################################################################
+
+print('testing distance fields and optimal actions')
+from gym_minigrid.distance import DistanceOracle, distance_fields, action_distance_fields
+
+# Distances on a vertical corridor with a door, costing 2 to open and cross
+costs = np.array([[1, 1, 2, 1, np.inf, 1]])
+targets = np.array([[False, False, False, True, False, False]])
+dist = distance_fields(costs, targets)
+assert dist[0].tolist() == [4, 3, 1, 0, np.inf, np.inf]
+action_dist = action_distance_fields(costs[None], targets[None])[0]
+assert action_dist[0, 0].tolist() == [5, 4, 5, 6]
+
+oracle = DistanceOracle()
+
+for env_name in ['MiniGrid-MultiRoom-N4-S5-v0', 'MiniGrid-FourRooms-v0', 'MiniGrid-LavaCrossingS9N2-v0']:
+    envs = [gym.make(env_name) for i in range(4)]
+    for i, env in enumerate(envs):
+        env.seed(i)
+        env.reset()
+
+    # Batched fields match the fields of each environment
+    fields = oracle.get_fields_batch(envs)
+    for env, env_fields in zip(envs, fields):
+        for field, ref_field in zip(env_fields, DistanceOracle().get_fields(env)):
+            assert np.array_equal(field, ref_field)
+
+    # Following the oracle reaches the goal in the predicted number of steps
+    for env in envs:
+        num_steps = oracle.distance(env)
+        for step in range(int(num_steps)):
+            obs, reward, done, info = env.step(oracle.optimal_action(env))
+        assert done and reward > 0
+
+# Opening a door invalidates the cached fields
+env = gym.make('MiniGrid-MultiRoom-N2-S4-v0')
+env.seed(1)
+env.reset()
+door_pos = env.unwrapped.rooms[1].entryDoorPos
+before = oracle.get_fields(env)[2]
+env.unwrapped.grid.get(*door_pos).is_open = True
+after = oracle.get_fields(env)[2]
+assert (after <= before).all() and (after < before).any()
+
+# Targets can be poses, here facing down from the cell above the target
+pose_targets = np.zeros((1, 6, 4), dtype=bool)
+pose_targets[0, 2, 1] = True
+action_dist = action_distance_fields(costs[None], pose_targets[None])[0]
+assert action_dist[0, 0].tolist() == [4, 3, 4, 5]
+assert action_dist[0, 2].tolist() == [1, 0, 1, 2]
+
+##############################################################################
+
+print('testing expert demonstrations')
+import tempfile
+from gym_minigrid.bot import solve
+from gym_minigrid.demos import generate_demos, iter_demos
+
+# The expert solves the tasks needing keys, boxes and moving obstacles
+for env_name in [
+    'MiniGrid-DoorKey-8x8-v0',
+    'MiniGrid-Unlock-v0',
+    'MiniGrid-BlockedUnlockPickup-v0',
+    'MiniGrid-KeyCorridorS3R3-v0',
+    'MiniGrid-ObstructedMaze-1Dlhb-v0',
+    'MiniGrid-KeyGiftsGoal-tiny-v0',
+    'MiniGrid-KeyNoDistractorDoor-v0',
+]:
+    env = gym.make(env_name)
+    for seed in range(3):
+        env.seed(seed)
+        obs = env.reset()
+        observations, actions, rewards, success = solve(env, obs)
+        assert success, (env_name, seed)
+        assert len(observations) == len(actions) == len(rewards)
+
+with tempfile.TemporaryDirectory() as out_dir:
+    stats = generate_demos('MiniGrid-DoorKey-5x5-v0', out_dir, num_seeds=10, shard_size=4)
+    assert stats['num_shards'] == 3 and stats['num_demos'] == 10
+    assert stats['success_rate'] == 1
+
+    # Running again only generates the missing shards, and the last
+    # shard, which had fewer seeds
+    stats = generate_demos('MiniGrid-DoorKey-5x5-v0', out_dir, num_seeds=14, shard_size=4)
+    assert stats['run_demos'] == 6 and stats['num_demos'] == 14
+
+    # Replaying the demonstrations reproduces the observations
+    env = gym.make('MiniGrid-DoorKey-5x5-v0')
+    demos = list(iter_demos(out_dir))
+    assert [demo['seed'] for demo in demos] == list(range(14))
+    for demo in demos[:4]:
+        env.seed(demo['seed'])
+        obs = env.reset()
+        for image, action in zip(demo['images'], demo['actions']):
+            assert np.array_equal(obs['image'], image)
+            obs, reward, done, info = env.step(action)
+        assert done and reward > 0 and np.isclose(reward, demo['rewards'][-1])
+
+##############################################################################
+
+print('testing trajectory store')
+from gym_minigrid.store import TrajectoryRecorder, TrajectoryReader
+
+with tempfile.TemporaryDirectory() as path:
+    # A small capacity makes the arrays grow while recording
+    env = TrajectoryRecorder(gym.make('MiniGrid-DoorKey-5x5-v0'), path, capacity=8)
+    rng = np.random.RandomState(0)
+    episodes = []
+    for episode in range(12):
+        if episode % 3 == 0:
+            env.seed(episode)
+        obs = env.reset()
+        steps = []
+        for step in range(rng.randint(1, 40)):
+            action = rng.randint(env.action_space.n)
+            next_obs, reward, done, info = env.step(action)
+            steps.append((obs, action, reward, done, next_obs))
+            obs = next_obs
+            if done:
+                break
+        episodes.append((episode if episode % 3 == 0 else -1, steps))
+    env.close()
+
+    reader = TrajectoryReader(path)
+    assert reader.num_episodes == len(episodes)
+    assert len(reader) == sum(len(steps) for _, steps in episodes)
+
+    transitions = reader.transitions(np.arange(len(reader)))
+    idx = 0
+    for episode, (seed, steps) in enumerate(episodes):
+        assert reader.episode_bounds(episode) == (idx, idx + len(steps))
+        assert reader.episode(episode)['seed'] == seed
+        for obs, action, reward, done, next_obs in steps:
+            assert np.array_equal(transitions['images'][idx], obs['image'])
+            assert np.array_equal(transitions['next_images'][idx], next_obs['image'])
+            assert transitions['next_directions'][idx] == next_obs['direction']
+            assert reader.missions[transitions['mission_ids'][idx]] == obs['mission']
+            assert transitions['actions'][idx] == action and transitions['dones'][idx] == done
+            assert np.isclose(transitions['rewards'][idx], reward)
+            assert transitions['episode_ids'][idx] == episode
+            idx += 1
+
+    batch = reader.sample(16)
+    assert batch['images'].shape == (16, 7, 7, 3)
+
+    # Single steps can be read too
+    transition = reader.transitions(len(reader) - 1)
+    assert transition['images'].shape == (7, 7, 3) and transition['dones'] == episodes[-1][1][-1][3]
+    assert np.array_equal(transition['next_images'], episodes[-1][1][-1][4]['image'])
+
+    # Episodes are appended to an existing store, and only the episodes
+    # ended when the store was flushed are visible
+    env = TrajectoryRecorder(gym.make('MiniGrid-DoorKey-5x5-v0'), path, flush_every=1)
+    env.seed(100)
+    env.reset()
+    env.step(env.actions.left)
+    env.reset()
+    env.step(env.actions.left)
+    reader = TrajectoryReader(path)
+    assert reader.num_episodes == len(episodes) + 1 and reader.seeds[-1] == 100
+    env.reset()
+    env.close()
+    reader = TrajectoryReader(path)
+    assert reader.num_episodes == len(episodes) + 2
+    assert len(reader) == sum(len(steps) for _, steps in episodes) + 2
+
+    # Closing after a reset doesn't leave an empty episode
+    env = TrajectoryRecorder(gym.make('MiniGrid-DoorKey-5x5-v0'), path)
+    env.reset()
+    env.close()
+    reader = TrajectoryReader(path)
+    assert reader.num_episodes == len(episodes) + 2
+    assert np.all(np.diff(reader.episode_starts.astype(np.int64)) > 0)
@@ -9,6 +9,6 @@ setup(
     packages=['gym_minigrid', 'gym_minigrid.envs'],
     install_requires=[
         'gym>=0.9.6',
-        'numpy>=1.15.0'
+        'numpy>=1.17.0'
     ]
 )